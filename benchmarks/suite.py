@@ -0,0 +1,319 @@
+# -*- coding: utf-8; -*-
+"""Benchmark suite for the stencil language interpreter.
+
+Programs and matrix files are generated deterministically, so results are
+comparable between runs and machines. This module is run by ``paver bench``
+and is not part of the interpreter, so it does not need to be RPython.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import random
+import subprocess
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+GENERATED_DIRECTORY = os.path.join(BENCHMARKS_DIRECTORY, 'generated')
+RESULTS_PATH = os.path.join(BENCHMARKS_DIRECTORY, 'results.json')
+BASELINE_PATH = os.path.join(BENCHMARKS_DIRECTORY, 'baseline.json')
+
+SIZES = [64, 256, 1024, 4096]
+"""Matrix side lengths for the stencil benchmarks."""
+
+RADII = [1, 2]
+"""Stencil radii for the stencil benchmarks."""
+
+PDE_ITERATIONS = 10
+"""Number of stencil applications in each stencil benchmark."""
+
+LOOP_ITERATIONS = 10000000
+"""Number of iterations of the register loop benchmarks."""
+
+PARSE_REALS = 1000000
+"""Number of reals in the literal of the parse benchmark."""
+
+BUILDS = ['untranslated', 'stencil', 'stencil-jit']
+"""Interpreter builds which can be benchmarked."""
+
+UNTRANSLATED_MAX_SIZE = 256
+"""Largest matrix size run by default on the untranslated interpreter, which
+is too slow for the others."""
+
+
+class Benchmark(object):
+    """A generated benchmark program."""
+    def __init__(self, name, size, generate):
+        """:param name: unique name of the benchmark
+        :type name: :class:`str`
+        :param size: matrix side length, or zero if the benchmark doesn't
+            apply a stencil
+        :type size: :class:`int`
+        :param generate: function which writes the program and its matrix
+            files into a directory and returns the program path
+        :type generate: :class:`function`
+        """
+        self.name = name
+        self.size = size
+        self.generate = generate
+
+
+def _write_matrix(path, rows, cols, rng):
+    with open(path, 'w') as matrix_file:
+        for _ in xrange(rows):
+            matrix_file.write(' '.join(
+                '%.6f' % rng.random() for _ in xrange(cols)))
+            matrix_file.write('\n')
+
+
+def _write_program(path, lines):
+    with open(path, 'w') as program_file:
+        program_file.write('\n'.join(lines) + '\n')
+
+
+def _stencil_benchmark(size, radius):
+    name = 'pde-{0}-r{1}'.format(size, radius)
+
+    def generate(directory):
+        rng = random.Random(size * 100 + radius)
+        width = 2 * radius + 1
+        stencil_path = os.path.join(directory, name + '.stencil')
+        matrix_path = os.path.join(directory, name + '.matrix')
+        _write_matrix(stencil_path, width, width, rng)
+        _write_matrix(matrix_path, size, size, rng)
+        program_path = os.path.join(directory, name + '.sl')
+        _write_program(program_path, [
+            'CMX 0 {0} {0}'.format(width),
+            'SMXF 0 "{0}"'.format(stencil_path),
+            'CMX 1 {0} {0}'.format(size),
+            'SMXF 1 "{0}"'.format(matrix_path),
+            'STO 0 0',
+            'ADD 0 1',
+            'PDE 0 1',
+            'BNE 0 {0} -2'.format(PDE_ITERATIONS),
+        ])
+        return program_path
+    return Benchmark(name, size, generate)
+
+
+def _register_loop_benchmark():
+    name = 'register-loop'
+
+    def generate(directory):
+        program_path = os.path.join(directory, name + '.sl')
+        _write_program(program_path, [
+            'STO 0 0',
+            'ADD 0 1',
+            'BNE 0 {0} -1'.format(LOOP_ITERATIONS),
+            'PR 0',
+        ])
+        return program_path
+    return Benchmark(name, 0, generate)
+
+
+def _nested_loop_benchmark():
+    # Both loops branch back to the same bytecode, so neither can be lowered to
+    # a counted loop.
+    name = 'nested-loop'
+
+    def generate(directory):
+        program_path = os.path.join(directory, name + '.sl')
+        _write_program(program_path, [
+            'STO 0 0',
+            'STO 1 0',
+            'ADD 1 1',
+            'BNE 1 1000 -1',
+            'ADD 0 1',
+            'ADD 1 -1000',
+            'BNE 0 {0} -4'.format(LOOP_ITERATIONS // 1000),
+            'PR 0',
+        ])
+        return program_path
+    return Benchmark(name, 0, generate)
+
+
+def _parse_benchmark():
+    name = 'parse-literal'
+
+    def generate(directory):
+        rng = random.Random(PARSE_REALS)
+        program_path = os.path.join(directory, name + '.sl')
+        with open(program_path, 'w') as program_file:
+            program_file.write('CMX 0 1 {0}\nSMX 0'.format(PARSE_REALS))
+            for i in xrange(PARSE_REALS):
+                program_file.write(' %.6f' % rng.random())
+                if i % 16 == 15:
+                    program_file.write('\n')
+            program_file.write('\nSTO 0 1\nPR 0\n')
+        return program_path
+    return Benchmark(name, 0, generate)
+
+
+def get_benchmarks():
+    """Get all benchmarks in the suite.
+
+    :return: the benchmarks
+    :rtype: :class:`list` of :class:`Benchmark`
+    """
+    benchmarks = [_stencil_benchmark(size, radius)
+                  for size in SIZES for radius in RADII]
+    benchmarks.append(_register_loop_benchmark())
+    benchmarks.append(_nested_loop_benchmark())
+    benchmarks.append(_parse_benchmark())
+    return benchmarks
+
+
+def generate(benchmark):
+    """Generate a benchmark's files, unless they already exist.
+
+    :param benchmark: benchmark to generate
+    :type benchmark: :class:`Benchmark`
+    :return: path to the benchmark program
+    :rtype: :class:`str`
+    """
+    directory = os.path.join(GENERATED_DIRECTORY, benchmark.name)
+    stamp_path = os.path.join(directory, 'program')
+    if os.path.exists(stamp_path):
+        with open(stamp_path) as stamp_file:
+            return stamp_file.read()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    program_path = benchmark.generate(directory)
+    # Only written once everything else has been, so that an interrupted
+    # generation is started over.
+    with open(stamp_path, 'w') as stamp_file:
+        stamp_file.write(program_path)
+    return program_path
+
+
+def build_command(build):
+    """Get the command which runs a build, or :data:`None` if it hasn't been
+    translated.
+
+    :param build: one of :data:`BUILDS`
+    :type build: :class:`str`
+    :return: the command, without the program path
+    :rtype: :class:`list` of :class:`str`
+    """
+    if build == 'untranslated':
+        return [sys.executable, '-m', 'stencil_lang.main']
+    executable = os.path.abspath(build)
+    if not os.path.exists(executable):
+        return None
+    return [executable]
+
+
+def time_run(command, program_path, repeat):
+    """Run a program several times and return the fastest wall time.
+
+    :param command: command which runs the interpreter
+    :type command: :class:`list` of :class:`str`
+    :param program_path: path to the program
+    :type program_path: :class:`str`
+    :param repeat: number of runs
+    :type repeat: :class:`int`
+    :return: the fastest time in seconds
+    :rtype: :class:`float`
+    """
+    # Don't let a bytecode cache from a previous run skip the parse.
+    cache_path = program_path + 'c'
+    best = None
+    with open(os.devnull, 'w') as devnull:
+        for _ in xrange(repeat):
+            if os.path.exists(cache_path):
+                os.remove(cache_path)
+            start = time.time()
+            subprocess.check_call(command + [program_path], stdout=devnull)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+    return best
+
+
+def run(builds, repeat, max_size, untranslated_max_size):
+    """Run the suite.
+
+    :param builds: builds to run, see :data:`BUILDS`
+    :type builds: :class:`list` of :class:`str`
+    :param repeat: number of runs of each benchmark
+    :type repeat: :class:`int`
+    :param max_size: largest matrix size to run
+    :type max_size: :class:`int`
+    :param untranslated_max_size: largest matrix size to run on the
+        untranslated interpreter
+    :type untranslated_max_size: :class:`int`
+    :return: fastest time for each build and benchmark
+    :rtype: :class:`dict` of :class:`str` to :class:`dict` of :class:`str`
+        to :class:`float`
+    """
+    results = {}
+    for build in builds:
+        command = build_command(build)
+        if command is None:
+            print('Skipping {0}: not translated'.format(build))
+            continue
+        build_max_size = max_size
+        if build == 'untranslated':
+            build_max_size = min(max_size, untranslated_max_size)
+        build_results = results[build] = {}
+        for benchmark in get_benchmarks():
+            if benchmark.size > build_max_size:
+                continue
+            program_path = generate(benchmark)
+            seconds = time_run(command, program_path, repeat)
+            build_results[benchmark.name] = seconds
+            print('{0:<14} {1:<16} {2:10.3f}s'.format(
+                build, benchmark.name, seconds))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Find results which are slower than the baseline.
+
+    :param results: results of :func:`run`
+    :type results: :class:`dict`
+    :param baseline: earlier results of :func:`run`
+    :type baseline: :class:`dict`
+    :param tolerance: fraction by which a result may exceed the baseline
+    :type tolerance: :class:`float`
+    :return: (build, benchmark, seconds, baseline seconds) of each regression
+    :rtype: :class:`list` of :class:`tuple`
+    """
+    regressions = []
+    for build in sorted(results):
+        for name in sorted(results[build]):
+            seconds = results[build][name]
+            try:
+                baseline_seconds = baseline[build][name]
+            except KeyError:
+                continue
+            if seconds > baseline_seconds * (1 + tolerance):
+                regressions.append((build, name, seconds, baseline_seconds))
+    return regressions
+
+
+def load_json(path):
+    """Load results saved with :func:`save_json`.
+
+    :return: the results, or :data:`None` if the file doesn't exist
+    :rtype: :class:`dict`
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+def save_json(path, results):
+    """Save results as JSON.
+
+    :param path: file to which to save
+    :type path: :class:`str`
+    :param results: results of :func:`run`
+    :type results: :class:`dict`
+    """
+    with open(path, 'w') as json_file:
+        json.dump(results, json_file, indent=2, sort_keys=True)
+        json_file.write('\n')
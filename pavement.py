@@ -191,7 +191,8 @@ def translate(options):
             '.',
             os.getenv('PYTHONPATH', ''),
             os.path.dirname(os.path.dirname(rply.__file__))])
-        cmd_flags = ['--make-jobs', str(cpus)]
+        # SNAP writes snapshots in a background thread.
+        cmd_flags = ['--make-jobs', str(cpus), '--thread']
         if 'view' in options.translate:
             cmd_flags += ['--annotate', '--view']
         if 'jit' in options.translate:
@@ -216,6 +217,52 @@ def translate(options):
             raise
 
 
+@task
+@cmdopts([
+    ('builds=', 'b', 'Comma-separated builds to run (default: all)'),
+    ('repeat=', 'r', 'Number of runs of each benchmark (default: 3)'),
+    ('max-size=', 'm', 'Largest matrix size to run'),
+    ('untranslated-max-size=', 'u',
+     'Largest matrix size to run on the untranslated interpreter'),
+    ('tolerance=', 't',
+     'Fraction by which a result may exceed the baseline (default: 0.1)'),
+    ('save-baseline', 's', 'Save the results as the new baseline'),
+])
+def bench(options):
+    """Run the benchmark suite and compare the results with the baseline."""
+    from benchmarks import suite
+    builds = suite.BUILDS
+    if 'builds' in options.bench:
+        builds = options.bench.builds.split(',')
+    results = suite.run(
+        builds,
+        int(options.bench.get('repeat', 3)),
+        int(options.bench.get('max_size', max(suite.SIZES))),
+        int(options.bench.get('untranslated_max_size',
+                              suite.UNTRANSLATED_MAX_SIZE)))
+    suite.save_json(suite.RESULTS_PATH, results)
+    print_success_message('Results saved to ' + suite.RESULTS_PATH)
+    if 'save_baseline' in options.bench:
+        suite.save_json(suite.BASELINE_PATH, results)
+        print_success_message('Baseline saved to ' + suite.BASELINE_PATH)
+        return
+    baseline = suite.load_json(suite.BASELINE_PATH)
+    if baseline is None:
+        print_failure_message(
+            "No baseline to compare with. Save one with `paver bench "
+            "--save-baseline'.")
+        return
+    regressions = suite.compare(
+        results, baseline, float(options.bench.get('tolerance', 0.1)))
+    for build, name, seconds, baseline_seconds in regressions:
+        print_failure_message(
+            'Regression: {0} {1} took {2:.3f}s, baseline {3:.3f}s'.format(
+                build, name, seconds, baseline_seconds))
+    if regressions:
+        raise SystemExit(1)
+    print_success_message('No regressions')
+
+
 @task
 @needs('html', 'setuptools.command.sdist')
 def sdist():
@@ -49,7 +49,9 @@ setup_dict = dict(
     zip_safe=False,  # don't use eggs
     entry_points={
         'console_scripts': [
-            'stencil_lang_cli = stencil_lang.main:main'
+            'stencil_lang_cli = stencil_lang.main:main',
+            'stencil_lang_convert = stencil_lang.matrix.convert:main',
+            'stencil_lang_submit = stencil_lang.client:main',
         ],
         # if you have a gui, use this
         # 'gui_scripts': [
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+""":mod:`stencil_lang.client` -- Client for the interpreter server
+
+Sends a program to a server started with ``--serve``, see
+:mod:`stencil_lang.server`. This is a plain Python tool, not translated with
+RPython.
+"""
+
+import socket
+import struct
+import sys
+
+from stencil_lang.server import PROGRAM, OUTPUT, ERROR, END, HEADER_LENGTH
+
+
+def usage(argv):
+    """Print program usage information.
+
+    :param argv: command-line arguments
+    :type argv: :class:`list`
+    :return: the usage string
+    :rtype: :class:`str`
+    """
+    return '''usage: %s SOCKET_PATH [INPUT_FILENAME]
+
+    Run a program on the server listening on SOCKET_PATH, printing its output
+    to stdout and its error, if any, to stderr. The program is read from
+    INPUT_FILENAME, or from stdin if it is omitted or '-'.
+''' % argv[0]
+
+
+def _recv_exactly(sock, length):
+    chunks = []
+    while length > 0:
+        chunk = sock.recv(length)
+        if not chunk:
+            raise EOFError('the server closed the connection')
+        chunks.append(chunk)
+        length -= len(chunk)
+    return ''.join(chunks)
+
+
+def submit(path, source_code, output=None):
+    """Run a program on a server.
+
+    :param path: file name of the server's socket
+    :type path: :class:`str`
+    :param source_code: program to run
+    :type source_code: :class:`str`
+    :param output: file to which to write the output as it arrives, instead \
+    of returning it
+    :type output: :class:`file`
+    :return: the program's output, unless `output` is given, and its error, \
+    or the empty string
+    :rtype: (:class:`str`, :class:`str`)
+    :raises EOFError: if the server closes the connection before answering
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(PROGRAM + struct.pack('<I', len(source_code)) +
+                     source_code)
+        chunks = []
+        error = ''
+        while True:
+            header = _recv_exactly(sock, HEADER_LENGTH)
+            kind = header[0]
+            payload = _recv_exactly(sock, struct.unpack('<I', header[1:])[0])
+            if kind == OUTPUT:
+                if output is None:
+                    chunks.append(payload)
+                else:
+                    output.write(payload)
+            elif kind == ERROR:
+                error = payload
+            elif kind == END:
+                return ''.join(chunks), error
+    finally:
+        sock.close()
+
+
+def _main(argv):
+    """Program entry point.
+
+    :param argv: command-line arguments
+    :type argv: :class:`list`
+    :return: exit code
+    :rtype: :class:`int`
+    """
+    if len(argv) not in (2, 3) or '-h' in argv or '--help' in argv:
+        print usage(argv)
+        return 1
+    if len(argv) == 2 or argv[2] == '-':
+        source_code = sys.stdin.read()
+    else:
+        with open(argv[2]) as input_file:
+            source_code = input_file.read()
+    error = submit(argv[1], source_code, sys.stdout)[1]
+    if error:
+        sys.stderr.write(error + '\n')
+        return 1
+    return 0
+
+
+def main():
+    """Main for use with setuptools/distribute."""
+    raise SystemExit(_main(sys.argv))
+
+
+if __name__ == '__main__':
+    main()
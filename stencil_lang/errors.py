@@ -121,6 +121,45 @@ class InconsistentMatrixDimensions(StencilLanguageError):
             self._current_cols, self._first_row_cols)
 
 
+class InvalidMatrixFileError(StencilLanguageError):
+    """Raised when a binary matrix file cannot be read."""
+    def __init__(self, reason):
+        """:param reason: what is wrong with the file
+        :type reason: :class:`str`
+        """
+        self._reason = reason
+
+    def __str__(self):
+        return 'Invalid binary matrix file: %s' % self._reason
+
+
+class MatrixWriteError(StencilLanguageError):
+    """Raised when a matrix cannot be written to a file."""
+    def __init__(self, matrix_num, reason):
+        """:param matrix_num: written matrix number
+        :type matrix_num: :class:`int`
+        :param reason: why the matrix cannot be written
+        :type reason: :class:`str`
+        """
+        self._matrix_num = matrix_num
+        self._reason = reason
+
+    def __str__(self):
+        return 'Cannot write matrix %d: %s' % (self._matrix_num, self._reason)
+
+
+class CheckpointError(StencilLanguageError):
+    """Raised when a program cannot be restarted from a checkpoint file."""
+    def __init__(self, reason):
+        """:param reason: what is wrong with the checkpoint
+        :type reason: :class:`str`
+        """
+        self._reason = reason
+
+    def __str__(self):
+        return 'Cannot restart from checkpoint: %s' % self._reason
+
+
 class InvalidStencilDimensionsError(StencilLanguageError):
     """Raised when an matrix is used as a stencil and its dimensions are not
     correct for that usage.
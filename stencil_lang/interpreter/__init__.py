@@ -1,17 +1,329 @@
 """:mod:`stencil_lang.interpreter` -- Interpreter code
 """
 
+import time
+
 from stencil_lang.structures import Context
-from stencil_lang.interpreter.lexer import lex
+from stencil_lang.matrix.prefetch import prefetcher
+from stencil_lang.matrix.snapshot import is_snapshot_filename
+from stencil_lang.interpreter.bytecodes import Smxf, Snap, Wmxf
+from stencil_lang.interpreter.lexer import lex, lex_all
+from stencil_lang.interpreter.scanner import scan
 from stencil_lang.interpreter.parser import parse
-from stencil_lang.interpreter.evaluator import eval_
+from stencil_lang.interpreter.evaluator import eval_, eval_profiled
+from stencil_lang.interpreter.optimizer import optimize
+from stencil_lang.interpreter.loops import lower_loops
+from stencil_lang.interpreter.peephole import fuse
+from stencil_lang.interpreter.verifier import verify
 from stencil_lang.interpreter.stencil import apply_stencil
+from stencil_lang.interpreter.cache import read_cache, write_cache
+from stencil_lang.interpreter.streaming import run_stream
+from stencil_lang.interpreter.profiler import statement_lines
+from stencil_lang.interpreter.sweep import sweep
+from stencil_lang.interpreter.checkpoint import (
+    Checkpointer,
+    program_digest,
+    restore,
+)
+
+
+def _lex_source(source_code, use_rply_lexer):
+    if use_rply_lexer:
+        return lex(source_code)
+    return scan(source_code)
+
+
+def _parse_source(source_code, use_rply_lexer):
+    return parse(_lex_source(source_code, use_rply_lexer))
+
+
+def _smxf_filenames(bytecodes):
+    """Names of the files which ``SMXF`` reads, for
+    :data:`stencil_lang.matrix.prefetch.prefetcher` to read in the background.
+    Loops hide their bodies once they are lowered, so this is called before.
+
+    Files which the program also writes with ``WMXF`` or ``SNAP`` are left
+    out, as a matrix read ahead from them would be discarded anyway.
+    """
+    written = []
+    snapped = []
+    for bytecode in bytecodes:
+        if isinstance(bytecode, Wmxf):
+            written.append(bytecode._filename)
+        elif isinstance(bytecode, Snap):
+            snapped.append(bytecode._filename)
+    filenames = []
+    for bytecode in bytecodes:
+        if (isinstance(bytecode, Smxf) and
+                not _is_written(bytecode._filename, written, snapped)):
+            filenames.append(bytecode._filename)
+    return filenames
+
+
+def _is_written(filename, written, snapped):
+    if filename in written:
+        return True
+    for snap_filename in snapped:
+        if is_snapshot_filename(filename, snap_filename):
+            return True
+    return False
+
+
+def _new_context(parameters):
+    """Create a context with the registers and matrices set before the
+    program starts, if any."""
+    context = Context(apply_stencil)
+    if parameters is not None:
+        parameters.seed(context)
+    return context
+
 
+def _close_snapshots(context):
+    """Wait for the snapshots taken by ``SNAP`` to be written."""
+    if context.snapshots is not None:
+        context.snapshots.close()
 
-def run(source_code):
+
+def load(source_code, cache_filename='', use_rply_lexer=False):
+    """Lex, parse and optimize the source code.
+
+    :param source_code: code to load
+    :type source_code: :class:`str`
+    :param cache_filename: bytecode cache file from which to read the parsed \
+    bytecodes if it is fresh, and to which to write them otherwise; empty to \
+    always parse without caching
+    :type cache_filename: :class:`str`
+    :param use_rply_lexer: whether to lex with the generated lexer instead of \
+    the hand-written scanner
+    :type use_rply_lexer: :class:`bool`
+    :return: the optimized bytecodes
+    :rtype: :class:`list` of :class:`stencil_lang.structures.Bytecode`
+    """
+    if cache_filename:
+        bytecodes = read_cache(cache_filename, source_code)
+        if bytecodes is None:
+            bytecodes = _parse_source(source_code, use_rply_lexer)
+            write_cache(cache_filename, source_code, bytecodes)
+    else:
+        bytecodes = _parse_source(source_code, use_rply_lexer)
+    return optimize(bytecodes)
+
+
+def _eval(bytecodes, filenames, context):
+    """Evaluate verified bytecodes, prefetching the files which ``SMXF``
+    reads."""
+    try:
+        prefetcher.start(filenames)
+        if context.profile is None:
+            eval_(bytecodes, context)
+        else:
+            eval_profiled(bytecodes, context)
+    finally:
+        prefetcher.close()
+        _close_snapshots(context)
+
+
+def run(source_code, cache_filename='', use_rply_lexer=False,
+        parameters=None):
     """Run the source code.
 
     :param source_code: code to run
     :type source_code: :class:`str`
+    :param cache_filename: bytecode cache file, see :func:`load`
+    :type cache_filename: :class:`str`
+    :param use_rply_lexer: see :func:`load`
+    :type use_rply_lexer: :class:`bool`
+    :param parameters: registers and matrices to set before the program \
+    starts
+    :type parameters: :class:`stencil_lang.interpreter.sweep.Parameters`
+    """
+    bytecodes = load(source_code, cache_filename, use_rply_lexer)
+    filenames = _smxf_filenames(bytecodes)
+    _eval(verify(fuse(lower_loops(bytecodes))), filenames,
+          _new_context(parameters))
+
+
+class _SweepRunner(object):
+    """Runs a loaded program with one register set to each value of a
+    sweep."""
+    def __init__(self, bytecodes, filenames, parameters, index):
+        self._bytecodes = bytecodes
+        self._filenames = filenames
+        self._parameters = parameters
+        self._index = index
+
+    def run(self, value):
+        context = _new_context(self._parameters)
+        context.registers[self._index] = value
+        _eval(self._bytecodes, self._filenames, context)
+
+
+def run_sweep(source_code, index, values, jobs, cache_filename='',
+              use_rply_lexer=False, parameters=None):
+    """Load the source code once, then run it once for each value of a
+    register on forked processes, see
+    :func:`stencil_lang.interpreter.sweep.sweep`.
+
+    :param source_code: code to run
+    :type source_code: :class:`str`
+    :param index: index of the register to set
+    :type index: :class:`int`
+    :param values: values of the register, in the order in which to write \
+    the outputs
+    :type values: :class:`list` of :class:`int`
+    :param jobs: most runs at once
+    :type jobs: :class:`int`
+    :param cache_filename: bytecode cache file, see :func:`load`
+    :type cache_filename: :class:`str`
+    :param use_rply_lexer: see :func:`load`
+    :type use_rply_lexer: :class:`bool`
+    :param parameters: registers and matrices to set before each run starts
+    :type parameters: :class:`stencil_lang.interpreter.sweep.Parameters`
+    """
+    bytecodes = load(source_code, cache_filename, use_rply_lexer)
+    filenames = _smxf_filenames(bytecodes)
+    runner = _SweepRunner(verify(fuse(lower_loops(bytecodes))), filenames,
+                          parameters, index)
+    sweep(runner, index, values, jobs)
+
+
+def run_checkpointed(source_code, checkpoint_filename, every,
+                     restart_filename='', cache_filename='',
+                     use_rply_lexer=False, parameters=None):
+    """Run the source code, saving the registers, matrices, program counter
+    and ``SNAP`` numbering to a checkpoint file every so many bytecodes, and
+    optionally starting from a checkpoint saved by an earlier run.
+
+    Loops are not lowered, and bytecodes are only fused into
+    superinstructions which don't run a whole loop, so that every iteration
+    of a loop passes between bytecodes where a checkpoint can be saved. The
+    program is otherwise run, and compiled by the JIT, like any other.
+
+    :param source_code: code to run
+    :type source_code: :class:`str`
+    :param checkpoint_filename: checkpoint file to which to save
+    :type checkpoint_filename: :class:`str`
+    :param every: number of bytecodes to run between checkpoints, zero to \
+    never save one
+    :type every: :class:`int`
+    :param restart_filename: checkpoint file from which to restart, empty to \
+    start from the beginning
+    :type restart_filename: :class:`str`
+    :param cache_filename: bytecode cache file, see :func:`load`
+    :type cache_filename: :class:`str`
+    :param use_rply_lexer: see :func:`load`
+    :type use_rply_lexer: :class:`bool`
+    :param parameters: registers and matrices to set before the program \
+    starts, unless it restarts from a checkpoint
+    :type parameters: :class:`stencil_lang.interpreter.sweep.Parameters`
+    :raises stencil_lang.errors.CheckpointError: if the restart file is not \
+    a checkpoint of this program
+    """
+    bytecodes = load(source_code, cache_filename, use_rply_lexer)
+    filenames = _smxf_filenames(bytecodes)
+    # Fusion always gives the same program counters for the same program,
+    # so the digest of the loaded program identifies them too.
+    digest = program_digest(bytecodes)
+    bytecodes = fuse(bytecodes, whole_loops=False)
+    context = _new_context(parameters)
+    if restart_filename:
+        restore(restart_filename, digest, context)
+    context.checkpointer = Checkpointer(checkpoint_filename, every, digest)
+    _eval(verify(bytecodes), filenames, context)
+
+
+def run_streaming(stream, parameters=None):
+    """Run source code statement by statement as it is read from a stream.
+
+    :param stream: stream from which to read source code
+    :type stream: :class:`rpython.rlib.streamio.Stream`
+    :param parameters: see :func:`run`
+    :type parameters: :class:`stencil_lang.interpreter.sweep.Parameters`
+    """
+    context = _new_context(parameters)
+    try:
+        run_stream(stream, context)
+    finally:
+        _close_snapshots(context)
+
+
+def run_profiled(source_code, profile, use_rply_lexer=False,
+                 parameters=None):
+    """Run the source code like :func:`run`, profiling each bytecode against
+    its :attr:`stencil_lang.structures.Bytecode.line`. The bytecode cache
+    isn't used, as it doesn't keep source lines.
+
+    :param source_code: code to run
+    :type source_code: :class:`str`
+    :param profile: profile in which to record
+    :type profile: :class:`stencil_lang.interpreter.profiler.Profile`
+    :param use_rply_lexer: see :func:`load`
+    :type use_rply_lexer: :class:`bool`
+    :param parameters: see :func:`run`
+    :type parameters: :class:`stencil_lang.interpreter.sweep.Parameters`
+    """
+    bytecodes = _parse_source(source_code, use_rply_lexer)
+    # Each statement is parsed into one bytecode.
+    lines = statement_lines(source_code)
+    for pc in xrange(len(bytecodes)):
+        bytecodes[pc].line = lines[pc]
+    bytecodes = optimize(bytecodes)
+    filenames = _smxf_filenames(bytecodes)
+    context = _new_context(parameters)
+    context.profile = profile
+    _eval(verify(fuse(lower_loops(bytecodes))), filenames, context)
+
+
+def run_with_stats(source_code, stats, cache_filename='',
+                   use_rply_lexer=False, parameters=None):
+    """Run the source code like :func:`run`, timing each phase.
+
+    :param source_code: code to run
+    :type source_code: :class:`str`
+    :param stats: statistics in which to record
+    :type stats: :class:`stencil_lang.interpreter.stats.Stats`
+    :param cache_filename: bytecode cache file, see :func:`load`
+    :type cache_filename: :class:`str`
+    :param use_rply_lexer: see :func:`load`
+    :type use_rply_lexer: :class:`bool`
+    :param parameters: see :func:`run`
+    :type parameters: :class:`stencil_lang.interpreter.sweep.Parameters`
     """
-    eval_(parse(lex(source_code)), Context(apply_stencil))
+    bytecodes = None
+    if cache_filename:
+        start = time.time()
+        bytecodes = read_cache(cache_filename, source_code)
+        stats.add_phase('cache', time.time() - start)
+    if bytecodes is None:
+        start = time.time()
+        tokens = lex_all(_lex_source(source_code, use_rply_lexer))
+        stats.add_phase('lex', time.time() - start)
+        start = time.time()
+        bytecodes = parse(tokens)
+        stats.add_phase('parse', time.time() - start)
+        if cache_filename:
+            start = time.time()
+            write_cache(cache_filename, source_code, bytecodes)
+            stats.add_phase('cache', time.time() - start)
+    else:
+        # Report the same phases whether or not the cache was fresh.
+        stats.add_phase('lex', 0.0)
+        stats.add_phase('parse', 0.0)
+    start = time.time()
+    bytecodes = optimize(bytecodes)
+    filenames = _smxf_filenames(bytecodes)
+    bytecodes = verify(fuse(lower_loops(bytecodes)))
+    stats.add_phase('optimize', time.time() - start)
+    context = _new_context(parameters)
+    context.stats = stats
+    start = time.time()
+    try:
+        try:
+            prefetcher.start(filenames)
+            eval_(bytecodes, context)
+        finally:
+            prefetcher.close()
+            # Writing the queued snapshots is part of running the program.
+            _close_snapshots(context)
+    finally:
+        stats.add_phase('eval', time.time() - start)
@@ -1,6 +1,9 @@
 """:mod:`stencil_lang.interpreter.bytecodes` -- Interpreter bytecodes
 """
 
+import os
+import time
+
 from stencil_lang.structures import Bytecode, Matrix
 from stencil_lang.errors import (
     UninitializedVariableError,
@@ -8,8 +11,14 @@ from stencil_lang.errors import (
     ArgumentError,
     InvalidBranchOffsetError,
     MatrixDimensionMismatchError,
+    MatrixWriteError,
 )
-from stencil_lang.matrix import from_file
+from stencil_lang.matrix import to_file
+from stencil_lang.matrix.filecache import file_cache
+from stencil_lang.matrix.prefetch import prefetcher
+from stencil_lang.matrix.printer import write_matrix, stdout
+from stencil_lang.matrix.snapshot import SnapshotWriter, QUEUE_LENGTH
+from stencil_lang.utils import format_real
 
 
 def _safe_get_matrix(context, matrix_num):
@@ -19,6 +28,29 @@ def _safe_get_matrix(context, matrix_num):
         raise UninitializedVariableError('Matrix', matrix_num)
 
 
+def _apply_stencil(context, stencil, matrix):
+    if context.snapshots is not None:
+        # Each step of a simulation is a chance to write queued snapshots.
+        context.snapshots.let_writer_run()
+    prefetcher.let_readers_run()
+    stats = context.stats
+    if stats is None:
+        return context.apply_stencil(stencil, matrix)
+    start = time.time()
+    result = context.apply_stencil(stencil, matrix)
+    stats.record_pde(result.rows * result.cols, time.time() - start)
+    # The old matrix is still alive at this point.
+    stats.record_matrices(context.matrices, len(result.contents))
+    return result
+
+
+def _read_matrix_file(filename):
+    matrix = prefetcher.take(filename)
+    if matrix is None:
+        matrix = file_cache.read(filename)
+    return matrix
+
+
 def _safe_get_register(context, register_num):
     try:
         return context.registers[register_num]
@@ -40,6 +72,9 @@ class Sto(Bytecode):
     def eval(self, context):
         context.registers[self._index] = self._integer
 
+    def as_source_string(self):
+        return 'STO %d %d' % (self._index, self._integer)
+
 
 class Pr(Bytecode):
     """Print register bytecode."""
@@ -52,6 +87,9 @@ class Pr(Bytecode):
     def eval(self, context):
         print _safe_get_register(context, self._index)
 
+    def as_source_string(self):
+        return 'PR %d' % self._index
+
 
 class Add(Bytecode):
     """Add bytecode."""
@@ -71,6 +109,9 @@ class Add(Bytecode):
         except KeyError:
             raise UninitializedVariableError('Register', index)
 
+    def as_source_string(self):
+        return 'ADD %d %d' % (self._index, self._integer)
+
 
 class Cmx(Bytecode):
     """Create matrix bytecode."""
@@ -94,6 +135,9 @@ class Cmx(Bytecode):
             raise InvalidMatrixDimensionsError(index, (rows, cols))
         context.matrices[index] = Matrix(rows, cols, [])
 
+    def as_source_string(self):
+        return 'CMX %d %d %d' % (self._index, self._rows, self._cols)
+
 
 class Pmx(Bytecode):
     """Print matrix bytecode."""
@@ -104,9 +148,17 @@ class Pmx(Bytecode):
         self._index = index
 
     def eval(self, context):
-        # RPython does not honor most magic methods. Hence, just `print'
-        # will work in tests but not when translated.
-        print _safe_get_matrix(context, self._index).__str__()
+        matrix = _safe_get_matrix(context, self._index)
+        stats = context.stats
+        if stats is None:
+            write_matrix(stdout, matrix, True)
+        else:
+            start = time.time()
+            write_matrix(stdout, matrix, True)
+            stats.record_io(time.time() - start)
+
+    def as_source_string(self):
+        return 'PMX %d' % self._index
 
 
 class Smx(Bytecode):
@@ -129,6 +181,14 @@ class Smx(Bytecode):
         if num_given_args != num_required_args:
             raise ArgumentError(num_required_args, num_given_args)
         matrix.contents = real_list
+        if context.stats is not None:
+            context.stats.record_matrices(context.matrices, 0)
+
+    def as_source_string(self):
+        parts = ['SMX %d' % self._index]
+        for real in self._real_list:
+            parts.append(format_real(real))
+        return ' '.join(parts)
 
 
 class Smxf(Bytecode):
@@ -146,7 +206,17 @@ class Smxf(Bytecode):
         index = self._index
         filename = self._filename
         matrix = _safe_get_matrix(context, index)
-        matrix_from_file = from_file(filename)
+        stats = context.stats
+        if stats is None:
+            matrix_from_file = _read_matrix_file(filename)
+        else:
+            misses = file_cache.misses
+            taken = prefetcher.taken
+            start = time.time()
+            matrix_from_file = _read_matrix_file(filename)
+            stats.record_io(time.time() - start)
+            if file_cache.misses != misses or prefetcher.taken != taken:
+                stats.record_read(os.stat(filename).st_size)
         if (matrix.rows != matrix_from_file.rows or
                 matrix.cols != matrix_from_file.cols):
             raise MatrixDimensionMismatchError(
@@ -154,6 +224,79 @@ class Smxf(Bytecode):
                 (matrix.rows, matrix.cols),
                 (matrix_from_file.rows, matrix_from_file.cols))
         matrix.contents = matrix_from_file.contents
+        if stats is not None:
+            stats.record_matrices(context.matrices, 0)
+
+    def as_source_string(self):
+        return 'SMXF %d "%s"' % (self._index, self._filename)
+
+
+class Wmxf(Bytecode):
+    """Write matrix to file bytecode."""
+    def __init__(self, index, filename):
+        """:param index: matrix index
+        :type index: :class:`int`
+        :param filename: file to which to write the matrix, in the binary \
+        format if it ends with \
+        :data:`stencil_lang.matrix.binary.EXTENSION`
+        :type filename: :class:`str`
+        """
+        self._index = index
+        self._filename = filename
+
+    def eval(self, context):
+        index = self._index
+        filename = self._filename
+        matrix = _safe_get_matrix(context, index)
+        if len(matrix.contents) != matrix.rows * matrix.cols:
+            raise MatrixWriteError(index, 'it is not populated')
+        stats = context.stats
+        start = 0.0
+        if stats is not None:
+            start = time.time()
+        try:
+            to_file(filename, matrix)
+        except ValueError:
+            raise MatrixWriteError(
+                index, 'non-finite reals can only be written in binary')
+        file_cache.discard(filename)
+        prefetcher.discard(filename)
+        if stats is not None:
+            stats.record_io(time.time() - start)
+
+    def as_source_string(self):
+        return 'WMXF %d "%s"' % (self._index, self._filename)
+
+
+class Snap(Bytecode):
+    """Snapshot matrix to a numbered file bytecode."""
+    def __init__(self, index, filename):
+        """:param index: matrix index
+        :type index: :class:`int`
+        :param filename: file name into which the snapshot number is \
+        inserted, see :func:`stencil_lang.matrix.snapshot.snapshot_filename`
+        :type filename: :class:`str`
+        """
+        self._index = index
+        self._filename = filename
+
+    def eval(self, context):
+        index = self._index
+        matrix = _safe_get_matrix(context, index)
+        if len(matrix.contents) != matrix.rows * matrix.cols:
+            raise MatrixWriteError(index, 'it is not populated')
+        writer = context.snapshots
+        if writer is None:
+            writer = SnapshotWriter(QUEUE_LENGTH)
+            context.snapshots = writer
+        filename = writer.put(index, self._filename,
+                              Matrix(matrix.rows, matrix.cols,
+                                     matrix.contents))
+        file_cache.discard(filename)
+        prefetcher.discard(filename)
+
+    def as_source_string(self):
+        return 'SNAP %d "%s"' % (self._index, self._filename)
 
 
 class Pde(Bytecode):
@@ -172,7 +315,11 @@ class Pde(Bytecode):
         stencil = _safe_get_matrix(context, stencil_index)
         matrix_index = self._matrix_index
         matrix = _safe_get_matrix(context, matrix_index)
-        context.matrices[matrix_index] = context.apply_stencil(stencil, matrix)
+        context.matrices[matrix_index] = _apply_stencil(context, stencil,
+                                                        matrix)
+
+    def as_source_string(self):
+        return 'PDE %d %d' % (self._stencil_index, self._matrix_index)
 
 
 class Bne(Bytecode):
@@ -200,6 +347,15 @@ class Bne(Bytecode):
             # Subtract one because the main loop increment will add another.
             context.pc = destination - 1
 
+    def as_source_string(self):
+        return 'BNE %d %d %d' % (self._register_index, self._value,
+                                 self._offset)
+
 
 BYTECODES = [cls.__name__.upper() for cls in Bytecode.__subclasses__()]
 """All language bytecodes."""
+
+# Get around limitations in RPython: type(bytecode).__name__ does not work.
+# Subclasses of these bytecodes share their opcode.
+for _subclass in Bytecode.__subclasses__():
+    _subclass.opcode = _subclass.__name__.upper()
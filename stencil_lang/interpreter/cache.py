@@ -0,0 +1,263 @@
+""":mod:`stencil_lang.interpreter.cache` -- Precompiled bytecode cache
+"""
+
+import os
+
+from rpython.rlib.rmd5 import RMD5
+from rpython.rlib.rstring import StringBuilder
+from rpython.rlib.streamio import open_file_as_stream
+
+from stencil_lang.interpreter.bytecodes import (
+    Sto,
+    Pr,
+    Add,
+    Cmx,
+    Pmx,
+    Smx,
+    Smxf,
+    Wmxf,
+    Snap,
+    Pde,
+    Bne,
+)
+from stencil_lang.interpreter.serialization import (
+    CorruptDataError,
+    Reader,
+    write_float,
+    write_int,
+    write_string,
+)
+
+MAGIC = 'SLC\x01'
+"""Start of every cache file. The last byte is the format version."""
+
+_HEADER_LENGTH = len(MAGIC) + 16
+
+# One-byte tags identifying each bytecode in a cache file.
+_STO = 'S'
+_PR = 'P'
+_ADD = 'A'
+_CMX = 'C'
+_PMX = 'M'
+_SMX = 'X'
+_SMXF = 'F'
+_WMXF = 'W'
+_SNAP = 'N'
+_PDE = 'D'
+_BNE = 'B'
+
+
+def cache_filename(filename):
+    """Name of the cache file for a source file.
+
+    :param filename: source file name
+    :type filename: :class:`str`
+    :return: the cache file name
+    :rtype: :class:`str`
+    """
+    if filename.endswith('.sl'):
+        return filename + 'c'
+    return filename + '.slc'
+
+
+def _dump_bytecode(builder, bytecode):
+    if isinstance(bytecode, Sto):
+        builder.append(_STO)
+        write_int(builder, bytecode._index)
+        write_int(builder, bytecode._integer)
+    elif isinstance(bytecode, Pr):
+        builder.append(_PR)
+        write_int(builder, bytecode._index)
+    elif isinstance(bytecode, Add):
+        builder.append(_ADD)
+        write_int(builder, bytecode._index)
+        write_int(builder, bytecode._integer)
+    elif isinstance(bytecode, Cmx):
+        builder.append(_CMX)
+        write_int(builder, bytecode._index)
+        write_int(builder, bytecode._rows)
+        write_int(builder, bytecode._cols)
+    elif isinstance(bytecode, Pmx):
+        builder.append(_PMX)
+        write_int(builder, bytecode._index)
+    elif isinstance(bytecode, Smx):
+        builder.append(_SMX)
+        write_int(builder, bytecode._index)
+        write_int(builder, len(bytecode._real_list))
+        for real in bytecode._real_list:
+            write_float(builder, real)
+    elif isinstance(bytecode, Smxf):
+        builder.append(_SMXF)
+        write_int(builder, bytecode._index)
+        write_string(builder, bytecode._filename)
+    elif isinstance(bytecode, Wmxf):
+        builder.append(_WMXF)
+        write_int(builder, bytecode._index)
+        write_string(builder, bytecode._filename)
+    elif isinstance(bytecode, Snap):
+        builder.append(_SNAP)
+        write_int(builder, bytecode._index)
+        write_string(builder, bytecode._filename)
+    elif isinstance(bytecode, Pde):
+        builder.append(_PDE)
+        write_int(builder, bytecode._stencil_index)
+        write_int(builder, bytecode._matrix_index)
+    elif isinstance(bytecode, Bne):
+        builder.append(_BNE)
+        write_int(builder, bytecode._register_index)
+        write_int(builder, bytecode._value)
+        write_int(builder, bytecode._offset)
+    else:
+        raise TypeError('Cannot cache bytecode: %s' %
+                        bytecode.as_source_string())
+
+
+def dumps(source_code, bytecodes):
+    """Serialize parsed bytecodes, keyed by the source they were parsed from.
+
+    :param source_code: source code which was parsed
+    :type source_code: :class:`str`
+    :param bytecodes: bytecodes parsed from `source_code`
+    :type bytecodes: :class:`list` of \
+    :class:`stencil_lang.structures.Bytecode`
+    :return: the cache file contents
+    :rtype: :class:`str`
+    """
+    builder = StringBuilder()
+    builder.append(MAGIC)
+    builder.append(RMD5(source_code).digest())
+    write_int(builder, len(bytecodes))
+    for bytecode in bytecodes:
+        _dump_bytecode(builder, bytecode)
+    return builder.build()
+
+
+def _load_bytecode(reader):
+    tag = reader.read_tag()
+    if tag == _STO:
+        index = reader.read_int()
+        return Sto(index, reader.read_int())
+    elif tag == _PR:
+        return Pr(reader.read_int())
+    elif tag == _ADD:
+        index = reader.read_int()
+        return Add(index, reader.read_int())
+    elif tag == _CMX:
+        index = reader.read_int()
+        rows = reader.read_int()
+        return Cmx(index, rows, reader.read_int())
+    elif tag == _PMX:
+        return Pmx(reader.read_int())
+    elif tag == _SMX:
+        index = reader.read_int()
+        num_reals = reader.read_int()
+        if num_reals < 0:
+            raise CorruptDataError()
+        real_list = []
+        for _ in xrange(num_reals):
+            real_list.append(reader.read_float())
+        return Smx(index, real_list)
+    elif tag == _SMXF:
+        index = reader.read_int()
+        return Smxf(index, reader.read_string())
+    elif tag == _WMXF:
+        index = reader.read_int()
+        return Wmxf(index, reader.read_string())
+    elif tag == _SNAP:
+        index = reader.read_int()
+        return Snap(index, reader.read_string())
+    elif tag == _PDE:
+        stencil_index = reader.read_int()
+        return Pde(stencil_index, reader.read_int())
+    elif tag == _BNE:
+        register_index = reader.read_int()
+        value = reader.read_int()
+        return Bne(register_index, value, reader.read_int())
+    raise CorruptDataError()
+
+
+def loads(source_code, data):
+    """Deserialize bytecodes written by :func:`dumps`.
+
+    :param source_code: source code which the bytecodes must have been parsed \
+    from
+    :type source_code: :class:`str`
+    :param data: cache file contents
+    :type data: :class:`str`
+    :return: the bytecodes, or :data:`None` if the cache is stale or corrupt
+    :rtype: :class:`list` of :class:`stencil_lang.structures.Bytecode`
+    """
+    if (len(data) < _HEADER_LENGTH or
+            data[:len(MAGIC)] != MAGIC or
+            data[len(MAGIC):_HEADER_LENGTH] != RMD5(source_code).digest()):
+        return None
+    reader = Reader(data, _HEADER_LENGTH)
+    try:
+        num_bytecodes = reader.read_int()
+        if num_bytecodes < 0:
+            return None
+        bytecodes = []
+        for _ in xrange(num_bytecodes):
+            bytecodes.append(_load_bytecode(reader))
+    except CorruptDataError:
+        return None
+    if not reader.at_end():
+        return None
+    return bytecodes
+
+
+def read_cache(filename, source_code):
+    """Read bytecodes from a cache file if it is fresh.
+
+    :param filename: cache file name
+    :type filename: :class:`str`
+    :param source_code: current source code
+    :type source_code: :class:`str`
+    :return: the bytecodes, or :data:`None` if the cache is missing, stale or \
+    corrupt
+    :rtype: :class:`list` of :class:`stencil_lang.structures.Bytecode`
+    """
+    try:
+        stream = open_file_as_stream(filename)
+        try:
+            data = stream.readall()
+        finally:
+            stream.close()
+    except OSError:
+        return None
+    return loads(source_code, data)
+
+
+def write_cache(filename, source_code, bytecodes):
+    """Write bytecodes to a cache file. Failure to write is not an error, as
+    the cache is only an optimization.
+
+    The cache is written to a temporary file of this process which then
+    replaces `filename`, so neither a crash nor another interpreter writing
+    the same cache leaves a partial one to be read.
+
+    :param filename: cache file name
+    :type filename: :class:`str`
+    :param source_code: source code which was parsed
+    :type source_code: :class:`str`
+    :param bytecodes: bytecodes parsed from `source_code`
+    :type bytecodes: :class:`list` of \
+    :class:`stencil_lang.structures.Bytecode`
+    """
+    data = dumps(source_code, bytecodes)
+    temporary_filename = '%s.%d.tmp' % (filename, os.getpid())
+    try:
+        fd = os.open(temporary_filename,
+                     os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666)
+        try:
+            written = 0
+            while written < len(data):
+                written += os.write(fd, data[written:])
+        finally:
+            os.close(fd)
+        os.rename(temporary_filename, filename)
+    except OSError:
+        try:
+            os.unlink(temporary_filename)
+        except OSError:
+            pass
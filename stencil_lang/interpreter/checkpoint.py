@@ -0,0 +1,222 @@
+""":mod:`stencil_lang.interpreter.checkpoint` -- Checkpoint and restart
+"""
+
+import os
+
+from rpython.rlib.jit import dont_look_inside
+from rpython.rlib.rmd5 import RMD5
+from rpython.rlib.rstring import StringBuilder
+from rpython.rlib.streamio import open_file_as_stream
+
+from stencil_lang.errors import CheckpointError
+from stencil_lang.matrix.snapshot import SnapshotWriter, QUEUE_LENGTH
+from stencil_lang.structures import Matrix
+from stencil_lang.interpreter.serialization import (
+    CorruptDataError,
+    Reader,
+    write_float,
+    write_int,
+    write_string,
+)
+
+MAGIC = 'SLK\x03'
+"""Start of every checkpoint file. The last byte is the format version."""
+
+_HEADER_LENGTH = len(MAGIC) + 16
+
+
+def program_digest(bytecodes):
+    """Digest identifying a program, so that a checkpoint is only restored
+    into the program which saved it.
+
+    :param bytecodes: the program
+    :type bytecodes: :class:`list` of \
+    :class:`stencil_lang.structures.Bytecode`
+    :return: the digest
+    :rtype: :class:`str`
+    """
+    digest = RMD5()
+    for bytecode in bytecodes:
+        digest.update(bytecode.as_source_string())
+        digest.update('\n')
+    return digest.digest()
+
+
+def dumps(digest, context):
+    """Serialize the state of a running program: its program counter,
+    registers, matrices and the number of the next snapshot of each file
+    name given to ``SNAP``.
+
+    :param digest: digest of the program, see :func:`program_digest`
+    :type digest: :class:`str`
+    :param context: the execution context
+    :type context: :class:`stencil_lang.structures.Context`
+    :return: the checkpoint file contents
+    :rtype: :class:`str`
+    """
+    builder = StringBuilder()
+    builder.append(MAGIC)
+    builder.append(digest)
+    write_int(builder, context.pc)
+    write_int(builder, len(context.registers))
+    for index, value in context.registers.iteritems():
+        write_int(builder, index)
+        write_int(builder, value)
+    write_int(builder, len(context.matrices))
+    for index, matrix in context.matrices.iteritems():
+        write_int(builder, index)
+        write_int(builder, matrix.rows)
+        write_int(builder, matrix.cols)
+        write_int(builder, len(matrix.contents))
+        for real in matrix.contents:
+            write_float(builder, real)
+    numbers = {}
+    if context.snapshots is not None:
+        numbers = context.snapshots.numbers
+    write_int(builder, len(numbers))
+    for filename, number in numbers.iteritems():
+        write_string(builder, filename)
+        write_int(builder, number)
+    return builder.build()
+
+
+def _read_count(reader):
+    count = reader.read_int()
+    if count < 0:
+        raise CorruptDataError()
+    return count
+
+
+def loads(digest, data, context):
+    """Restore the state of a running program written by :func:`dumps`.
+
+    :param digest: digest of the program, see :func:`program_digest`
+    :type digest: :class:`str`
+    :param data: checkpoint file contents
+    :type data: :class:`str`
+    :param context: the execution context to restore into
+    :type context: :class:`stencil_lang.structures.Context`
+    :raises stencil_lang.errors.CheckpointError: if `data` is not a valid \
+    checkpoint of the program
+    """
+    if len(data) < _HEADER_LENGTH or not data.startswith(MAGIC):
+        raise CheckpointError('not a checkpoint file')
+    if data[len(MAGIC):_HEADER_LENGTH] != digest:
+        raise CheckpointError('it was saved by a different program')
+    reader = Reader(data, _HEADER_LENGTH)
+    registers = {}
+    matrices = {}
+    numbers = {}
+    try:
+        pc = reader.read_int()
+        for _ in xrange(_read_count(reader)):
+            index = reader.read_int()
+            registers[index] = reader.read_int()
+        for _ in xrange(_read_count(reader)):
+            index = reader.read_int()
+            rows = reader.read_int()
+            cols = reader.read_int()
+            contents = []
+            for _ in xrange(_read_count(reader)):
+                contents.append(reader.read_float())
+            matrices[index] = Matrix(rows, cols, contents)
+        for _ in xrange(_read_count(reader)):
+            filename = reader.read_string()
+            numbers[filename] = reader.read_int()
+        if not reader.at_end():
+            raise CorruptDataError()
+    except CorruptDataError:
+        raise CheckpointError('it is corrupt')
+    context.pc = pc
+    context.registers = registers
+    context.matrices = matrices
+    if numbers:
+        writer = SnapshotWriter(QUEUE_LENGTH)
+        writer.numbers = numbers
+        context.snapshots = writer
+
+
+def save(filename, data):
+    """Write a checkpoint atomically: it is written to a temporary file which
+    then replaces `filename`, so a crash never leaves a partial checkpoint.
+
+    :param filename: checkpoint file name
+    :type filename: :class:`str`
+    :param data: checkpoint file contents
+    :type data: :class:`str`
+    """
+    temporary_filename = filename + '.tmp'
+    fd = os.open(temporary_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                 0666)
+    try:
+        written = 0
+        while written < len(data):
+            written += os.write(fd, data[written:])
+        # Make sure the contents reach the disk before the rename does.
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.rename(temporary_filename, filename)
+
+
+def restore(filename, digest, context):
+    """Restore the state of a running program from a checkpoint file.
+
+    :param filename: checkpoint file name
+    :type filename: :class:`str`
+    :param digest: digest of the program, see :func:`program_digest`
+    :type digest: :class:`str`
+    :param context: the execution context to restore into
+    :type context: :class:`stencil_lang.structures.Context`
+    :raises stencil_lang.errors.CheckpointError: if the file is not a valid \
+    checkpoint of the program
+    """
+    try:
+        stream = open_file_as_stream(filename)
+        try:
+            data = stream.readall()
+        finally:
+            stream.close()
+    except OSError:
+        raise CheckpointError('cannot read %s' % filename)
+    loads(digest, data, context)
+
+
+class Checkpointer(object):
+    """Saves a checkpoint every so many bytecodes. Set as the context's
+    :attr:`stencil_lang.structures.Context.checkpointer`, it is stepped by
+    :func:`stencil_lang.interpreter.evaluator.eval_` after each bytecode."""
+    def __init__(self, filename, every, digest):
+        """:param filename: checkpoint file name
+        :type filename: :class:`str`
+        :param every: number of bytecodes to run between checkpoints, zero \
+        to never save one
+        :type every: :class:`int`
+        :param digest: digest of the program, see :func:`program_digest`
+        :type digest: :class:`str`
+        """
+        self._filename = filename
+        self._every = every
+        self._digest = digest
+        self._countdown = every
+
+    def step(self, context):
+        """Count one bytecode, and save a checkpoint if it is due.
+
+        :param context: the execution context, between two bytecodes
+        :type context: :class:`stencil_lang.structures.Context`
+        """
+        if self._every == 0:
+            return
+        self._countdown -= 1
+        if self._countdown == 0:
+            self._save(context)
+            self._countdown = self._every
+
+    @dont_look_inside
+    def _save(self, context):
+        if context.snapshots is not None:
+            # Every snapshot counted in the checkpoint must be on disk before
+            # the checkpoint is.
+            context.snapshots.close()
+        save(self._filename, dumps(self._digest, context))
@@ -1,12 +1,15 @@
 """:mod:`stencil_lang.interpreter.evaluator` -- Bytecode evaluator
 """
 
+import time
+
 from rpython.rlib.jit import JitDriver
 jit_driver = JitDriver(greens=['bytecodes'], reds=['context'])
 
 
 def eval_(bytecodes, context):
-    """Evaluate a list of bytecodes within a context.
+    """Evaluate a list of bytecodes within a context. If the context has a
+    checkpointer, the checkpointer is handed the context after each bytecode.
 
     :param bytecodes: bytecodes to evaluate
     :type bytecodes: :class:`stencil_lang.structures.BytecodeListBox`
@@ -19,6 +22,28 @@ def eval_(bytecodes, context):
             bytecodes=bytecodes,
             context=context,
         )
-        bytecodes[context.pc].eval(context)
+        bytecode = bytecodes[context.pc]
+        bytecode.eval(context)
+
+        context.pc += 1
+        if context.checkpointer is not None:
+            context.checkpointer.step(context)
 
+
+def eval_profiled(bytecodes, context):
+    """Evaluate a list of bytecodes like :func:`eval_`, recording each
+    bytecode's run in the context's profile. It is a loop of its own, so that
+    :func:`eval_` doesn't check for a profile at every bytecode.
+
+    :param bytecodes: bytecodes to evaluate
+    :type bytecodes: :class:`stencil_lang.structures.BytecodeListBox`
+    :param context: the execution context, with a profile
+    :type context: :class:`stencil_lang.structures.Context`
+    """
+    context.program_length = len(bytecodes)
+    while context.pc < len(bytecodes):
+        bytecode = bytecodes[context.pc]
+        start = time.time()
+        bytecode.eval(context)
+        context.profile.record(bytecode, time.time() - start)
         context.pc += 1
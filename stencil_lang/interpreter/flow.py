@@ -0,0 +1,79 @@
+""":mod:`stencil_lang.interpreter.flow` -- Control flow helpers
+"""
+
+from stencil_lang.interpreter.bytecodes import Bne
+from stencil_lang.interpreter.peephole import AddBne
+
+
+def successors(bytecodes, pc):
+    """Find the program counters which may run after `pc`.
+
+    :param bytecodes: bytecodes with valid branches
+    :type bytecodes: :class:`list` of \
+    :class:`stencil_lang.structures.Bytecode`
+    :param pc: program counter of the bytecode
+    :type pc: :class:`int`
+    :return: the successors, which may include the end of the program
+    :rtype: :class:`list` of :class:`int`
+    """
+    bytecode = bytecodes[pc]
+    next_pcs = [pc + 1]
+    if isinstance(bytecode, Bne):
+        next_pcs.append(pc + bytecode._offset)
+    elif isinstance(bytecode, AddBne):
+        next_pcs.append(bytecode._destination)
+    return next_pcs
+
+
+def relocate(bytecodes, removed):
+    """Remove bytecodes and fix up the offsets of the remaining branches.
+
+    Branches to a removed bytecode go to the next remaining one. A removed
+    bytecode is kept after all if removing it would leave a branch with no
+    valid destination.
+
+    :param bytecodes: bytecodes to filter
+    :type bytecodes: :class:`list` of \
+    :class:`stencil_lang.structures.Bytecode`
+    :param removed: whether to remove each bytecode
+    :type removed: :class:`list` of :class:`bool`
+    :return: the remaining bytecodes
+    :rtype: :class:`list` of :class:`stencil_lang.structures.Bytecode`
+    """
+    program_length = len(bytecodes)
+    while True:
+        # Map each old program counter to the next remaining bytecode.
+        new_pcs = [0] * (program_length + 1)
+        new_pc = 0
+        for pc in xrange(program_length):
+            new_pcs[pc] = new_pc
+            if not removed[pc]:
+                new_pc += 1
+        new_pcs[program_length] = new_pc
+        new_length = new_pc
+
+        restored = False
+        for pc in xrange(program_length):
+            bytecode = bytecodes[pc]
+            if removed[pc] or not isinstance(bytecode, Bne):
+                continue
+            destination = pc + bytecode._offset
+            new_destination = new_pcs[destination]
+            if new_destination == new_pcs[pc] or new_destination >= new_length:
+                removed[destination] = False
+                restored = True
+        if not restored:
+            break
+
+    new_bytecodes = []
+    for pc in xrange(program_length):
+        if removed[pc]:
+            continue
+        bytecode = bytecodes[pc]
+        if isinstance(bytecode, Bne):
+            new_destination = new_pcs[pc + bytecode._offset]
+            bytecode = bytecode.replaced_by(
+                Bne(bytecode._register_index, bytecode._value,
+                    new_destination - new_pcs[pc]))
+        new_bytecodes.append(bytecode)
+    return new_bytecodes
@@ -1,6 +1,8 @@
 """:mod:`stencil_lang.interpreter.lexer` --- Scanning-related variables
 """
 from rply import LexerGenerator
+from rply.errors import LexingError
+from rply.lexer import LexerStream
 
 from stencil_lang.interpreter.tokens import TOKENS, IGNORES
 
@@ -27,3 +29,46 @@ def lex(text):
     :rtype: :class:`rply.lexer.LexerStream`
     """
     return _lexer.lex(text)
+
+
+class TokenList(LexerStream):
+    """Token stream over tokens which have already been lexed."""
+    def __init__(self, tokens, error):
+        """:param tokens: the lexed tokens
+        :type tokens: :class:`list` of :class:`rply.token.Token`
+        :param error: error to raise after the tokens, or :data:`None`
+        :type error: :class:`rply.errors.LexingError`
+        """
+        LexerStream.__init__(self, None, '')
+        self._tokens = tokens
+        self._error = error
+        self._next_index = 0
+
+    def next(self):
+        index = self._next_index
+        if index < len(self._tokens):
+            self._next_index = index + 1
+            return self._tokens[index]
+        if self._error is not None:
+            raise self._error
+        raise StopIteration
+
+
+def lex_all(stream):
+    """Lex all tokens of a stream up front, so that lexing can be timed
+    separately from parsing. A lexing error is raised when the parser reaches
+    it, as if the tokens were lexed lazily.
+
+    :param stream: stream to lex
+    :type stream: :class:`rply.lexer.LexerStream`
+    :return: stream of the lexed tokens
+    :rtype: :class:`TokenList`
+    """
+    tokens = []
+    try:
+        while True:
+            tokens.append(stream.next())
+    except StopIteration:
+        return TokenList(tokens, None)
+    except LexingError as error:
+        return TokenList(tokens, error)
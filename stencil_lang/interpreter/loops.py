@@ -0,0 +1,185 @@
+""":mod:`stencil_lang.interpreter.loops` -- Counted loop recognition
+"""
+
+from rpython.rlib.jit import JitDriver
+
+from stencil_lang.structures import Bytecode
+from stencil_lang.interpreter.bytecodes import Sto, Pr, Add, Bne
+from stencil_lang.interpreter.flow import relocate
+
+loop_driver = JitDriver(greens=['loop'], reds=['i', 'context'])
+
+
+class CountedLoop(Bytecode):
+    """Native loop which runs its body a fixed number of times."""
+    opcode = 'LOOP'
+
+    # _index isn't listed, because other bytecodes' _index fields are
+    # mutable.
+    _immutable_fields_ = ['_count', '_body[*]', '_write_back',
+                          '_final_value']
+
+    def __init__(self, index, count, body, write_back, final_value):
+        """:param index: loop counter register index
+        :type index: :class:`int`
+        :param count: number of times to run the body
+        :type count: :class:`int`
+        :param body: bytecodes to run on each iteration, without branches
+        :type body: :class:`list` of \
+        :class:`stencil_lang.structures.Bytecode`
+        :param write_back: whether to store the final value in the counter \
+        register after the loop, because the body does not update it
+        :type write_back: :class:`bool`
+        :param final_value: counter value after the loop
+        :type final_value: :class:`int`
+        """
+        self._index = index
+        self._count = count
+        # The JIT can only treat a fixed-size list as immutable.
+        self._body = [None] * len(body)
+        for i in xrange(len(body)):
+            self._body[i] = body[i]
+        self._write_back = write_back
+        self._final_value = final_value
+
+    def eval(self, context):
+        i = 0
+        while i < self._count:
+            loop_driver.jit_merge_point(loop=self, i=i, context=context)
+            for bytecode in self._body:
+                bytecode.eval(context)
+            i += 1
+        if self._write_back:
+            context.registers[self._index] = self._final_value
+
+
+def _reads_register(bytecode, index):
+    if isinstance(bytecode, Pr) or isinstance(bytecode, Add):
+        return bytecode._index == index
+    elif isinstance(bytecode, Bne):
+        return bytecode._register_index == index
+    elif isinstance(bytecode, CountedLoop):
+        for body_bytecode in bytecode._body:
+            if _reads_register(body_bytecode, index):
+                return True
+    return False
+
+
+def _writes_register(bytecode, index):
+    if isinstance(bytecode, Sto) or isinstance(bytecode, Add):
+        return bytecode._index == index
+    elif isinstance(bytecode, CountedLoop):
+        if bytecode._index == index:
+            return True
+        for body_bytecode in bytecode._body:
+            if _writes_register(body_bytecode, index):
+                return True
+    return False
+
+
+def _branch_sources(bytecodes):
+    """Count the branches to each program counter."""
+    sources = [0] * len(bytecodes)
+    for pc in xrange(len(bytecodes)):
+        bytecode = bytecodes[pc]
+        if isinstance(bytecode, Bne):
+            sources[pc + bytecode._offset] += 1
+    return sources
+
+
+def counted_loop(bytecodes, pc, sources):
+    """Recognize a counted loop closed by the branch at `pc`.
+
+    A counted loop looks like ``STO r a``, then a body without branches which
+    adds a constant to ``r`` exactly once and doesn't otherwise store to it,
+    closed by a backward ``BNE r b`` to the start of the body. Nothing else may
+    branch into the loop, and the counter must reach ``b`` exactly.
+
+    :param bytecodes: bytecodes with valid branches
+    :type bytecodes: :class:`list` of \
+    :class:`stencil_lang.structures.Bytecode`
+    :param pc: program counter of a branch
+    :type pc: :class:`int`
+    :param sources: number of branches to each program counter
+    :type sources: :class:`list` of :class:`int`
+    :return: the loop to replace the body and branch with, or :data:`None`
+    :rtype: :class:`CountedLoop`
+    """
+    bne = bytecodes[pc]
+    if not isinstance(bne, Bne) or bne._offset >= 0:
+        return None
+    index = bne._register_index
+    start = pc + bne._offset
+    # Only this branch may lead back to the start of the loop, and nothing may
+    # branch into the middle of it.
+    if start == 0 or sources[start] != 1 or sources[pc] != 0:
+        return None
+    sto = bytecodes[start - 1]
+    if not isinstance(sto, Sto) or sto._index != index:
+        return None
+
+    increment = 0
+    num_increments = 0
+    reads = False
+    body = []
+    for body_pc in xrange(start, pc):
+        bytecode = bytecodes[body_pc]
+        if isinstance(bytecode, Bne) or (body_pc > start and
+                                         sources[body_pc] > 0):
+            return None
+        if isinstance(bytecode, Add) and bytecode._index == index:
+            increment = bytecode._integer
+            num_increments += 1
+            continue
+        if _writes_register(bytecode, index):
+            return None
+        if _reads_register(bytecode, index):
+            reads = True
+        body.append(bytecode)
+    if num_increments != 1 or increment == 0:
+        return None
+
+    distance = bne._value - sto._integer
+    if distance % increment != 0 or distance / increment <= 0:
+        # The loop would never end.
+        return None
+    count = distance / increment
+
+    if reads:
+        # Keep the counter up to date for the body to read.
+        body = [bytecodes[body_pc] for body_pc in xrange(start, pc)]
+    return bne.replaced_by(
+        CountedLoop(index, count, body, not reads, bne._value))
+
+
+def lower_loops(bytecodes):
+    """Replace counted loops with native :class:`CountedLoop` bytecodes.
+
+    Inner loops are lowered first, so that the loops around them no longer
+    contain branches and can be lowered too.
+
+    :param bytecodes: bytecodes with valid branches
+    :type bytecodes: :class:`list` of \
+    :class:`stencil_lang.structures.Bytecode`
+    :return: the lowered bytecodes
+    :rtype: :class:`list` of :class:`stencil_lang.structures.Bytecode`
+    """
+    lowered_any = True
+    while lowered_any:
+        lowered_any = False
+        sources = _branch_sources(bytecodes)
+        for pc in xrange(len(bytecodes)):
+            loop = counted_loop(bytecodes, pc, sources)
+            if loop is not None:
+                bne = bytecodes[pc]
+                assert isinstance(bne, Bne)
+                start = pc + bne._offset
+                assert start >= 0
+                lowered = bytecodes[:start] + [loop] + bytecodes[start + 1:]
+                removed = [False] * len(bytecodes)
+                for body_pc in xrange(start + 1, pc + 1):
+                    removed[body_pc] = True
+                bytecodes = relocate(lowered, removed)
+                lowered_any = True
+                break
+    return bytecodes
@@ -0,0 +1,332 @@
+""":mod:`stencil_lang.interpreter.optimizer` -- Bytecode optimizer
+"""
+
+from rpython.rlib.unroll import unrolling_iterable
+
+from stencil_lang.interpreter.bytecodes import (
+    Sto,
+    Pr,
+    Add,
+    Cmx,
+    Pmx,
+    Smx,
+    Smxf,
+    Wmxf,
+    Snap,
+    Pde,
+    Bne,
+)
+from stencil_lang.interpreter.verifier import (
+    check_branches,
+    initialized_variables,
+)
+from stencil_lang.interpreter.flow import successors, relocate
+
+
+class _Constants(object):
+    """Registers which are initialized, and those with a known value, on every
+    path to a program point.
+    """
+    def __init__(self, initialized, values):
+        """:param initialized: initialized register indices
+        :type initialized: :class:`dict` of :class:`int` to :class:`bool`
+        :param values: known register values
+        :type values: :class:`dict` of :class:`int` to :class:`int`
+        """
+        self.initialized = initialized
+        self.values = values
+
+    def copy(self):
+        return _Constants(self.initialized.copy(), self.values.copy())
+
+    def meet(self, other):
+        """Keep only the facts which also hold in `other`.
+
+        :return: whether anything changed
+        :rtype: :class:`bool`
+        """
+        removed = [index for index in self.initialized
+                   if index not in other.initialized]
+        for index in removed:
+            del self.initialized[index]
+        varying = [index for index in self.values
+                   if (index not in other.values or
+                       other.values[index] != self.values[index])]
+        for index in varying:
+            del self.values[index]
+        return len(removed) > 0 or len(varying) > 0
+
+
+def _transfer_constants(bytecode, constants):
+    if isinstance(bytecode, Sto):
+        constants.initialized[bytecode._index] = True
+        constants.values[bytecode._index] = bytecode._integer
+    elif isinstance(bytecode, Add):
+        index = bytecode._index
+        constants.initialized[index] = True
+        if index in constants.values:
+            constants.values[index] += bytecode._integer
+    elif isinstance(bytecode, Pr):
+        constants.initialized[bytecode._index] = True
+    elif isinstance(bytecode, Bne):
+        constants.initialized[bytecode._register_index] = True
+
+
+def _feasible_successors(bytecodes, pc, constants):
+    """Successors of `pc`, leaving out branches which can never be taken."""
+    bytecode = bytecodes[pc]
+    if isinstance(bytecode, Bne):
+        index = bytecode._register_index
+        if index in constants.values:
+            if constants.values[index] == bytecode._value:
+                return [pc + 1]
+            return [pc + bytecode._offset]
+    return successors(bytecodes, pc)
+
+
+def _constants_in(bytecodes):
+    """Conditional constant propagation over the registers.
+
+    :return: facts for each program counter, :data:`None` if unreachable
+    :rtype: :class:`list`
+    """
+    program_length = len(bytecodes)
+    constants_in = [None] * program_length
+    if program_length == 0:
+        return constants_in
+    constants_in[0] = _Constants({}, {})
+    worklist = [0]
+    while worklist:
+        pc = worklist.pop()
+        constants_out = constants_in[pc].copy()
+        _transfer_constants(bytecodes[pc], constants_out)
+        for successor in _feasible_successors(bytecodes, pc, constants_out):
+            if successor >= program_length:
+                continue
+            successor_constants = constants_in[successor]
+            if successor_constants is None:
+                constants_in[successor] = constants_out.copy()
+                worklist.append(successor)
+            elif successor_constants.meet(constants_out):
+                worklist.append(successor)
+    return constants_in
+
+
+def propagate_constants(bytecodes):
+    """Propagate constant register values and remove unreachable code.
+
+    ``ADD``\\ s to registers with a known value become ``STO``\\ s, branches
+    whose outcome is known and ``ADD r 0`` are removed, as is any code which
+    can never be reached.
+
+    :param bytecodes: bytecodes to optimize
+    :type bytecodes: :class:`list` of \
+    :class:`stencil_lang.structures.Bytecode`
+    :return: the optimized bytecodes
+    :rtype: :class:`list` of :class:`stencil_lang.structures.Bytecode`
+    """
+    constants_in = _constants_in(bytecodes)
+    program_length = len(bytecodes)
+    rewritten = []
+    removed = [False] * program_length
+    for pc in xrange(program_length):
+        bytecode = bytecodes[pc]
+        constants = constants_in[pc]
+        if constants is None:
+            removed[pc] = True
+        elif isinstance(bytecode, Add):
+            index = bytecode._index
+            if index in constants.values:
+                bytecode = bytecode.replaced_by(
+                    Sto(index, constants.values[index] + bytecode._integer))
+            elif bytecode._integer == 0 and index in constants.initialized:
+                removed[pc] = True
+        elif isinstance(bytecode, Bne):
+            index = bytecode._register_index
+            if index in constants.initialized and bytecode._offset == 1:
+                # Both outcomes continue with the next bytecode.
+                removed[pc] = True
+            elif (index in constants.values and
+                    constants.values[index] == bytecode._value):
+                removed[pc] = True
+        rewritten.append(bytecode)
+    return relocate(rewritten, removed)
+
+
+def _live_out(bytecodes):
+    """Backward liveness analysis over the registers.
+
+    :return: registers which may be read later, for each program counter
+    :rtype: :class:`list` of :class:`dict`
+    """
+    program_length = len(bytecodes)
+    predecessors = [[] for _ in xrange(program_length)]
+    for pc in xrange(program_length):
+        for successor in successors(bytecodes, pc):
+            if successor < program_length:
+                predecessors[successor].append(pc)
+
+    live_in = [{} for _ in xrange(program_length)]
+    live_out = [{} for _ in xrange(program_length)]
+    worklist = range(program_length)
+    while worklist:
+        pc = worklist.pop()
+        live = {}
+        for successor in successors(bytecodes, pc):
+            if successor < program_length:
+                live.update(live_in[successor])
+        live_out[pc] = live
+        live = live.copy()
+        bytecode = bytecodes[pc]
+        if isinstance(bytecode, Sto):
+            if bytecode._index in live:
+                del live[bytecode._index]
+        elif isinstance(bytecode, Add):
+            live[bytecode._index] = True
+        elif isinstance(bytecode, Pr):
+            live[bytecode._index] = True
+        elif isinstance(bytecode, Bne):
+            live[bytecode._register_index] = True
+        if len(live) != len(live_in[pc]):
+            # Live sets only ever grow, so a size change is a change.
+            live_in[pc] = live
+            for predecessor in predecessors[pc]:
+                worklist.append(predecessor)
+    return live_out
+
+
+def eliminate_dead_stores(bytecodes):
+    """Remove ``STO``\\ s and ``ADD``\\ s whose results are never read.
+
+    An ``ADD`` is only removed if its register is known to be initialized,
+    because it would otherwise raise an error.
+
+    :param bytecodes: bytecodes to optimize
+    :type bytecodes: :class:`list` of \
+    :class:`stencil_lang.structures.Bytecode`
+    :return: the optimized bytecodes
+    :rtype: :class:`list` of :class:`stencil_lang.structures.Bytecode`
+    """
+    while True:
+        live_out = _live_out(bytecodes)
+        facts_in = initialized_variables(bytecodes)
+        program_length = len(bytecodes)
+        removed = [False] * program_length
+        any_removed = False
+        for pc in xrange(program_length):
+            bytecode = bytecodes[pc]
+            if isinstance(bytecode, Sto):
+                removed[pc] = bytecode._index not in live_out[pc]
+            elif isinstance(bytecode, Add):
+                facts = facts_in[pc]
+                removed[pc] = (bytecode._index not in live_out[pc] and
+                               facts is not None and
+                               bytecode._index in facts.registers)
+            if removed[pc]:
+                any_removed = True
+        if not any_removed:
+            return bytecodes
+        # Removing an ADD can make the store before it dead too.
+        bytecodes = relocate(bytecodes, removed)
+
+
+def eliminate_unused_matrices(bytecodes):
+    """Remove ``CMX``\\ s and ``SMX``\\ s of matrices which are never read.
+
+    A matrix is only removed if none of its bytecodes could raise an error:
+    all of its ``CMX``\\ s have the same valid dimensions and all of its
+    ``SMX``\\ s set an initialized matrix with the right number of values.
+    Matrices set by ``SMXF`` are kept, as reading the file could fail, as are
+    matrices with a bytecode which a branch goes to, since the branch would
+    keep that bytecode alone.
+
+    :param bytecodes: bytecodes to optimize
+    :type bytecodes: :class:`list` of \
+    :class:`stencil_lang.structures.Bytecode`
+    :return: the optimized bytecodes
+    :rtype: :class:`list` of :class:`stencil_lang.structures.Bytecode`
+    """
+    # Matrices which must be kept.
+    used = {}
+    # Dimensions of each created matrix.
+    dimensions = {}
+    for bytecode in bytecodes:
+        if isinstance(bytecode, Pmx):
+            used[bytecode._index] = True
+        elif isinstance(bytecode, Pde):
+            used[bytecode._stencil_index] = True
+            used[bytecode._matrix_index] = True
+        elif isinstance(bytecode, Smxf):
+            used[bytecode._index] = True
+        elif isinstance(bytecode, Wmxf):
+            used[bytecode._index] = True
+        elif isinstance(bytecode, Snap):
+            used[bytecode._index] = True
+        elif isinstance(bytecode, Cmx):
+            index = bytecode._index
+            rows = bytecode._rows
+            cols = bytecode._cols
+            if rows <= 0 or cols <= 0:
+                used[index] = True
+            elif index not in dimensions:
+                dimensions[index] = [rows, cols]
+            elif dimensions[index] != [rows, cols]:
+                used[index] = True
+
+    facts_in = initialized_variables(bytecodes)
+    program_length = len(bytecodes)
+    for pc in xrange(program_length):
+        bytecode = bytecodes[pc]
+        if isinstance(bytecode, Bne):
+            destination = pc + bytecode._offset
+            if destination < program_length:
+                target = bytecodes[destination]
+                if isinstance(target, Cmx):
+                    used[target._index] = True
+                elif isinstance(target, Smx):
+                    used[target._index] = True
+        elif isinstance(bytecode, Smx):
+            index = bytecode._index
+            facts = facts_in[pc]
+            if (facts is None or index not in facts.matrices or
+                    index not in dimensions):
+                used[index] = True
+            else:
+                rows_cols = dimensions[index]
+                if len(bytecode._real_list) != rows_cols[0] * rows_cols[1]:
+                    used[index] = True
+
+    removed = [False] * program_length
+    for pc in xrange(program_length):
+        bytecode = bytecodes[pc]
+        if isinstance(bytecode, Cmx) or isinstance(bytecode, Smx):
+            removed[pc] = bytecode._index not in used
+    return relocate(bytecodes, removed)
+
+
+PASSES = [
+    propagate_constants,
+    eliminate_dead_stores,
+    eliminate_unused_matrices,
+]
+"""Optimization passes, in the order in which they run."""
+
+_unrolled_passes = unrolling_iterable(PASSES)
+
+
+def optimize(bytecodes):
+    """Optimize a program.
+
+    :param bytecodes: bytecodes to optimize
+    :type bytecodes: :class:`list` of \
+    :class:`stencil_lang.structures.Bytecode`
+    :return: the optimized bytecodes
+    :rtype: :class:`list` of :class:`stencil_lang.structures.Bytecode`
+    :raises stencil_lang.errors.InvalidBranchOffsetError: if any branch is \
+    invalid
+    """
+    # The passes rely on every branch having a valid destination.
+    check_branches(bytecodes)
+    for optimization in _unrolled_passes:
+        bytecodes = optimization(bytecodes)
+    return bytecodes
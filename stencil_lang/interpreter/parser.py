@@ -50,6 +50,8 @@ class Parser(BaseParser):
     @_pg.production('stmt : pmx')
     @_pg.production('stmt : smx')
     @_pg.production('stmt : smxf')
+    @_pg.production('stmt : wmxf')
+    @_pg.production('stmt : snap')
     @_pg.production('stmt : pde')
     @_pg.production('stmt : bne')
     def _stmt(self, p):
@@ -101,6 +103,24 @@ class Parser(BaseParser):
         filename = filename_with_right_quote[:-1]
         return Smxf(index, filename)
 
+    @_pg.production('wmxf : WMXF index FILENAME')
+    def _wmxf(self, p):
+        index = p[1].get_int()
+        filename_with_quotes = p[2].getstr()
+        # See _smxf.
+        filename_with_right_quote = filename_with_quotes[1:]
+        filename = filename_with_right_quote[:-1]
+        return Wmxf(index, filename)
+
+    @_pg.production('snap : SNAP index FILENAME')
+    def _snap(self, p):
+        index = p[1].get_int()
+        filename_with_quotes = p[2].getstr()
+        # See _smxf.
+        filename_with_right_quote = filename_with_quotes[1:]
+        filename = filename_with_right_quote[:-1]
+        return Snap(index, filename)
+
     @_pg.production('pde : PDE index index')
     def _pde(self, p):
         stencil_index = p[1].get_int()
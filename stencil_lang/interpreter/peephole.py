@@ -0,0 +1,232 @@
+""":mod:`stencil_lang.interpreter.peephole` -- Superinstruction fusion
+"""
+
+from rpython.rlib.unroll import unrolling_iterable
+
+from stencil_lang.structures import Bytecode
+from stencil_lang.errors import UninitializedVariableError
+from stencil_lang.interpreter.bytecodes import (
+    Add,
+    Pde,
+    Bne,
+    _safe_get_matrix,
+    _apply_stencil,
+)
+
+
+class AddBne(Bytecode):
+    """Superinstruction for ``ADD r k`` followed by ``BNE r n off``."""
+    opcode = 'ADDBNE'
+
+    def __init__(self, index, integer, value, destination):
+        """:param index: register index to which to add and then check
+        :type index: :class:`int`
+        :param integer: integer to add to register
+        :type integer: :class:`int`
+        :param value: value with which to compare to register
+        :type value: :class:`int`
+        :param destination: absolute instruction to which to jump
+        :type destination: :class:`int`
+        """
+        self._index = index
+        self._integer = integer
+        self._value = value
+        self._destination = destination
+
+    def eval(self, context):
+        index = self._index
+        try:
+            register_value = context.registers[index] + self._integer
+        except KeyError:
+            raise UninitializedVariableError('Register', index)
+        context.registers[index] = register_value
+        if register_value != self._value:
+            # Subtract one because the main loop increment will add another.
+            context.pc = self._destination - 1
+
+
+class PdeLoop(Bytecode):
+    """Superinstruction for the counted stencil loop ``ADD r k``, ``PDE s m``,
+    ``BNE r n -2``.
+    """
+    opcode = 'PDELOOP'
+
+    def __init__(self, index, integer, stencil_index, matrix_index, value):
+        """:param index: loop counter register index
+        :type index: :class:`int`
+        :param integer: integer to add to the counter on each iteration
+        :type integer: :class:`int`
+        :param stencil_index: index of the stencil
+        :type stencil_index: :class:`int`
+        :param matrix_index: index of the matrix
+        :type matrix_index: :class:`int`
+        :param value: counter value at which the loop ends
+        :type value: :class:`int`
+        """
+        self._index = index
+        self._integer = integer
+        self._stencil_index = stencil_index
+        self._matrix_index = matrix_index
+        self._value = value
+
+    def eval(self, context):
+        index = self._index
+        matrix_index = self._matrix_index
+        while True:
+            try:
+                register_value = context.registers[index] + self._integer
+            except KeyError:
+                raise UninitializedVariableError('Register', index)
+            context.registers[index] = register_value
+            stencil = _safe_get_matrix(context, self._stencil_index)
+            matrix = _safe_get_matrix(context, matrix_index)
+            context.matrices[matrix_index] = _apply_stencil(context, stencil,
+                                                            matrix)
+            if register_value == self._value:
+                break
+
+
+def _matches_add_bne(bytecodes, pc):
+    return (isinstance(bytecodes[pc], Add) and
+            isinstance(bytecodes[pc + 1], Bne))
+
+
+def _fuse_add_bne(bytecodes, pc):
+    add = bytecodes[pc]
+    assert isinstance(add, Add)
+    bne = bytecodes[pc + 1]
+    assert isinstance(bne, Bne)
+    if add._index != bne._register_index:
+        return None
+    # The destination is relocated once all fusions are known.
+    return add.replaced_by(
+        AddBne(add._index, add._integer, bne._value, pc + 1 + bne._offset))
+
+
+def _matches_add_pde_bne(bytecodes, pc):
+    return (isinstance(bytecodes[pc], Add) and
+            isinstance(bytecodes[pc + 1], Pde) and
+            isinstance(bytecodes[pc + 2], Bne))
+
+
+def _fuse_add_pde_bne(bytecodes, pc):
+    add = bytecodes[pc]
+    assert isinstance(add, Add)
+    pde = bytecodes[pc + 1]
+    assert isinstance(pde, Pde)
+    bne = bytecodes[pc + 2]
+    assert isinstance(bne, Bne)
+    # Only fuse loops which branch straight back to the ADD.
+    if add._index != bne._register_index or bne._offset != -2:
+        return None
+    return add.replaced_by(
+        PdeLoop(add._index, add._integer, pde._stencil_index,
+                pde._matrix_index, bne._value))
+
+
+FUSIONS = [
+    (3, _matches_add_pde_bne, _fuse_add_pde_bne, True),
+    (2, _matches_add_bne, _fuse_add_bne, False),
+]
+"""Fusion table of the length of each bytecode sequence, the function which
+checks whether a sequence starts at a program counter, the function which
+builds its superinstruction and whether the superinstruction runs a whole
+loop. Longer sequences must come first. Both functions are called with the
+bytecodes and the program counter of the sequence, and builders return
+:data:`None` to decline fusion.
+
+Each sequence has its own functions, instead of a tuple of classes, so that
+RPython sees a constant class for each bytecode of the sequence.
+"""
+
+_unrolled_fusions = unrolling_iterable(FUSIONS)
+
+
+def _branch_targets(bytecodes):
+    """Find all branch destinations in the program.
+
+    :return: whether each program counter is a branch destination, or \
+    :data:`None` if any branch is invalid
+    :rtype: :class:`list` of :class:`bool`
+    """
+    program_length = len(bytecodes)
+    targets = [False] * program_length
+    for pc in xrange(program_length):
+        bytecode = bytecodes[pc]
+        if isinstance(bytecode, Bne):
+            destination = pc + bytecode._offset
+            if (bytecode._offset == 0 or
+                    destination >= program_length or
+                    destination < 0):
+                return None
+            targets[destination] = True
+    return targets
+
+
+def _fits(bytecodes, pc, length, targets):
+    if pc + length > len(bytecodes):
+        return False
+    # Only the first bytecode of a sequence may be jumped to.
+    for i in xrange(1, length):
+        if targets[pc + i]:
+            return False
+    return True
+
+
+def fuse(bytecodes, whole_loops=True):
+    """Replace common bytecode sequences with superinstructions.
+
+    The returned program has the same semantics as the original. Programs
+    containing invalid branches are returned unchanged so that they fail at
+    the same point as before.
+
+    :param bytecodes: bytecodes to optimize
+    :type bytecodes: :class:`list` of \
+    :class:`stencil_lang.structures.Bytecode`
+    :param whole_loops: whether to also fuse loops into superinstructions \
+    which run the whole loop, leaving no point between bytecodes within it
+    :type whole_loops: :class:`bool`
+    :return: the optimized bytecodes
+    :rtype: :class:`list` of :class:`stencil_lang.structures.Bytecode`
+    """
+    targets = _branch_targets(bytecodes)
+    if targets is None:
+        return bytecodes
+
+    # First pass: fuse sequences, remembering where each bytecode came from.
+    program_length = len(bytecodes)
+    fused_bytecodes = []
+    old_pcs = []
+    new_pcs = [-1] * program_length
+    pc = 0
+    while pc < program_length:
+        bytecode = bytecodes[pc]
+        length = 1
+        for fusion_length, matches, build, runs_loop in _unrolled_fusions:
+            if (length == 1 and (whole_loops or not runs_loop) and
+                    _fits(bytecodes, pc, fusion_length, targets) and
+                    matches(bytecodes, pc)):
+                fused = build(bytecodes, pc)
+                if fused is not None:
+                    bytecode = fused
+                    length = fusion_length
+        new_pcs[pc] = len(fused_bytecodes)
+        fused_bytecodes.append(bytecode)
+        old_pcs.append(pc)
+        pc += length
+
+    # Second pass: relocate branches to the new program counters.
+    new_bytecodes = []
+    for new_pc in xrange(len(fused_bytecodes)):
+        bytecode = fused_bytecodes[new_pc]
+        if isinstance(bytecode, Bne):
+            destination = new_pcs[old_pcs[new_pc] + bytecode._offset]
+            bytecode = bytecode.replaced_by(
+                Bne(bytecode._register_index, bytecode._value,
+                    destination - new_pc))
+        elif isinstance(bytecode, AddBne):
+            bytecode = bytecode.replaced_by(
+                AddBne(bytecode._index, bytecode._integer, bytecode._value,
+                       new_pcs[bytecode._destination]))
+        new_bytecodes.append(bytecode)
+    return new_bytecodes
@@ -0,0 +1,116 @@
+""":mod:`stencil_lang.interpreter.profiler` -- Per-opcode execution profiler
+"""
+
+from rpython.rlib.listsort import make_timsort_class
+from rpython.rlib.rfloat import formatd
+
+from stencil_lang.interpreter.scanner import scan
+from stencil_lang.interpreter.tokens import LITERALS
+from stencil_lang.utils import rjust, ljust
+
+
+def statement_lines(source_code):
+    """Find the source line on which each statement starts.
+
+    :param source_code: source code which parses without errors
+    :type source_code: :class:`str`
+    :return: line number of each statement, starting at one
+    :rtype: :class:`list` of :class:`int`
+    """
+    lines = []
+    for token in scan(source_code):
+        # Every statement starts with a literal, and only there.
+        if token.gettokentype() in LITERALS:
+            lines.append(token.getsourcepos().lineno)
+    return lines
+
+
+class ProfileEntry(object):
+    """Execution count and cumulative time of one row of a profile."""
+    def __init__(self, name):
+        """:param name: opcode or source line of the row
+        :type name: :class:`str`
+        """
+        self.name = name
+        self.count = 0
+        self.seconds = 0.0
+
+
+def _slower(entry, other):
+    return entry.seconds > other.seconds
+
+
+_SlowestFirst = make_timsort_class(lt=_slower)
+
+
+class Profile(object):
+    """Execution counts and cumulative wall time per opcode and per source
+    line, recorded by :func:`stencil_lang.interpreter.evaluator.eval_`.
+
+    The bytecodes recorded are those which run after optimization, so
+    superinstructions and lowered loops have rows of their own, and are
+    counted against the source line of the bytecode they replaced.
+    """
+    def __init__(self):
+        self._opcodes = {}
+        self._line_entries = {}
+
+    def _entry(self, entries, name):
+        try:
+            return entries[name]
+        except KeyError:
+            entry = ProfileEntry(name)
+            entries[name] = entry
+            return entry
+
+    def record(self, bytecode, seconds):
+        """Record one execution of a bytecode.
+
+        :param bytecode: the bytecode which ran
+        :type bytecode: :class:`stencil_lang.structures.Bytecode`
+        :param seconds: wall time taken
+        :type seconds: :class:`float`
+        """
+        entry = self._entry(self._opcodes, bytecode.opcode)
+        entry.count += 1
+        entry.seconds += seconds
+        entry = self._entry(self._line_entries, '%d' % bytecode.line)
+        entry.count += 1
+        entry.seconds += seconds
+
+    def opcode_entries(self):
+        """:return: a row for each opcode which ran, slowest first
+        :rtype: :class:`list` of :class:`ProfileEntry`
+        """
+        return _sorted_entries(self._opcodes)
+
+    def line_entries(self):
+        """:return: a row for each source line which ran, slowest first
+        :rtype: :class:`list` of :class:`ProfileEntry`
+        """
+        return _sorted_entries(self._line_entries)
+
+    def format(self):
+        """Format the profile as tables.
+
+        :return: the tables
+        :rtype: :class:`str`
+        """
+        return (_format_table('opcode', self.opcode_entries()) + '\n' +
+                _format_table('line', self.line_entries()))
+
+
+def _sorted_entries(entries):
+    result = entries.values()
+    _SlowestFirst(result).sort()
+    return result
+
+
+def _format_table(title, entries):
+    rows = ['%s %s %s' % (ljust(title, 8), rjust('count', 12),
+                          rjust('seconds', 14))]
+    for entry in entries:
+        rows.append('%s %s %s' % (
+            ljust(entry.name, 8), rjust('%d' % entry.count, 12),
+            rjust(formatd(entry.seconds, 'f', 6), 14)))
+    return '\n'.join(rows) + '\n'
@@ -0,0 +1,139 @@
+""":mod:`stencil_lang.interpreter.scanner` --- Hand-written scanner
+"""
+
+from rply.errors import LexingError
+from rply.lexer import LexerStream
+from rply.token import SourcePosition, Token
+
+from stencil_lang.interpreter.tokens import LITERALS
+
+
+def _is_space(char):
+    # Same characters as `\s' in the generated lexer's ignore pattern.
+    return (char == ' ' or char == '\t' or char == '\n' or char == '\r' or
+            char == '\f' or char == '\v')
+
+
+def _is_digit(char):
+    return '0' <= char <= '9'
+
+
+def _is_word(char):
+    # Same characters as `\w', which determine the `\b' word boundaries around
+    # literals.
+    return (('a' <= char <= 'z') or ('A' <= char <= 'Z') or _is_digit(char) or
+            char == '_')
+
+
+class ScannerStream(LexerStream):
+    """Token stream produced by a single pass over the source text.
+
+    Each token is chosen by looking at its first character instead of trying
+    every pattern in :data:`stencil_lang.interpreter.tokens.TOKENS` in turn,
+    but the tokens and errors are the same as those of the generated lexer.
+    """
+    def __init__(self, text):
+        """:param text: text to scan
+        :type text: :class:`str`
+        """
+        LexerStream.__init__(self, None, text)
+        # Index of the last newline before `idx', for column numbers.
+        self._last_newline = -1
+
+    def _skip_digits(self, pos):
+        s = self.s
+        end = len(s)
+        while pos < end and _is_digit(s[pos]):
+            pos += 1
+        return pos
+
+    def _scan_literal(self, start):
+        """Return the name of the literal at `start`, or the empty string."""
+        s = self.s
+        if start > 0 and _is_word(s[start - 1]):
+            return ''
+        end = start
+        while end < len(s) and _is_word(s[end]):
+            end += 1
+        word = s[start:end]
+        for literal in LITERALS:
+            if word == literal:
+                return literal
+        return ''
+
+    def _scan_number(self, start):
+        """Return the name of the number token at `start` and its end, or the
+        empty string if there is none.
+        """
+        s = self.s
+        end = len(s)
+        pos = start
+        if s[pos] == '-':
+            pos += 1
+        if pos == end or not _is_digit(s[pos]):
+            return '', start
+        int_end = self._skip_digits(pos)
+        pos = int_end
+        if pos < end and s[pos] == '.':
+            pos = self._skip_digits(pos + 1)
+        if pos < end and s[pos] == 'e':
+            exponent = pos + 1
+            if exponent < end and s[exponent] == '-':
+                exponent += 1
+            if exponent < end and _is_digit(s[exponent]):
+                return 'REAL_SCI', self._skip_digits(exponent)
+        if int_end < end and s[int_end] == '.':
+            return 'REAL', self._skip_digits(int_end + 1)
+        if s[start] == '-':
+            return 'NEG_INT', int_end
+        return 'POS_INT', int_end
+
+    def _token(self, name, start, end):
+        s = self.s
+        colno = start - self._last_newline
+        for pos in xrange(start, end):
+            if s[pos] == '\n':
+                self._lineno += 1
+                self._last_newline = pos
+        self.idx = end
+        return Token(name, s[start:end],
+                     SourcePosition(start, self._lineno, colno))
+
+    def next(self):
+        s = self.s
+        end = len(s)
+        start = self.idx
+        while start < end and _is_space(s[start]):
+            if s[start] == '\n':
+                self._lineno += 1
+                self._last_newline = start
+            start += 1
+        self.idx = start
+        if start >= end:
+            raise StopIteration
+        char = s[start]
+        if 'A' <= char <= 'Z':
+            literal = self._scan_literal(start)
+            if literal:
+                return self._token(literal, start, start + len(literal))
+        elif _is_digit(char) or char == '-':
+            name, token_end = self._scan_number(start)
+            if name:
+                return self._token(name, start, token_end)
+        elif char == '"':
+            close = s.find('"', start + 1)
+            if close > start + 1:
+                return self._token('FILENAME', start, close + 1)
+        raise LexingError(None, SourcePosition(start, -1, -1))
+
+
+def scan(text):
+    """Scan text using the hand-written scanner. This is much faster than
+    :func:`stencil_lang.interpreter.lexer.lex` and produces the same tokens.
+
+    :param text: text to scan
+    :type text: :class:`str`
+    :return: token stream
+    :rtype: :class:`ScannerStream`
+    """
+    return ScannerStream(text)
@@ -0,0 +1,94 @@
+""":mod:`stencil_lang.interpreter.serialization` -- Binary encoding shared by
+bytecode caches and checkpoints
+"""
+
+from rpython.rlib.rarithmetic import intmask, r_ulonglong
+from rpython.rlib.rstruct.ieee import float_pack, float_unpack
+
+
+class CorruptDataError(Exception):
+    """Raised when encoded data cannot be decoded."""
+    pass
+
+
+def write_int(builder, value):
+    """Append an integer as eight little-endian bytes, regardless of the
+    platform's word size.
+
+    :param builder: builder to which to append
+    :type builder: :class:`rpython.rlib.rstring.StringBuilder`
+    :param value: integer to append
+    :type value: :class:`int`
+    """
+    for i in xrange(8):
+        builder.append(chr((value >> (i * 8)) & 0xff))
+
+
+def write_float(builder, value):
+    """Append a float as eight little-endian bytes of an IEEE double.
+
+    :param builder: builder to which to append
+    :type builder: :class:`rpython.rlib.rstring.StringBuilder`
+    :param value: float to append
+    :type value: :class:`float`
+    """
+    bits = float_pack(value, 8)
+    for i in xrange(8):
+        builder.append(chr(intmask((bits >> (i * 8)) & 0xff)))
+
+
+def write_string(builder, value):
+    """Append a string, preceded by its length.
+
+    :param builder: builder to which to append
+    :type builder: :class:`rpython.rlib.rstring.StringBuilder`
+    :param value: string to append
+    :type value: :class:`str`
+    """
+    write_int(builder, len(value))
+    builder.append(value)
+
+
+class Reader(object):
+    """Cursor over encoded data. Each method raises
+    :class:`CorruptDataError` if the data ends too soon."""
+    def __init__(self, data, pos):
+        """:param data: encoded data
+        :type data: :class:`str`
+        :param pos: position at which to start reading
+        :type pos: :class:`int`
+        """
+        self._data = data
+        self._pos = pos
+
+    def _take(self, length):
+        start = self._pos
+        end = start + length
+        if length < 0 or end > len(self._data):
+            raise CorruptDataError()
+        assert start >= 0 and end >= 0
+        self._pos = end
+        return self._data[start:end]
+
+    def at_end(self):
+        return self._pos == len(self._data)
+
+    def read_tag(self):
+        return self._take(1)
+
+    def read_int(self):
+        data = self._take(8)
+        value = 0
+        for i in xrange(8):
+            value |= ord(data[i]) << (i * 8)
+        return intmask(value)
+
+    def read_float(self):
+        data = self._take(8)
+        bits = r_ulonglong(0)
+        for i in xrange(8):
+            bits |= r_ulonglong(ord(data[i])) << (i * 8)
+        return float_unpack(bits, 8)
+
+    def read_string(self):
+        return self._take(self.read_int())
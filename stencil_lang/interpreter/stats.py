@@ -0,0 +1,106 @@
+""":mod:`stencil_lang.interpreter.stats` -- Phase timing and throughput
+"""
+
+from rpython.rlib.rfloat import formatd
+
+_BYTES_PER_REAL = 8
+
+
+def _format_seconds(seconds):
+    return formatd(seconds, 'f', 6)
+
+
+class Stats(object):
+    """Time spent in each phase of running a program, and throughput of its
+    stencil applications and matrix I/O.
+    """
+    def __init__(self):
+        self._phase_names = []
+        self._phase_seconds = []
+        self.io_seconds = 0.0
+        """Time spent reading matrix files and printing matrices."""
+        self.pde_seconds = 0.0
+        """Time spent applying stencils."""
+        self.cells_updated = 0
+        """Number of matrix cells computed by stencil applications."""
+        self.bytes_read = 0
+        """Size of the matrix files read."""
+        self.peak_matrix_bytes = 0
+        """Largest size of the contents of all matrices at once."""
+
+    def add_phase(self, name, seconds):
+        """Add time spent in a phase.
+
+        :param name: phase name
+        :type name: :class:`str`
+        :param seconds: wall time spent
+        :type seconds: :class:`float`
+        """
+        for i in xrange(len(self._phase_names)):
+            if self._phase_names[i] == name:
+                self._phase_seconds[i] += seconds
+                return
+        self._phase_names.append(name)
+        self._phase_seconds.append(seconds)
+
+    def phase_seconds(self, name):
+        """:return: time spent in a phase, zero if it never ran
+        :rtype: :class:`float`
+        """
+        for i in xrange(len(self._phase_names)):
+            if self._phase_names[i] == name:
+                return self._phase_seconds[i]
+        return 0.0
+
+    def record_io(self, seconds):
+        self.io_seconds += seconds
+
+    def record_read(self, num_bytes):
+        self.bytes_read += num_bytes
+
+    def record_pde(self, cells, seconds):
+        self.cells_updated += cells
+        self.pde_seconds += seconds
+
+    def record_matrices(self, matrices, extra_reals):
+        """Update the peak matrix memory.
+
+        :param matrices: the matrix bank
+        :type matrices: :class:`dict` of :class:`int` to \
+        :class:`stencil_lang.structures.Matrix`
+        :param extra_reals: number of reals in matrices not in the bank yet
+        :type extra_reals: :class:`int`
+        """
+        reals = extra_reals
+        for matrix in matrices.itervalues():
+            reals += len(matrix.contents)
+        matrix_bytes = reals * _BYTES_PER_REAL
+        if matrix_bytes > self.peak_matrix_bytes:
+            self.peak_matrix_bytes = matrix_bytes
+
+    def cells_per_second(self):
+        """:return: cells updated per second spent applying stencils
+        :rtype: :class:`float`
+        """
+        if self.pde_seconds <= 0.0:
+            return 0.0
+        return self.cells_updated / self.pde_seconds
+
+    def format(self):
+        """Format the statistics as ``key=value`` lines.
+
+        :return: the statistics
+        :rtype: :class:`str`
+        """
+        lines = []
+        for i in xrange(len(self._phase_names)):
+            lines.append('%s_seconds=%s' % (
+                self._phase_names[i], _format_seconds(self._phase_seconds[i])))
+        lines.append('io_seconds=%s' % _format_seconds(self.io_seconds))
+        lines.append('pde_seconds=%s' % _format_seconds(self.pde_seconds))
+        lines.append('cells_updated=%d' % self.cells_updated)
+        lines.append('cells_per_second=%s' %
+                     formatd(self.cells_per_second(), 'f', 0))
+        lines.append('matrix_bytes_read=%d' % self.bytes_read)
+        lines.append('peak_matrix_bytes=%d' % self.peak_matrix_bytes)
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,256 @@
+""":mod:`stencil_lang.interpreter.streaming` -- Streaming execution
+"""
+
+from rply.errors import LexingError
+
+from stencil_lang.errors import ParseError
+from stencil_lang.interpreter.tokens import LITERALS
+from stencil_lang.interpreter.scanner import ScannerStream, _is_space
+from stencil_lang.interpreter.bytecodes import (
+    Sto,
+    Pr,
+    Add,
+    Cmx,
+    Pmx,
+    Smx,
+    Smxf,
+    Wmxf,
+    Snap,
+    Pde,
+    Bne,
+)
+
+CHUNK_SIZE = 64 * 1024
+"""Number of bytes to read from the input at a time."""
+
+_LITERALS = {}
+for _literal in LITERALS:
+    _LITERALS[_literal] = True
+
+
+def _last_space(text):
+    pos = len(text) - 1
+    while pos >= 0 and not _is_space(text[pos]):
+        pos -= 1
+    return pos
+
+
+class TokenReader(object):
+    """Scans tokens from a stream as its text arrives.
+
+    Only text up to the last whitespace read so far is scanned, so that no
+    token is cut off at the end of a chunk. A file name may contain
+    whitespace, so one which is not closed yet is scanned again once more
+    text has arrived.
+    """
+    def __init__(self, stream):
+        """:param stream: stream from which to read source code
+        :type stream: :class:`rpython.rlib.streamio.Stream`
+        """
+        self._stream = stream
+        self._scanner = ScannerStream('')
+        # Text which has been read but not scanned.
+        self._pending = ''
+        self._at_eof = False
+
+    def _fill(self):
+        while True:
+            chunk = self._stream.read(CHUNK_SIZE)
+            if not chunk:
+                self._at_eof = True
+                self._scanner = ScannerStream(self._pending)
+                self._pending = ''
+                return
+            text = self._pending + chunk
+            cut = _last_space(text) + 1
+            if cut > 0:
+                self._scanner = ScannerStream(text[:cut])
+                self._pending = text[cut:]
+                return
+            self._pending = text
+
+    def next(self):
+        """Scan the next token.
+
+        :return: the token, or :data:`None` at the end of the input
+        :rtype: :class:`rply.token.Token`
+        :raises rply.errors.LexingError: on invalid input
+        """
+        while True:
+            try:
+                return self._scanner.next()
+            except StopIteration:
+                if self._at_eof:
+                    return None
+                self._fill()
+            except LexingError as error:
+                text = self._scanner.s
+                pos = error.getsourcepos().idx
+                if self._at_eof or text[pos] != '"':
+                    raise
+                # The rest of the file name hasn't been read yet.
+                assert pos >= 0
+                self._pending = text[pos:] + self._pending
+                self._fill()
+
+
+class StatementReader(object):
+    """Parses one statement at a time from a stream of tokens.
+
+    Statements are parsed with the same rules and errors as
+    :mod:`stencil_lang.interpreter.parser`, which can only parse a whole
+    program at once.
+    """
+    def __init__(self, tokens):
+        """:param tokens: tokens to parse
+        :type tokens: :class:`TokenReader`
+        """
+        self._tokens = tokens
+        self._lookahead = None
+        self._peeked = False
+
+    def _peek(self):
+        if not self._peeked:
+            self._lookahead = self._tokens.next()
+            self._peeked = True
+        return self._lookahead
+
+    def _peek_name(self):
+        token = self._peek()
+        if token is None:
+            return '$end'
+        return token.gettokentype()
+
+    def _advance(self):
+        name = self._peek_name()
+        self._peeked = False
+        if name == '$end':
+            raise ParseError(name)
+        return self._lookahead.getstr()
+
+    def _expect(self, name):
+        if self._peek_name() != name:
+            raise ParseError(self._peek_name())
+        return self._advance()
+
+    def _index(self):
+        return int(self._expect('POS_INT'))
+
+    def _int(self):
+        name = self._peek_name()
+        if name != 'POS_INT' and name != 'NEG_INT':
+            raise ParseError(name)
+        return int(self._advance())
+
+    def _at_real(self):
+        name = self._peek_name()
+        return (name == 'POS_INT' or name == 'NEG_INT' or name == 'REAL' or
+                name == 'REAL_SCI')
+
+    def _real(self):
+        if not self._at_real():
+            raise ParseError(self._peek_name())
+        return float(self._advance())
+
+    def next_statement(self):
+        """Parse the next statement.
+
+        :return: the statement's bytecode, or :data:`None` at the end of the \
+        input
+        :rtype: :class:`stencil_lang.structures.Bytecode`
+        :raises stencil_lang.errors.ParseError: on invalid input
+        """
+        name = self._peek_name()
+        if name == '$end':
+            return None
+        if name not in _LITERALS:
+            raise ParseError(name)
+        self._advance()
+        if name == 'STO':
+            index = self._index()
+            return Sto(index, self._int())
+        elif name == 'PR':
+            return Pr(self._index())
+        elif name == 'ADD':
+            index = self._index()
+            return Add(index, self._int())
+        elif name == 'CMX':
+            index = self._index()
+            rows = self._index()
+            return Cmx(index, rows, self._index())
+        elif name == 'PMX':
+            return Pmx(self._index())
+        elif name == 'SMX':
+            index = self._index()
+            real_list = [self._real()]
+            while self._at_real():
+                real_list.append(self._real())
+            return Smx(index, real_list)
+        elif name == 'SMXF':
+            index = self._index()
+            filename_with_quotes = self._expect('FILENAME')
+            filename_with_right_quote = filename_with_quotes[1:]
+            return Smxf(index, filename_with_right_quote[:-1])
+        elif name == 'WMXF':
+            index = self._index()
+            filename_with_quotes = self._expect('FILENAME')
+            filename_with_right_quote = filename_with_quotes[1:]
+            return Wmxf(index, filename_with_right_quote[:-1])
+        elif name == 'SNAP':
+            index = self._index()
+            filename_with_quotes = self._expect('FILENAME')
+            filename_with_right_quote = filename_with_quotes[1:]
+            return Snap(index, filename_with_right_quote[:-1])
+        elif name == 'PDE':
+            stencil_index = self._index()
+            return Pde(stencil_index, self._index())
+        # BNE
+        register_index = self._index()
+        value = self._int()
+        return Bne(register_index, value, self._int())
+
+
+def run_stream(stream, context):
+    """Lex, parse and run a program statement by statement as it is read.
+
+    Only the bytecodes are kept, not the source code. Backward branches go to
+    statements which have already been read. A forward branch which is taken
+    waits for its destination to be read. Because the whole program is never
+    seen at once, it is neither optimized nor verified. Errors in later
+    statements are only found after the earlier ones have run.
+
+    :param stream: stream from which to read source code
+    :type stream: :class:`rpython.rlib.streamio.Stream`
+    :param context: the execution context
+    :type context: :class:`stencil_lang.structures.Context`
+    """
+    reader = StatementReader(TokenReader(stream))
+    bytecodes = []
+    bytecode = reader.next_statement()
+    if bytecode is None:
+        # An empty program is a parse error, as with the whole-program parser.
+        raise ParseError('$end')
+    bytecodes.append(bytecode)
+    at_end = False
+    while True:
+        pc = context.pc
+        if pc >= len(bytecodes):
+            if at_end:
+                break
+            bytecode = reader.next_statement()
+            if bytecode is None:
+                at_end = True
+            else:
+                bytecodes.append(bytecode)
+            continue
+        bytecode = bytecodes[pc]
+        if isinstance(bytecode, Bne):
+            while not at_end and pc + bytecode._offset >= len(bytecodes):
+                next_bytecode = reader.next_statement()
+                if next_bytecode is None:
+                    at_end = True
+                else:
+                    bytecodes.append(next_bytecode)
+        context.program_length = len(bytecodes)
+        bytecode.eval(context)
+        context.pc += 1
@@ -0,0 +1,166 @@
+""":mod:`stencil_lang.interpreter.sweep` -- Parameters and parameter sweeps
+
+A program can be given registers and matrices which are set before it
+starts, so that a parameter can be changed without editing the program.
+
+A sweep runs a program once for each value of a register. The program is
+loaded once, and each run is a process forked from the loaded program, with
+at most a given number of runs at once. The runs' outputs are written in the
+order of the values, each preceded by a line ``==> INDEX=VALUE <==``. A run
+only waits for its turn to write once the pipe to which it prints is full.
+"""
+
+import os
+import sys
+
+from rpython.rlib import rthread
+from rpython.rlib.objectmodel import we_are_translated
+
+from stencil_lang.errors import StencilLanguageError
+from stencil_lang.structures import Matrix
+
+DEFAULT_JOBS = 4
+"""Default number of runs of a sweep at once."""
+
+_READ_SIZE = 64 * 1024
+
+
+class Parameters(object):
+    """Registers and matrices set before a program starts."""
+    def __init__(self):
+        self.registers = {}
+        """Register values, by index."""
+        self.matrices = {}
+        """:class:`stencil_lang.structures.Matrix` objects, by index."""
+
+    def seed(self, context):
+        """Set the registers and matrices in a context.
+
+        :param context: the execution context of the program about to start
+        :type context: :class:`stencil_lang.structures.Context`
+        """
+        for index, value in self.registers.iteritems():
+            context.registers[index] = value
+        for index, matrix in self.matrices.iteritems():
+            context.matrices[index] = Matrix(matrix.rows, matrix.cols,
+                                             list(matrix.contents))
+
+
+def sweep_values(start, stop, step):
+    """The values of a sweep, like :func:`range`.
+
+    :param start: first value
+    :type start: :class:`int`
+    :param stop: value at which to stop, which is not included
+    :type stop: :class:`int`
+    :param step: difference between consecutive values, not zero
+    :type step: :class:`int`
+    :return: the values
+    :rtype: :class:`list` of :class:`int`
+    """
+    assert step != 0
+    values = []
+    value = start
+    while (step > 0 and value < stop) or (step < 0 and value > stop):
+        values.append(value)
+        value += step
+    return values
+
+
+def _flush_stdout():
+    if not we_are_translated():
+        # Untranslated, output is buffered, and would be written again by
+        # each forked process.
+        sys.stdout.flush()
+
+
+def _write_all(fd, data):
+    written = 0
+    while written < len(data):
+        written += os.write(fd, data[written:])
+
+
+def _run_job(runner, value, fd):
+    """Run the program with its output going to a pipe. Runs in the forked
+    process, and never returns."""
+    status = 0
+    try:
+        os.dup2(fd, 1)
+        os.close(fd)
+        try:
+            runner.run(value)
+        except StencilLanguageError as error:
+            print '%s: %s' % (error.name, error.__str__())
+        except OSError as error:
+            print 'OSError: %s' % os.strerror(error.errno)
+        _flush_stdout()
+    except Exception:
+        status = 1
+    # Don't run anything the parent would run on exit.
+    os._exit(status)
+
+
+def _start_job(runner, value):
+    """:return: the run's process id and the pipe from which to read its \
+    output"""
+    fds = os.pipe()
+    _flush_stdout()
+    opaqueaddr = rthread.gc_thread_before_fork()
+    pid = os.fork()
+    rthread.gc_thread_after_fork(pid, opaqueaddr)
+    if pid == 0:
+        os.close(fds[0])
+        _run_job(runner, value, fds[1])
+    os.close(fds[1])
+    return [pid, fds[0]]
+
+
+def _finish_job(job):
+    """Copy a run's output to stdout and wait for it to exit.
+
+    :return: the run's exit status
+    """
+    fd = job[1]
+    try:
+        while True:
+            data = os.read(fd, _READ_SIZE)
+            if not data:
+                break
+            _write_all(1, data)
+    finally:
+        os.close(fd)
+        status = os.waitpid(job[0], 0)[1]
+    return status
+
+
+def sweep(runner, index, values, jobs):
+    """Run a program once for each value of a register, on forked processes,
+    and write the outputs in order.
+
+    :param runner: object whose ``run(value)`` method runs the program with \
+    the register set to `value`
+    :type runner: :class:`object`
+    :param index: index of the register, for the headers
+    :type index: :class:`int`
+    :param values: values of the register
+    :type values: :class:`list` of :class:`int`
+    :param jobs: most runs at once
+    :type jobs: :class:`int`
+    """
+    running = []
+    started = 0
+    try:
+        for value in values:
+            while started < len(values) and len(running) < jobs:
+                running.append(_start_job(runner, values[started]))
+                started += 1
+            job = running.pop(0)
+            print '==> %d=%d <==' % (index, value)
+            _flush_stdout()
+            if _finish_job(job) != 0:
+                print 'the program stopped unexpectedly'
+    finally:
+        # Only left over if writing the output failed.
+        for job in running:
+            os.close(job[1])
+            os.waitpid(job[0], 0)
@@ -15,6 +15,8 @@ LITERALS = [
     'PMX',
     'SMXF',
     'SMX',
+    'WMXF',
+    'SNAP',
     'PDE',
     'BNE',
 ]
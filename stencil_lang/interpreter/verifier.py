@@ -0,0 +1,279 @@
+""":mod:`stencil_lang.interpreter.verifier` -- Load-time bytecode verifier
+"""
+
+from stencil_lang.structures import Bytecode
+from stencil_lang.errors import InvalidBranchOffsetError
+from stencil_lang.interpreter.bytecodes import (
+    Sto,
+    Pr,
+    Add,
+    Cmx,
+    Pmx,
+    Smx,
+    Smxf,
+    Wmxf,
+    Snap,
+    Pde,
+    Bne,
+    _apply_stencil,
+)
+from stencil_lang.interpreter.peephole import AddBne, PdeLoop
+from stencil_lang.interpreter.loops import CountedLoop
+from stencil_lang.interpreter.flow import successors
+
+
+class UncheckedAdd(Add):
+    """Add bytecode whose register is known to be initialized."""
+    def eval(self, context):
+        context.registers[self._index] += self._integer
+
+
+class UncheckedPr(Pr):
+    """Print register bytecode whose register is known to be initialized."""
+    def eval(self, context):
+        print context.registers[self._index]
+
+
+class UncheckedPde(Pde):
+    """Partial differential equation bytecode whose stencil and matrix are
+    known to be initialized.
+    """
+    def eval(self, context):
+        matrix_index = self._matrix_index
+        context.matrices[matrix_index] = _apply_stencil(
+            context,
+            context.matrices[self._stencil_index],
+            context.matrices[matrix_index])
+
+
+class UncheckedBne(Bytecode):
+    """Branch-not-equal bytecode with a verified absolute destination and a
+    register known to be initialized.
+    """
+    opcode = 'BNE'
+
+    def __init__(self, register_index, value, destination):
+        """:param register_index: index for register to check
+        :type register_index: :class:`int`
+        :param value: value with which to compare to register
+        :type value: :class:`int`
+        :param destination: absolute instruction to which to jump
+        :type destination: :class:`int`
+        """
+        self._register_index = register_index
+        self._value = value
+        self._destination = destination
+
+    def eval(self, context):
+        if context.registers[self._register_index] != self._value:
+            # Subtract one because the main loop increment will add another.
+            context.pc = self._destination - 1
+
+
+class UncheckedAddBne(AddBne):
+    """:class:`stencil_lang.interpreter.peephole.AddBne` whose register is
+    known to be initialized.
+    """
+    def eval(self, context):
+        index = self._index
+        register_value = context.registers[index] + self._integer
+        context.registers[index] = register_value
+        if register_value != self._value:
+            context.pc = self._destination - 1
+
+
+class _Facts(object):
+    """Registers and matrices which are initialized on every path to a
+    program point.
+    """
+    def __init__(self, registers, matrices):
+        """:param registers: initialized register indices
+        :type registers: :class:`dict` of :class:`int` to :class:`bool`
+        :param matrices: initialized matrix indices
+        :type matrices: :class:`dict` of :class:`int` to :class:`bool`
+        """
+        self.registers = registers
+        self.matrices = matrices
+
+    def copy(self):
+        return _Facts(self.registers.copy(), self.matrices.copy())
+
+    def intersect(self, other):
+        """Keep only the facts which also hold in `other`.
+
+        :return: whether anything changed
+        :rtype: :class:`bool`
+        """
+        changed = _intersect(self.registers, other.registers)
+        # Don't short-circuit; both banks must be narrowed.
+        if _intersect(self.matrices, other.matrices):
+            changed = True
+        return changed
+
+
+def _intersect(bank, other_bank):
+    removed = [index for index in bank if index not in other_bank]
+    for index in removed:
+        del bank[index]
+    return len(removed) > 0
+
+
+def check_branches(bytecodes):
+    """Check that every branch in the program has a valid destination.
+
+    :param bytecodes: bytecodes to check
+    :type bytecodes: :class:`list` of \
+    :class:`stencil_lang.structures.Bytecode`
+    :raises stencil_lang.errors.InvalidBranchOffsetError: on the first \
+    invalid branch
+    """
+    program_length = len(bytecodes)
+    for pc in xrange(program_length):
+        bytecode = bytecodes[pc]
+        if isinstance(bytecode, Bne):
+            offset = bytecode._offset
+            destination = pc + offset
+            if (offset == 0 or
+                    destination >= program_length or
+                    destination < 0):
+                raise InvalidBranchOffsetError(offset, destination)
+
+
+def _transfer(bytecode, facts):
+    """Update `facts` with the effects of successfully evaluating `bytecode`.
+
+    A bytecode which reads an uninitialized variable raises, so any variable
+    it reads is also initialized afterwards.
+    """
+    if isinstance(bytecode, Sto):
+        facts.registers[bytecode._index] = True
+    elif isinstance(bytecode, Pr):
+        facts.registers[bytecode._index] = True
+    elif isinstance(bytecode, Add):
+        facts.registers[bytecode._index] = True
+    elif isinstance(bytecode, AddBne):
+        facts.registers[bytecode._index] = True
+    elif isinstance(bytecode, Bne):
+        facts.registers[bytecode._register_index] = True
+    elif isinstance(bytecode, Cmx):
+        facts.matrices[bytecode._index] = True
+    elif isinstance(bytecode, Pmx):
+        facts.matrices[bytecode._index] = True
+    elif isinstance(bytecode, Smx):
+        facts.matrices[bytecode._index] = True
+    elif isinstance(bytecode, Smxf):
+        facts.matrices[bytecode._index] = True
+    elif isinstance(bytecode, Wmxf):
+        facts.matrices[bytecode._index] = True
+    elif isinstance(bytecode, Snap):
+        facts.matrices[bytecode._index] = True
+    elif isinstance(bytecode, Pde):
+        facts.matrices[bytecode._stencil_index] = True
+        facts.matrices[bytecode._matrix_index] = True
+    elif isinstance(bytecode, PdeLoop):
+        facts.registers[bytecode._index] = True
+        facts.matrices[bytecode._stencil_index] = True
+        facts.matrices[bytecode._matrix_index] = True
+    elif isinstance(bytecode, CountedLoop):
+        # The body always runs at least once.
+        for body_bytecode in bytecode._body:
+            _transfer(body_bytecode, facts)
+        facts.registers[bytecode._index] = True
+
+
+def initialized_variables(bytecodes):
+    """Compute which variables are initialized before each bytecode runs.
+
+    This is a forward "must" dataflow analysis: a variable is initialized at a
+    program point only if it is initialized on every path to that point.
+    Branches must already have been checked with :func:`check_branches`.
+
+    :param bytecodes: bytecodes to analyze
+    :type bytecodes: :class:`list` of \
+    :class:`stencil_lang.structures.Bytecode`
+    :return: facts for each program counter, :data:`None` if unreachable
+    :rtype: :class:`list`
+    """
+    program_length = len(bytecodes)
+    facts_in = [None] * program_length
+    if program_length == 0:
+        return facts_in
+    facts_in[0] = _Facts({}, {})
+    worklist = [0]
+    while worklist:
+        pc = worklist.pop()
+        facts_out = facts_in[pc].copy()
+        _transfer(bytecodes[pc], facts_out)
+        for successor in successors(bytecodes, pc):
+            if successor >= program_length:
+                # Falls off the end of the program.
+                continue
+            successor_facts = facts_in[successor]
+            if successor_facts is None:
+                facts_in[successor] = facts_out.copy()
+                worklist.append(successor)
+            elif successor_facts.intersect(facts_out):
+                worklist.append(successor)
+    return facts_in
+
+
+def _specialize(bytecode, pc, facts):
+    """Return an unchecked variant of `bytecode` if `facts` prove it safe."""
+    registers = facts.registers
+    matrices = facts.matrices
+    if isinstance(bytecode, Add):
+        if bytecode._index in registers:
+            return UncheckedAdd(bytecode._index, bytecode._integer)
+    elif isinstance(bytecode, Pr):
+        if bytecode._index in registers:
+            return UncheckedPr(bytecode._index)
+    elif isinstance(bytecode, Pde):
+        if (bytecode._stencil_index in matrices and
+                bytecode._matrix_index in matrices):
+            return UncheckedPde(bytecode._stencil_index,
+                                bytecode._matrix_index)
+    elif isinstance(bytecode, Bne):
+        if bytecode._register_index in registers:
+            return UncheckedBne(bytecode._register_index, bytecode._value,
+                                pc + bytecode._offset)
+    elif isinstance(bytecode, AddBne):
+        if bytecode._index in registers:
+            return UncheckedAddBne(bytecode._index, bytecode._integer,
+                                   bytecode._value, bytecode._destination)
+    elif isinstance(bytecode, CountedLoop):
+        # Later iterations only know more than the first one.
+        body_facts = facts.copy()
+        body = []
+        for body_bytecode in bytecode._body:
+            body.append(_specialize(body_bytecode, pc, body_facts))
+            _transfer(body_bytecode, body_facts)
+        return CountedLoop(bytecode._index, bytecode._count, body,
+                           bytecode._write_back, bytecode._final_value)
+    return bytecode
+
+
+def verify(bytecodes):
+    """Verify a program once before it runs.
+
+    Invalid branches are rejected up front, and bytecodes whose variables are
+    proven to be initialized are replaced with variants which skip their
+    runtime checks.
+
+    :param bytecodes: bytecodes to verify
+    :type bytecodes: :class:`list` of \
+    :class:`stencil_lang.structures.Bytecode`
+    :return: the verified bytecodes
+    :rtype: :class:`list` of :class:`stencil_lang.structures.Bytecode`
+    :raises stencil_lang.errors.InvalidBranchOffsetError: if any branch is \
+    invalid
+    """
+    check_branches(bytecodes)
+    facts_in = initialized_variables(bytecodes)
+    verified = []
+    for pc in xrange(len(bytecodes)):
+        bytecode = bytecodes[pc]
+        facts = facts_in[pc]
+        if facts is not None:
+            bytecode = bytecode.replaced_by(_specialize(bytecode, pc, facts))
+        verified.append(bytecode)
+    return verified
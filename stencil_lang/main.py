@@ -2,12 +2,36 @@
 """:mod:`stencil_lang.main` -- Program entry point
 """
 
+import os
 import sys
+import time
 
+from rpython.rlib.rsocket import SocketError
 from rpython.rlib.streamio import open_file_as_stream, fdopen_as_stream
 
 from stencil_lang import metadata
-from stencil_lang.interpreter import run
+from stencil_lang.interpreter import (
+    load,
+    run,
+    run_checkpointed,
+    run_streaming,
+    run_profiled,
+    run_with_stats,
+    run_sweep,
+)
+from stencil_lang.interpreter.profiler import Profile
+from stencil_lang.interpreter.stats import Stats
+from stencil_lang.interpreter.cache import cache_filename
+from stencil_lang.interpreter.sweep import (
+    Parameters,
+    sweep_values,
+    DEFAULT_JOBS,
+)
+from stencil_lang.matrix import from_file
+from stencil_lang.matrix.filecache import file_cache, DEFAULT_BUDGET
+from stencil_lang.matrix.parallel import parallel_reader
+from stencil_lang.matrix.prefetch import prefetcher, DEFAULT_THREADS
+from stencil_lang.server import serve, DEFAULT_WORKERS
 from stencil_lang.errors import StencilLanguageError
 
 
@@ -19,11 +43,294 @@ def usage(argv):
     :return: the usage string
     :rtype: :class:`str`
     """
-    return '''usage: %s [INPUT_FILENAME]
+    return '''usage: %s [--dump-optimized] [--rply-lexer] [--stream]
+       [--profile] [--stats] [--matrix-cache=BYTES] [--parse-workers=N]
+       [--prefetch-threads=N]
+       [--register=INDEX=VALUE ...] [--matrix=INDEX=PATH ...]
+       [--sweep=INDEX=START:STOP[:STEP] [--jobs=N]]
+       [--checkpoint-every=N --checkpoint-file=PATH] [--restart-from=PATH]
+       [--manifest=PATH] [INPUT_FILENAME ...]
+   or: %s [--serve-workers=N] --serve=PATH
 
     INPUT_FILENAME
-        stencil language source file, omit or pass '-' to read from stdin
-''' % argv[0]
+        stencil language source file, omit or pass '-' to read from stdin;
+        the parsed program is cached next to the file with a .slc extension
+
+    --manifest=PATH
+        also run the source files listed in PATH, one per line; blank lines
+        and lines starting with '#' are skipped
+
+    Given several source files, or a manifest, the programs run one after
+    another in this process, each with its own registers and matrices but
+    sharing the matrix cache. Each program's output is preceded by a line
+    '==> INPUT_FILENAME <==', and an error in one program is printed and
+    the next program runs. Batches cannot be combined with --stream or
+    checkpointing.
+
+    --register=INDEX=VALUE
+        set register INDEX to the integer VALUE before the program starts
+
+    --matrix=INDEX=PATH
+        set matrix INDEX to the matrix read from PATH before the program
+        starts
+
+    --sweep=INDEX=START:STOP[:STEP]
+        load the program once, then run it once for each value of register
+        INDEX from START up to, but not including, STOP in steps of STEP
+        (default: 1), each on a forked process; the outputs are printed in
+        order, each preceded by a line '==> INDEX=VALUE <=='. A sweep runs
+        a single program, and cannot be combined with --dump-optimized,
+        --stream, --profile, --stats or checkpointing
+
+    --jobs=N
+        run at most N runs of a sweep at once (default: %d)
+
+    --serve=PATH
+        listen on the Unix domain socket PATH, which must not exist, and run
+        each program sent to it until killed, after which the workers exit
+        and remove PATH; see stencil_lang.server for the protocol, and
+        stencil_lang_submit for a client
+
+    --serve-workers=N
+        run at most N programs sent to the server at once (default: %d)
+
+    --dump-optimized
+        print the optimized program instead of running it
+
+    --rply-lexer
+        lex with the generated rply lexer instead of the faster hand-written
+        scanner, which produces the same tokens
+
+    --stream
+        run each statement as soon as it has been read instead of reading the
+        whole program first; the program is not optimized or verified, and
+        cannot be combined with --dump-optimized or --rply-lexer
+
+    --profile
+        print the execution count and time of each opcode and source line to
+        stderr at exit; the program is profiled as it runs after
+        optimization, so fused bytecodes (ADDBNE, PDELOOP) are counted
+        against the line of their ADD and lowered loops (LOOP) against the
+        line of their BNE; cannot be combined with --dump-optimized or
+        --stream
+
+    --stats
+        print the time spent in each phase and the stencil and matrix I/O
+        throughput to stderr at exit, as key=value lines; cannot be combined
+        with --dump-optimized, --stream or --profile
+
+    --matrix-cache=BYTES
+        keep up to BYTES bytes of matrices read by SMXF in memory, so that
+        reading an unchanged file again doesn't read and parse it again;
+        0 disables the cache (default: %d)
+
+    --parse-workers=N
+        read text matrix files of at least %d bytes on N forked worker
+        processes, each reading a share of the lines (default: 1, which
+        reads them in this process)
+
+    --prefetch-threads=N
+        read the files named by SMXF on N background threads as soon as the
+        program starts, so that SMXF only waits for a read already under way;
+        files which the program writes with WMXF or SNAP are not read ahead,
+        and the matrices read ahead are kept within --matrix-cache;
+        0 reads each file when its SMXF runs (default: %d)
+
+    --checkpoint-every=N --checkpoint-file=PATH
+        save the registers, matrices, program counter and SNAP numbering to
+        PATH after every N bytecodes, replacing the previous checkpoint
+        atomically; loops are not compiled to their faster forms, so that
+        each iteration can be checkpointed
+
+    --restart-from=PATH
+        continue the program from a checkpoint saved by an earlier run of the
+        same program instead of starting from the beginning; SNAP goes on
+        numbering its snapshots after the last one taken before the
+        checkpoint
+
+    --checkpoint-every, --checkpoint-file and --restart-from cannot be
+    combined with --dump-optimized, --stream, --profile or --stats
+''' % (argv[0], argv[0], DEFAULT_BUDGET, parallel_reader.threshold,
+       DEFAULT_THREADS, DEFAULT_JOBS, DEFAULT_WORKERS)
+
+
+_MATRIX_CACHE_PREFIX = '--matrix-cache='
+_PARSE_WORKERS_PREFIX = '--parse-workers='
+_PREFETCH_THREADS_PREFIX = '--prefetch-threads='
+_CHECKPOINT_EVERY_PREFIX = '--checkpoint-every='
+_CHECKPOINT_FILE_PREFIX = '--checkpoint-file='
+_RESTART_FROM_PREFIX = '--restart-from='
+_MANIFEST_PREFIX = '--manifest='
+_REGISTER_PREFIX = '--register='
+_MATRIX_PREFIX = '--matrix='
+_SWEEP_PREFIX = '--sweep='
+_JOBS_PREFIX = '--jobs='
+_SERVE_PREFIX = '--serve='
+_SERVE_WORKERS_PREFIX = '--serve-workers='
+
+
+class _Options(object):
+    """How to run each program, from the command line."""
+    def __init__(self):
+        self.dump_optimized = False
+        self.use_rply_lexer = False
+        self.streaming = False
+        self.profiling = False
+        self.collecting_stats = False
+        self.checkpointing = False
+        self.checkpoint_every = 0
+        self.checkpoint_file = ''
+        self.restart_from = ''
+        self.parameters = None
+        self.sweeping = False
+        self.sweep_index = 0
+        self.sweep_values = []
+        self.jobs = DEFAULT_JOBS
+
+
+def _split_option(argv, prefix):
+    """Remove the arguments of an option given as ``--option=value``.
+
+    :param argv: command-line arguments
+    :type argv: :class:`list`
+    :param prefix: the option followed by ``=``
+    :type prefix: :class:`str`
+    :return: the remaining arguments and the option values, in order
+    :rtype: (:class:`list`, :class:`list`)
+    """
+    values = [arg[len(prefix):] for arg in argv if arg.startswith(prefix)]
+    return [arg for arg in argv if not arg.startswith(prefix)], values
+
+
+def _parse_assignment(value):
+    """Split an option value given as ``INDEX=VALUE``.
+
+    :param value: the option value
+    :type value: :class:`str`
+    :return: the index and the text after the ``=``
+    :rtype: (:class:`int`, :class:`str`)
+    :raises ValueError: if there is no ``=`` or the index is not an integer
+    """
+    equals = value.find('=')
+    if equals == -1:
+        raise ValueError('missing =')
+    assert equals >= 0
+    return int(value[:equals]), value[equals + 1:]
+
+
+def _parse_sweep(value):
+    """Parse the value of ``--sweep``, given as ``INDEX=START:STOP[:STEP]``.
+
+    :param value: the option value
+    :type value: :class:`str`
+    :return: the register index and its values
+    :rtype: (:class:`int`, :class:`list` of :class:`int`)
+    :raises ValueError: if the value is malformed or the step is zero
+    """
+    index, spec = _parse_assignment(value)
+    bounds = spec.split(':')
+    if len(bounds) != 2 and len(bounds) != 3:
+        raise ValueError('expected START:STOP[:STEP]')
+    step = 1
+    if len(bounds) == 3:
+        step = int(bounds[2])
+        if step == 0:
+            raise ValueError('zero step')
+    return index, sweep_values(int(bounds[0]), int(bounds[1]), step)
+
+
+def _read_manifest(filename):
+    """Read the source file names listed in a manifest.
+
+    :param filename: manifest file name
+    :type filename: :class:`str`
+    :return: the source file names, in order
+    :rtype: :class:`list` of :class:`str`
+    """
+    stream = open_file_as_stream(filename)
+    try:
+        text = stream.readall()
+    finally:
+        stream.close()
+    filenames = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            filenames.append(line)
+    return filenames
+
+
+def _run_input(filename, options):
+    """Run, or dump, one program.
+
+    :param filename: source file name, ``-`` for stdin
+    :type filename: :class:`str`
+    :param options: how to run the program
+    :type options: :class:`_Options`
+    """
+    if filename == '-':
+        input_stream = fdopen_as_stream(0, 'r')
+        # There is no file next to which to cache stdin.
+        cache = ''
+    else:
+        input_stream = open_file_as_stream(filename)
+        cache = cache_filename(filename)
+
+    use_rply_lexer = options.use_rply_lexer
+    parameters = options.parameters
+    try:
+        if options.streaming:
+            try:
+                run_streaming(input_stream, parameters)
+            finally:
+                input_stream.close()
+        else:
+            start = time.time()
+            try:
+                source_code = input_stream.readall()
+            finally:
+                input_stream.close()
+            read_seconds = time.time() - start
+            if options.dump_optimized:
+                for bytecode in load(source_code, cache, use_rply_lexer):
+                    print bytecode.as_source_string()
+            elif options.profiling:
+                profile = Profile()
+                try:
+                    run_profiled(source_code, profile, use_rply_lexer,
+                                 parameters)
+                finally:
+                    os.write(2, profile.format())
+            elif options.collecting_stats:
+                stats = Stats()
+                stats.add_phase('read', read_seconds)
+                try:
+                    run_with_stats(source_code, stats, cache, use_rply_lexer,
+                                   parameters)
+                finally:
+                    os.write(2, stats.format())
+            elif options.checkpointing:
+                run_checkpointed(source_code, options.checkpoint_file,
+                                 options.checkpoint_every,
+                                 options.restart_from, cache, use_rply_lexer,
+                                 parameters)
+            elif options.sweeping:
+                run_sweep(source_code, options.sweep_index,
+                          options.sweep_values, options.jobs, cache,
+                          use_rply_lexer, parameters)
+            else:
+                run(source_code, cache, use_rply_lexer, parameters)
+    except StencilLanguageError as error:
+        # The purpose of this except block is two-fold:
+        #
+        # * Don't print tracebacks for interpreter errors. Tracebacks shouldn't
+        #   be shown to the user.
+        # * RPython doesn't honor most magic methods including __str__ and
+        #   __repr__, so error messages aren't shown to the user when using the
+        #   translated executable. Only the exception name is shown.
+
+        # TODO: This should print to stderr.
+        print '%s: %s' % (error.name, error.__str__())
 
 
 def _main(argv):
@@ -56,34 +363,225 @@ URL: <%s>
         print '%s %s' % (metadata.project, metadata.version)
         return 0
 
-    num_argv = len(argv)
-    if num_argv > 2:
+    dump_optimized = '--dump-optimized' in argv
+    if dump_optimized:
+        argv = [arg for arg in argv if arg != '--dump-optimized']
+    use_rply_lexer = '--rply-lexer' in argv
+    if use_rply_lexer:
+        argv = [arg for arg in argv if arg != '--rply-lexer']
+
+    streaming = '--stream' in argv
+    if streaming:
+        argv = [arg for arg in argv if arg != '--stream']
+        if dump_optimized or use_rply_lexer:
+            print usage(argv)
+            return 1
+
+    profiling = '--profile' in argv
+    if profiling:
+        argv = [arg for arg in argv if arg != '--profile']
+        if dump_optimized or streaming:
+            print usage(argv)
+            return 1
+
+    collecting_stats = '--stats' in argv
+    if collecting_stats:
+        argv = [arg for arg in argv if arg != '--stats']
+        if dump_optimized or streaming or profiling:
+            print usage(argv)
+            return 1
+
+    argv, budget_values = _split_option(argv, _MATRIX_CACHE_PREFIX)
+    if budget_values:
+        try:
+            budget = int(budget_values[-1])
+        except ValueError:
+            print usage(argv)
+            return 1
+        if budget < 0:
+            print usage(argv)
+            return 1
+        file_cache.set_budget(budget)
+
+    argv, workers_values = _split_option(argv, _PARSE_WORKERS_PREFIX)
+    if workers_values:
+        try:
+            workers = int(workers_values[-1])
+        except ValueError:
+            print usage(argv)
+            return 1
+        if workers < 1:
+            print usage(argv)
+            return 1
+        parallel_reader.workers = workers
+
+    argv, threads_values = _split_option(argv, _PREFETCH_THREADS_PREFIX)
+    if threads_values:
+        try:
+            threads = int(threads_values[-1])
+        except ValueError:
+            print usage(argv)
+            return 1
+        if threads < 0:
+            print usage(argv)
+            return 1
+        prefetcher.threads = threads
+
+    argv, every_values = _split_option(argv, _CHECKPOINT_EVERY_PREFIX)
+    argv, checkpoint_values = _split_option(argv, _CHECKPOINT_FILE_PREFIX)
+    argv, restart_values = _split_option(argv, _RESTART_FROM_PREFIX)
+    checkpointing = bool(every_values or checkpoint_values or restart_values)
+    checkpoint_every = 0
+    checkpoint_file = ''
+    restart_from = ''
+    if checkpointing:
+        if dump_optimized or streaming or profiling or collecting_stats:
+            print usage(argv)
+            return 1
+        # Saving needs both the interval and the file.
+        if bool(every_values) != bool(checkpoint_values):
+            print usage(argv)
+            return 1
+        if every_values:
+            try:
+                checkpoint_every = int(every_values[-1])
+            except ValueError:
+                print usage(argv)
+                return 1
+            checkpoint_file = checkpoint_values[-1]
+            if checkpoint_every <= 0 or not checkpoint_file:
+                print usage(argv)
+                return 1
+        if restart_values:
+            restart_from = restart_values[-1]
+            if not restart_from:
+                print usage(argv)
+                return 1
+
+    argv, manifest_values = _split_option(argv, _MANIFEST_PREFIX)
+
+    argv, register_values = _split_option(argv, _REGISTER_PREFIX)
+    argv, matrix_values = _split_option(argv, _MATRIX_PREFIX)
+    registers = {}
+    matrix_filenames = {}
+    try:
+        for value in register_values:
+            index, text = _parse_assignment(value)
+            registers[index] = int(text)
+        for value in matrix_values:
+            index, filename = _parse_assignment(value)
+            if not filename:
+                raise ValueError('missing file name')
+            matrix_filenames[index] = filename
+    except ValueError:
+        print usage(argv)
+        return 1
+
+    argv, sweep_specs = _split_option(argv, _SWEEP_PREFIX)
+    argv, jobs_values = _split_option(argv, _JOBS_PREFIX)
+    sweeping = bool(sweep_specs)
+    sweep_index = 0
+    values = []
+    jobs = DEFAULT_JOBS
+    if sweeping:
+        # Each run is the whole program, loaded once.
+        if dump_optimized or streaming or profiling or collecting_stats or \
+                checkpointing:
+            print usage(argv)
+            return 1
+        try:
+            sweep_index, values = _parse_sweep(sweep_specs[-1])
+            if jobs_values:
+                jobs = int(jobs_values[-1])
+        except ValueError:
+            print usage(argv)
+            return 1
+        if jobs < 1:
+            print usage(argv)
+            return 1
+    elif jobs_values:
+        print usage(argv)
+        return 1
+
+    argv, serve_values = _split_option(argv, _SERVE_PREFIX)
+    argv, serve_workers_values = _split_option(argv, _SERVE_WORKERS_PREFIX)
+    if serve_values or serve_workers_values:
+        # The server takes its programs from the socket.
+        if (not serve_values or not serve_values[-1] or len(argv) > 1 or
+                manifest_values or dump_optimized or streaming or
+                profiling or collecting_stats or checkpointing or
+                registers or matrix_filenames or sweeping):
+            print usage(argv)
+            return 1
+        serve_workers = DEFAULT_WORKERS
+        if serve_workers_values:
+            try:
+                serve_workers = int(serve_workers_values[-1])
+            except ValueError:
+                print usage(argv)
+                return 1
+            if serve_workers < 1:
+                print usage(argv)
+                return 1
+        try:
+            serve(serve_values[-1], serve_workers)
+        except SocketError:
+            print 'Cannot listen on %s' % serve_values[-1]
+            return 1
+        return 0
+
+    filenames = argv[1:]
+    batch = len(filenames) > 1 or bool(manifest_values)
+    if batch and (streaming or checkpointing or sweeping):
         print usage(argv)
         return 1
+    for manifest in manifest_values:
+        filenames.extend(_read_manifest(manifest))
+    if not batch and not filenames:
+        filenames = ['-']
 
-    if num_argv == 1 or (num_argv == 2 and argv[1] == '-'):
-        input_stream = fdopen_as_stream(0, 'r')
-    else:
-        input_stream = open_file_as_stream(argv[1])
+    options = _Options()
+    options.dump_optimized = dump_optimized
+    options.use_rply_lexer = use_rply_lexer
+    options.streaming = streaming
+    options.profiling = profiling
+    options.collecting_stats = collecting_stats
+    options.checkpointing = checkpointing
+    options.checkpoint_every = checkpoint_every
+    options.checkpoint_file = checkpoint_file
+    options.restart_from = restart_from
+    options.sweeping = sweeping
+    options.sweep_index = sweep_index
+    options.sweep_values = values
+    options.jobs = jobs
 
-    try:
-        source_code = input_stream.readall()
-    finally:
-        input_stream.close()
-    try:
-        run(source_code)
-    except StencilLanguageError as error:
-        # The purpose of this except block is two-fold:
-        #
-        # * Don't print tracebacks for interpreter errors. Tracebacks shouldn't
-        #   be shown to the user.
-        # * RPython doesn't honor most magic methods including __str__ and
-        #   __repr__, so error messages aren't shown to the user when using the
-        #   translated executable. Only the exception name is shown.
+    if registers or matrix_filenames:
+        parameters = Parameters()
+        parameters.registers = registers
+        # Read each matrix once, for every program and every run of a sweep.
+        for index, filename in matrix_filenames.iteritems():
+            try:
+                parameters.matrices[index] = from_file(filename)
+            except StencilLanguageError as error:
+                print '%s: %s' % (error.name, error.__str__())
+                return 1
+            except OSError as error:
+                print 'Cannot read %s: %s' % (filename,
+                                              os.strerror(error.errno))
+                return 1
+        options.parameters = parameters
 
-        # TODO: This should print to stderr.
-        print '%s: %s' % (error.name, error.__str__())
+    if not batch:
+        _run_input(filenames[0], options)
+        return 0
 
+    for filename in filenames:
+        print '==> %s <==' % filename
+        try:
+            _run_input(filename, options)
+        except OSError as error:
+            # Go on with the next program, as after any other error.
+            print 'OSError: %s' % os.strerror(error.errno)
     return 0
 
 
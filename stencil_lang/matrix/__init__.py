@@ -1,25 +1,58 @@
 """:mod:`stencil_lang.matrix` --- Parse matrices from strings/files
 """
 
+from rpython.rlib.rfloat import isfinite
+from rpython.rlib.rstring import StringBuilder
 from rpython.rlib.streamio import open_file_as_stream
 
-from stencil_lang.matrix.lexer import lex
-from stencil_lang.matrix.parser import parse
+from stencil_lang.matrix import binary, npy
+from stencil_lang.matrix.reader import read
+from stencil_lang.matrix import compressed
+from stencil_lang.matrix.parallel import parallel_reader
+from stencil_lang.utils import format_real
+
+WRITE_CHUNK_SIZE = 1024 * 1024
+"""Number of bytes :func:`to_file` writes at a time."""
 
 
 def from_string(text):
-    """Parse a matrix from a string.
+    """Parse a matrix from a string with the hand-written reader, which is
+    much faster than the generated :mod:`stencil_lang.matrix.parser` and
+    accepts the same text.
 
     :param text: matrix text to parse
     :type text: :class:`str`
     :return: the created matrix
     :rtype: :class:`Matrix`
     """
-    return parse(lex(text))
+    return read(text)
+
+
+def from_data(data):
+    """Create a matrix from the contents of a matrix file, which may be in
+    the text, the binary or the ``.npy`` format, and may be compressed, see
+    :mod:`stencil_lang.matrix.compressed`.
+
+    :param data: matrix file contents
+    :type data: :class:`str`
+    :return: the created matrix
+    :rtype: :class:`Matrix`
+    """
+    if binary.is_binary(data):
+        return binary.loads(data)
+    if npy.is_npy(data):
+        return npy.loads(data)
+    if compressed.is_compressed(data):
+        return compressed.loads(data)
+    return from_string(data)
 
 
 def from_file(filename):
-    """Parse a matrix from a file.
+    """Read a matrix from a file in the text, the binary or the ``.npy``
+    format. Compressed files are decompressed as they are read, see
+    :func:`compressed.read`. Large text files are read on several processes,
+    see
+    :data:`stencil_lang.matrix.parallel.parallel_reader`.
 
     :param filename: file name from which to read the matrix
     :type filename: :class:`str`
@@ -28,7 +61,88 @@ def from_file(filename):
     """
     stream = open_file_as_stream(filename)
     try:
-        matrix = from_string(stream.readall())
+        data = stream.read(len(npy.MAGIC))
+        if compressed.is_compressed(data):
+            return compressed.read(stream, data)
+        data += stream.readall()
+    finally:
+        stream.close()
+    if binary.is_binary(data):
+        return binary.loads(data)
+    if npy.is_npy(data):
+        return npy.loads(data)
+    return parallel_reader.read(data)
+
+
+def _check_finite(matrix):
+    for real in matrix.contents:
+        if not isfinite(real):
+            raise ValueError('Cannot write a non-finite real as text')
+
+
+def _append_row(builder, matrix, row):
+    start = row * matrix.cols
+    for i in xrange(start, start + matrix.cols):
+        if i > start:
+            builder.append(' ')
+        builder.append(format_real(matrix.contents[i]))
+    builder.append('\n')
+
+
+def to_string(matrix):
+    """Format a matrix in the text format, so that :func:`from_string` reads
+    back exactly the same matrix.
+
+    :param matrix: matrix to format
+    :type matrix: :class:`stencil_lang.structures.Matrix`
+    :return: the matrix text
+    :rtype: :class:`str`
+    :raises ValueError: if the matrix contains a NaN or an infinity
+    """
+    _check_finite(matrix)
+    builder = StringBuilder()
+    for row in xrange(matrix.rows):
+        _append_row(builder, matrix, row)
+    return builder.build()
+
+
+def to_file(filename, matrix):
+    """Write a matrix to a file, in the binary format if the file name ends
+    with :data:`stencil_lang.matrix.binary.EXTENSION`, in the ``.npy``
+    format if it ends with :data:`stencil_lang.matrix.npy.EXTENSION` and in
+    the text format otherwise. The file is written :data:`WRITE_CHUNK_SIZE`
+    bytes at a time. If the file name also ends with
+    :data:`stencil_lang.matrix.compressed.EXTENSION`, e.g.,
+    ``matrix.slmx.gz``, the file is compressed with gzip as it is written.
+
+    :param filename: file name to which to write the matrix
+    :type filename: :class:`str`
+    :param matrix: matrix to write
+    :type matrix: :class:`stencil_lang.structures.Matrix`
+    :raises ValueError: if the text format is used and the matrix contains a \
+    NaN or an infinity, in which case the file is left untouched
+    """
+    format_filename = compressed.uncompressed_filename(filename)
+    text = not (format_filename.endswith(binary.EXTENSION) or
+                format_filename.endswith(npy.EXTENSION))
+    if text:
+        # Check before opening, which would truncate an existing file.
+        _check_finite(matrix)
+    stream = open_file_as_stream(filename, 'w')
+    if format_filename != filename:
+        stream = compressed.DeflateStream(stream)
+    try:
+        if format_filename.endswith(binary.EXTENSION):
+            binary.write(stream, matrix, WRITE_CHUNK_SIZE)
+        elif format_filename.endswith(npy.EXTENSION):
+            npy.write(stream, matrix, WRITE_CHUNK_SIZE)
+        else:
+            builder = StringBuilder(WRITE_CHUNK_SIZE)
+            for row in xrange(matrix.rows):
+                if builder.getlength() >= WRITE_CHUNK_SIZE:
+                    stream.write(builder.build())
+                    builder = StringBuilder(WRITE_CHUNK_SIZE)
+                _append_row(builder, matrix, row)
+            stream.write(builder.build())
     finally:
         stream.close()
-    return matrix
@@ -0,0 +1,264 @@
+""":mod:`stencil_lang.matrix.binary` -- Binary matrix file format
+
+A binary matrix file is a 32-byte header followed by the matrix contents in
+row-major order. All numbers are little-endian.
+
+====== ====== ====================================================
+Offset Length Contents
+====== ====== ====================================================
+0      4      :data:`MAGIC`
+4      4      format version, :data:`VERSION`
+8      8      number of rows
+16     8      number of columns
+24     4      element type, :data:`FLOAT64`
+28     4      reserved, zero
+32     8 * n  contents, one IEEE 754 double per element
+====== ====== ====================================================
+
+The header is a multiple of eight bytes long so that the contents are aligned
+when the file is mapped into memory.
+"""
+
+from rpython.rlib.rarithmetic import intmask, r_ulonglong
+from rpython.rlib.rstring import StringBuilder
+from rpython.rlib.rstruct.ieee import float_pack, float_unpack
+
+from stencil_lang.errors import InvalidMatrixFileError
+from stencil_lang.structures import Matrix
+
+MAGIC = 'SLMX'
+"""Start of every binary matrix file. It can't start a text matrix file."""
+
+VERSION = 1
+"""Version of the format written by :func:`dumps`."""
+
+FLOAT64 = 1
+"""Element type of little-endian IEEE 754 doubles."""
+
+HEADER_LENGTH = 32
+"""Number of bytes before the contents."""
+
+EXTENSION = '.slmx'
+"""Extension of files to which ``WMXF`` writes the binary format."""
+
+_REAL_LENGTH = 8
+
+
+def is_binary(data):
+    """Determine whether file contents are a binary matrix.
+
+    :param data: matrix file contents
+    :type data: :class:`str`
+    :return: whether `data` starts with :data:`MAGIC`
+    :rtype: :class:`bool`
+    """
+    return data.startswith(MAGIC)
+
+
+def _write_uint(builder, value, length):
+    for i in xrange(length):
+        builder.append(chr((value >> (i * 8)) & 0xff))
+
+
+def _read_uint(data, pos, length):
+    value = 0
+    for i in xrange(length):
+        value |= ord(data[pos + i]) << (i * 8)
+    return intmask(value)
+
+
+def _append_header(builder, matrix):
+    builder.append(MAGIC)
+    _write_uint(builder, VERSION, 4)
+    _write_uint(builder, matrix.rows, 8)
+    _write_uint(builder, matrix.cols, 8)
+    _write_uint(builder, FLOAT64, 4)
+    _write_uint(builder, 0, 4)
+
+
+def _append_real(builder, real):
+    bits = float_pack(real, _REAL_LENGTH)
+    for i in xrange(_REAL_LENGTH):
+        builder.append(chr(intmask((bits >> (i * 8)) & 0xff)))
+
+
+def dumps(matrix):
+    """Serialize a matrix in the binary format.
+
+    :param matrix: matrix to serialize
+    :type matrix: :class:`stencil_lang.structures.Matrix`
+    :return: the binary matrix file contents
+    :rtype: :class:`str`
+    """
+    builder = StringBuilder(
+        HEADER_LENGTH + len(matrix.contents) * _REAL_LENGTH)
+    _append_header(builder, matrix)
+    for real in matrix.contents:
+        _append_real(builder, real)
+    return builder.build()
+
+
+def write(stream, matrix, chunk_size):
+    """Write a matrix in the binary format, in chunks of about `chunk_size`
+    bytes, so that the whole file is never held in memory.
+
+    :param stream: stream to which to write
+    :type stream: :class:`rpython.rlib.streamio.Stream`
+    :param matrix: matrix to write
+    :type matrix: :class:`stencil_lang.structures.Matrix`
+    :param chunk_size: number of bytes to write at a time
+    :type chunk_size: :class:`int`
+    """
+    builder = StringBuilder(chunk_size)
+    _append_header(builder, matrix)
+    _write_contents(stream, builder, matrix, chunk_size)
+
+
+def _write_contents(stream, builder, matrix, chunk_size):
+    # The builder already holds the header.
+    for real in matrix.contents:
+        if builder.getlength() >= chunk_size:
+            stream.write(builder.build())
+            builder = StringBuilder(chunk_size)
+        _append_real(builder, real)
+    stream.write(builder.build())
+
+
+def read_header(data):
+    """Read and check the header of a binary matrix file.
+
+    :param data: binary matrix file contents, or at least the header
+    :type data: :class:`str`
+    :return: number of rows and columns
+    :rtype: :class:`list` of :class:`int`
+    :raises stencil_lang.errors.InvalidMatrixFileError: if the header is \
+    invalid
+    """
+    if not is_binary(data):
+        raise InvalidMatrixFileError('missing magic number')
+    if len(data) < HEADER_LENGTH:
+        raise InvalidMatrixFileError('truncated header')
+    version = _read_uint(data, 4, 4)
+    if version != VERSION:
+        raise InvalidMatrixFileError('unsupported version %d' % version)
+    rows = _read_uint(data, 8, 8)
+    cols = _read_uint(data, 16, 8)
+    if rows < 0 or cols < 0:
+        raise InvalidMatrixFileError('negative dimensions')
+    dtype = _read_uint(data, 24, 4)
+    if dtype != FLOAT64:
+        raise InvalidMatrixFileError('unsupported element type %d' % dtype)
+    return [rows, cols]
+
+
+def _num_reals(rows, cols, payload_length):
+    size = payload_length // _REAL_LENGTH
+    # Compare without multiplying, which could overflow for a corrupt header.
+    if (payload_length % _REAL_LENGTH != 0 or
+            (cols == 0 and size != 0) or
+            (cols != 0 and (size % cols != 0 or size // cols != rows))):
+        raise InvalidMatrixFileError(
+            'contents do not match dimensions (%d, %d)' % (rows, cols))
+    return size
+
+
+def _decode_into(contents, index, data, pos, size):
+    for i in xrange(index, index + size):
+        bits = r_ulonglong(0)
+        for j in xrange(_REAL_LENGTH):
+            bits |= r_ulonglong(ord(data[pos + j])) << (j * 8)
+        contents[i] = float_unpack(bits, _REAL_LENGTH)
+        pos += _REAL_LENGTH
+
+
+def _decode_reals(data, pos, size):
+    contents = [0.0] * size
+    _decode_into(contents, 0, data, pos, size)
+    return contents
+
+
+def _append_reals(contents, data, pos, size):
+    for _ in xrange(size):
+        bits = r_ulonglong(0)
+        for j in xrange(_REAL_LENGTH):
+            bits |= r_ulonglong(ord(data[pos + j])) << (j * 8)
+        contents.append(float_unpack(bits, _REAL_LENGTH))
+        pos += _REAL_LENGTH
+
+
+class Decoder(object):
+    """Deserializes a matrix given in pieces, e.g., as it is decompressed.
+    Each real is decoded as soon as its bytes have been given, and only the
+    bytes of an incomplete real are kept until the next piece.
+    """
+    def __init__(self):
+        self._pending = ''
+        self._rows = -1
+        self._cols = -1
+        self._contents = []
+
+    def _read_header(self, data):
+        """Read the header if `data` holds all of it.
+
+        :return: the header length, or -1 if the header is incomplete
+        :rtype: :class:`int`
+        """
+        if len(data) < HEADER_LENGTH and (is_binary(data) or
+                                          MAGIC.startswith(data)):
+            return -1
+        dimensions = read_header(data)
+        self._rows = dimensions[0]
+        self._cols = dimensions[1]
+        return HEADER_LENGTH
+
+    def feed(self, data):
+        """Decode the next piece of a binary matrix file.
+
+        :param data: piece of binary matrix file contents
+        :type data: :class:`str`
+        :raises stencil_lang.errors.InvalidMatrixFileError: if the header is \
+        invalid
+        """
+        if self._pending:
+            data = self._pending + data
+        pos = 0
+        if self._rows == -1:
+            pos = self._read_header(data)
+            if pos == -1:
+                self._pending = data
+                return
+        size = (len(data) - pos) // _REAL_LENGTH
+        _append_reals(self._contents, data, pos, size)
+        pos += size * _REAL_LENGTH
+        assert pos >= 0
+        self._pending = data[pos:]
+
+    def finish(self):
+        """:return: the matrix decoded from all pieces
+        :rtype: :class:`stencil_lang.structures.Matrix`
+        :raises stencil_lang.errors.InvalidMatrixFileError: if the pieces \
+        are not a valid binary matrix
+        """
+        if self._rows == -1:
+            self._read_header(self._pending)
+            raise InvalidMatrixFileError('truncated header')
+        _num_reals(self._rows, self._cols,
+                   len(self._contents) * _REAL_LENGTH + len(self._pending))
+        return Matrix(self._rows, self._cols, self._contents)
+
+
+def loads(data):
+    """Deserialize a matrix written by :func:`dumps`.
+
+    :param data: binary matrix file contents
+    :type data: :class:`str`
+    :return: the matrix
+    :rtype: :class:`stencil_lang.structures.Matrix`
+    :raises stencil_lang.errors.InvalidMatrixFileError: if `data` is not a \
+    valid binary matrix
+    """
+    dimensions = read_header(data)
+    rows = dimensions[0]
+    cols = dimensions[1]
+    size = _num_reals(rows, cols, len(data) - HEADER_LENGTH)
+    return Matrix(rows, cols, _decode_reals(data, HEADER_LENGTH, size))
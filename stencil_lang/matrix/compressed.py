@@ -0,0 +1,204 @@
+""":mod:`stencil_lang.matrix.compressed` -- zlib and gzip compressed matrices
+
+Any matrix format may be compressed with zlib or gzip. Compressed files
+are recognized by their first two bytes, which can start no other matrix
+format, and are decompressed a piece at a time straight into the
+matrix.
+"""
+
+from rpython.rlib import rzlib
+from rpython.rlib.streamio import Stream
+
+from stencil_lang.matrix import binary, npy
+from stencil_lang.matrix.reader import MatrixReader
+from stencil_lang.errors import InvalidMatrixFileError
+
+EXTENSION = '.gz'
+"""Extension of files to which matrices are written compressed with gzip."""
+
+READ_CHUNK_SIZE = 64 * 1024
+"""Most compressed bytes read, and most decompressed bytes produced, at a
+time."""
+
+_GZIP_MAGIC = '\x1f\x8b'
+
+# Accept both zlib and gzip headers.
+_AUTODETECT_WBITS = rzlib.MAX_WBITS | 32
+_GZIP_WBITS = rzlib.MAX_WBITS | 16
+
+_ZLIB_DEFLATE = 8
+_ZLIB_PRESET_DICTIONARY = 0x20
+
+
+def is_compressed(data):
+    """Determine whether file contents are compressed with zlib or gzip.
+
+    A zlib header is two bytes whose value is a multiple of 31, using the
+    deflate method and no preset dictionary. That rules out the digits,
+    signs and blanks which start a text matrix.
+
+    :param data: matrix file contents, or at least the first two bytes
+    :type data: :class:`str`
+    :return: whether `data` starts with a zlib or gzip header
+    :rtype: :class:`bool`
+    """
+    if data.startswith(_GZIP_MAGIC):
+        return True
+    if len(data) < 2:
+        return False
+    cmf = ord(data[0])
+    flg = ord(data[1])
+    return (cmf & 0x0f == _ZLIB_DEFLATE and cmf >> 4 <= 7 and
+            flg & _ZLIB_PRESET_DICTIONARY == 0 and (cmf * 256 + flg) % 31 == 0)
+
+
+def uncompressed_filename(filename):
+    """Name which determines the format of a matrix written to a file.
+
+    :param filename: file name to which the matrix is written
+    :type filename: :class:`str`
+    :return: `filename` without :data:`EXTENSION`
+    :rtype: :class:`str`
+    """
+    if filename.endswith(EXTENSION):
+        end = len(filename) - len(EXTENSION)
+        assert end >= 0
+        return filename[:end]
+    return filename
+
+
+class _Decoder(object):
+    """Decodes the decompressed pieces in whichever format they turn out to
+    be in."""
+    def __init__(self):
+        self._head = ''
+        self._binary = None
+        self._text = None
+
+    def _start(self):
+        if binary.is_binary(self._head):
+            self._binary = binary.Decoder()
+            self._binary.feed(self._head)
+        elif npy.is_npy(self._head):
+            self._binary = npy.Decoder()
+            self._binary.feed(self._head)
+        else:
+            self._text = MatrixReader()
+            self._text.feed(self._head)
+        self._head = ''
+
+    def feed(self, data):
+        if self._binary is not None:
+            self._binary.feed(data)
+        elif self._text is not None:
+            self._text.feed(data)
+        else:
+            self._head += data
+            if len(self._head) >= len(npy.MAGIC):
+                self._start()
+
+    def finish(self):
+        if self._binary is None and self._text is None:
+            self._start()
+        if self._binary is not None:
+            return self._binary.finish()
+        assert self._text is not None
+        return self._text.finish()
+
+
+def read(stream, data):
+    """Read a compressed matrix from a stream, reading and decompressing at
+    most :data:`READ_CHUNK_SIZE` bytes at a time. The whole decompressed file
+    is never held in memory, however well it was compressed.
+
+    :param stream: stream from which to read the rest of the file
+    :type stream: :class:`rpython.rlib.streamio.Stream`
+    :param data: bytes already read from the start of the file
+    :type data: :class:`str`
+    :return: the matrix
+    :rtype: :class:`stencil_lang.structures.Matrix`
+    :raises stencil_lang.errors.InvalidMatrixFileError: if the compressed \
+    data is corrupt or truncated
+    """
+    decoder = _Decoder()
+    inflater = rzlib.inflateInit(_AUTODETECT_WBITS)
+    try:
+        finished = False
+        full = False
+        while not finished:
+            # A full piece may leave decompressed bytes inside zlib even
+            # once all the compressed bytes have been used.
+            if not data and not full:
+                data = stream.read(READ_CHUNK_SIZE)
+                if not data:
+                    raise InvalidMatrixFileError(
+                        'truncated compressed data')
+            try:
+                result = rzlib.decompress(inflater, data,
+                                          max_length=READ_CHUNK_SIZE)
+            except rzlib.RZlibError as error:
+                raise InvalidMatrixFileError(
+                    'corrupt compressed data: %s' % error.msg)
+            decoder.feed(result[0])
+            finished = result[1]
+            full = len(result[0]) == READ_CHUNK_SIZE
+            # Keep the compressed bytes which did not fit in this piece.
+            start = len(data) - result[2]
+            assert start >= 0
+            data = data[start:]
+    finally:
+        rzlib.inflateEnd(inflater)
+    return decoder.finish()
+
+
+class _StringStream(Stream):
+    """Reads a string in pieces, like a file."""
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+
+    def read(self, n):
+        start = self._pos
+        assert start >= 0
+        end = min(start + n, len(self._data))
+        self._pos = end
+        return self._data[start:end]
+
+
+def loads(data):
+    """Decompress and deserialize a compressed matrix.
+
+    :param data: compressed matrix file contents
+    :type data: :class:`str`
+    :return: the matrix
+    :rtype: :class:`stencil_lang.structures.Matrix`
+    :raises stencil_lang.errors.InvalidMatrixFileError: if the compressed \
+    data is corrupt or truncated
+    """
+    return read(_StringStream(data), '')
+
+
+class DeflateStream(Stream):
+    """Compresses everything written to it with gzip before writing it to
+    another stream."""
+    def __init__(self, base):
+        """:param base: stream to which to write the compressed data
+        :type base: :class:`rpython.rlib.streamio.Stream`
+        """
+        self._base = base
+        self._deflater = rzlib.deflateInit(wbits=_GZIP_WBITS)
+
+    def write(self, data):
+        compressed = rzlib.compress(self._deflater, data)
+        if compressed:
+            self._base.write(compressed)
+
+    def close(self):
+        """Write the rest of the compressed data and close the other
+        stream."""
+        try:
+            self._base.write(
+                rzlib.compress(self._deflater, '', rzlib.Z_FINISH))
+        finally:
+            rzlib.deflateEnd(self._deflater)
+            self._base.close()
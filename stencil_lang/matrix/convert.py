@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+""":mod:`stencil_lang.matrix.convert` -- Matrix file format converter
+"""
+
+import sys
+
+from rpython.rlib.streamio import open_file_as_stream
+
+from stencil_lang.matrix import binary, from_data, to_string
+from stencil_lang.errors import StencilLanguageError
+
+
+def usage(argv):
+    """Print program usage information.
+
+    :param argv: command-line arguments
+    :type argv: :class:`list`
+    :return: the usage string
+    :rtype: :class:`str`
+    """
+    return '''usage: %s INPUT_FILENAME OUTPUT_FILENAME
+
+    Convert a text matrix file to the binary format, or a binary matrix file
+    to the text format. The input format is detected from its contents.
+''' % argv[0]
+
+
+def convert(data):
+    """Convert matrix file contents to the other format.
+
+    :param data: matrix file contents in either format
+    :type data: :class:`str`
+    :return: the same matrix in the other format
+    :rtype: :class:`str`
+    :raises ValueError: if a binary matrix containing a NaN or an infinity \
+    is converted to text
+    """
+    if binary.is_binary(data):
+        return to_string(from_data(data))
+    return binary.dumps(from_data(data))
+
+
+def _main(argv):
+    """Program entry point.
+
+    :param argv: command-line arguments
+    :type argv: :class:`list`
+    :return: exit code
+    :rtype: :class:`int`
+    """
+    if len(argv) != 3 or '-h' in argv or '--help' in argv:
+        print usage(argv)
+        return 1
+
+    input_stream = open_file_as_stream(argv[1])
+    try:
+        data = input_stream.readall()
+    finally:
+        input_stream.close()
+    try:
+        converted = convert(data)
+    except StencilLanguageError as error:
+        print '%s: %s' % (error.name, error.__str__())
+        return 1
+    except ValueError:
+        print 'Cannot convert a matrix with non-finite reals to text'
+        return 1
+    output_stream = open_file_as_stream(argv[2], 'w')
+    try:
+        output_stream.write(converted)
+    finally:
+        output_stream.close()
+    return 0
+
+
+def main():
+    """Main for use with setuptools/distribute.
+
+    NOT_RPYTHON
+    """
+    raise SystemExit(_main(sys.argv))
+
+
+def target(*args):
+    """Target function for use with RPython."""
+    return _main, None
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+""":mod:`stencil_lang.matrix.filecache` -- Cache of matrices read from files
+"""
+
+import os
+
+from stencil_lang.matrix import from_file
+from stencil_lang.structures import Matrix
+
+DEFAULT_BUDGET = 64 * 1024 * 1024
+"""Default number of bytes of matrix contents kept in :data:`file_cache`."""
+
+_BYTES_PER_REAL = 8
+
+
+def matrix_bytes(matrix):
+    """Bytes of contents of a matrix, as counted against a budget.
+
+    :param matrix: the matrix
+    :type matrix: :class:`stencil_lang.structures.Matrix`
+    :return: the number of bytes
+    :rtype: :class:`int`
+    """
+    return len(matrix.contents) * _BYTES_PER_REAL
+
+
+class _Entry(object):
+    """A cached matrix and the state of the file it was read from."""
+    def __init__(self, size, mtime, matrix, last_used):
+        self.size = size
+        self.mtime = mtime
+        self.matrix = matrix
+        self.last_used = last_used
+        self.num_bytes = matrix_bytes(matrix)
+
+
+class MatrixFileCache(object):
+    """Matrices read from files, keyed on the file name, size and modification
+    time, up to a budget of bytes of matrix contents. The least recently used
+    matrices are evicted first.
+
+    Each matrix returned shares its contents with the cached one. Matrix
+    contents are never modified in place, only replaced with a new list, so
+    the cached contents stay intact however the returned matrix is used.
+    """
+    def __init__(self, budget):
+        """:param budget: most bytes of matrix contents to keep, zero to \
+        disable caching
+        :type budget: :class:`int`
+        """
+        self._budget = budget
+        self._entries = {}
+        self._num_bytes = 0
+        self._clock = 0
+        self.hits = 0
+        """Number of reads answered from the cache."""
+        self.misses = 0
+        """Number of reads which had to read the file."""
+
+    def set_budget(self, budget):
+        """Change the budget, evicting matrices until it is met.
+
+        :param budget: most bytes of matrix contents to keep, zero to \
+        disable caching
+        :type budget: :class:`int`
+        """
+        self._budget = budget
+        self._evict()
+
+    def budget(self):
+        """:return: most bytes of matrix contents to keep
+        :rtype: :class:`int`
+        """
+        return self._budget
+
+    def num_bytes(self):
+        """:return: bytes of matrix contents currently cached
+        :rtype: :class:`int`
+        """
+        return self._num_bytes
+
+    def clear(self):
+        """Remove all cached matrices."""
+        self._entries.clear()
+        self._num_bytes = 0
+
+    def discard(self, filename):
+        """Remove the matrix read from a file, if it is cached. Used when the
+        file is written, in case its size and modification time don't change.
+
+        :param filename: file name from which the matrix was read
+        :type filename: :class:`str`
+        """
+        if filename in self._entries:
+            self._remove(filename)
+
+    def _remove(self, filename):
+        entry = self._entries[filename]
+        del self._entries[filename]
+        self._num_bytes -= entry.num_bytes
+
+    def _evict(self):
+        while self._num_bytes > self._budget:
+            oldest = ''
+            oldest_used = -1
+            for filename, entry in self._entries.iteritems():
+                if oldest_used == -1 or entry.last_used < oldest_used:
+                    oldest = filename
+                    oldest_used = entry.last_used
+            self._remove(oldest)
+
+    def read(self, filename):
+        """Read a matrix from a file, or from the cache if the file hasn't
+        changed since it was cached.
+
+        :param filename: file name from which to read the matrix
+        :type filename: :class:`str`
+        :return: the matrix
+        :rtype: :class:`stencil_lang.structures.Matrix`
+        """
+        st = os.stat(filename)
+        self._clock += 1
+        try:
+            entry = self._entries[filename]
+        except KeyError:
+            pass
+        else:
+            if entry.size == st.st_size and entry.mtime == st.st_mtime:
+                self.hits += 1
+                entry.last_used = self._clock
+                return Matrix(entry.matrix.rows, entry.matrix.cols,
+                              entry.matrix.contents)
+            self._remove(filename)
+        self.misses += 1
+        matrix = from_file(filename)
+        self._add(filename, _Entry(st.st_size, st.st_mtime, matrix,
+                                   self._clock))
+        return Matrix(matrix.rows, matrix.cols, matrix.contents)
+
+    def add(self, filename, size, mtime, matrix):
+        """Cache a matrix read from a file elsewhere, e.g., by
+        :data:`stencil_lang.matrix.prefetch.prefetcher`.
+
+        :param filename: file name from which the matrix was read
+        :type filename: :class:`str`
+        :param size: size of the file when it was read
+        :type size: :class:`int`
+        :param mtime: modification time of the file when it was read
+        :type mtime: :class:`float`
+        :param matrix: the matrix read
+        :type matrix: :class:`stencil_lang.structures.Matrix`
+        """
+        self._clock += 1
+        self.discard(filename)
+        self._add(filename, _Entry(size, mtime, matrix, self._clock))
+
+    def _add(self, filename, entry):
+        if entry.num_bytes <= self._budget:
+            self._entries[filename] = entry
+            self._num_bytes += entry.num_bytes
+            self._evict()
+
+
+file_cache = MatrixFileCache(DEFAULT_BUDGET)
+"""The cache used by ``SMXF``. Its budget is set from the command line."""
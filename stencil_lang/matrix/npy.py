@@ -0,0 +1,294 @@
+""":mod:`stencil_lang.matrix.npy` -- NumPy ``.npy`` matrix files
+
+Two-dimensional arrays of little-endian doubles in C order, as written by
+:func:`numpy.save` for a ``float64`` array, are read and written, so that
+matrices can be exchanged with NumPy without going through the text format.
+
+A ``.npy`` file starts with :data:`MAGIC`, a format version and the length
+of a header, all little-endian. The header is the text of a Python
+dictionary describing the array, padded with spaces and a newline so that
+the contents start at a multiple of :data:`ALIGNMENT` bytes. The contents
+follow in the same order as in :mod:`stencil_lang.matrix.binary`.
+"""
+
+from rpython.rlib.rstring import StringBuilder
+
+from stencil_lang.matrix import binary
+from stencil_lang.errors import InvalidMatrixFileError
+from stencil_lang.structures import Matrix
+
+MAGIC = '\x93NUMPY'
+"""Start of every ``.npy`` file. It can't start a text or binary matrix
+file."""
+
+EXTENSION = '.npy'
+"""Extension of files to which ``WMXF`` writes the ``.npy`` format."""
+
+ALIGNMENT = 64
+"""Multiple of bytes at which :func:`dumps` starts the contents."""
+
+DESCR = '<f8'
+"""Description of the only element type, little-endian doubles."""
+
+# Version 1.0 has a two-byte header length, later versions a four-byte one.
+_SHORT_PREFIX_LENGTH = len(MAGIC) + 4
+_LONG_PREFIX_LENGTH = len(MAGIC) + 6
+
+# More digits than this can't be a dimension which fits in memory.
+_MAX_DIGITS = 18
+
+
+def is_npy(data):
+    """Determine whether file contents are a ``.npy`` file.
+
+    :param data: matrix file contents
+    :type data: :class:`str`
+    :return: whether `data` starts with :data:`MAGIC`
+    :rtype: :class:`bool`
+    """
+    return data.startswith(MAGIC)
+
+
+def _header_length(data):
+    """:return: length of everything before the contents, or -1 if `data` is \
+    too short to tell"""
+    if len(data) < _SHORT_PREFIX_LENGTH:
+        return -1
+    major = ord(data[len(MAGIC)])
+    if major == 1:
+        return _SHORT_PREFIX_LENGTH + binary._read_uint(
+            data, _SHORT_PREFIX_LENGTH - 2, 2)
+    if major == 2 or major == 3:
+        if len(data) < _LONG_PREFIX_LENGTH:
+            return -1
+        return _LONG_PREFIX_LENGTH + binary._read_uint(
+            data, _LONG_PREFIX_LENGTH - 4, 4)
+    raise InvalidMatrixFileError('unsupported .npy version %d.%d' %
+                                 (major, ord(data[len(MAGIC) + 1])))
+
+
+class _HeaderParser(object):
+    """Parses the dictionary literal in a ``.npy`` header."""
+    def __init__(self, text):
+        self._text = text
+        self._pos = 0
+
+    def _error(self):
+        return InvalidMatrixFileError('malformed .npy header')
+
+    def skip_space(self):
+        while (self._pos < len(self._text) and
+               self._text[self._pos] in ' \t\n'):
+            self._pos += 1
+
+    def at_end(self):
+        self.skip_space()
+        return self._pos == len(self._text)
+
+    def accept(self, char):
+        self.skip_space()
+        if self._pos < len(self._text) and self._text[self._pos] == char:
+            self._pos += 1
+            return True
+        return False
+
+    def expect(self, char):
+        if not self.accept(char):
+            raise self._error()
+
+    def string(self):
+        self.skip_space()
+        if self._pos >= len(self._text):
+            raise self._error()
+        quote = self._text[self._pos]
+        if quote != "'" and quote != '"':
+            raise self._error()
+        start = self._pos + 1
+        assert start >= 0
+        end = self._text.find(quote, start)
+        if end == -1:
+            raise self._error()
+        self._pos = end + 1
+        assert end >= start
+        return self._text[start:end]
+
+    def boolean(self):
+        self.skip_space()
+        start = self._pos
+        assert start >= 0
+        for word, value in [('True', True), ('False', False)]:
+            if self._text[start:start + len(word)] == word:
+                self._pos += len(word)
+                return value
+        raise self._error()
+
+    def integer(self):
+        self.skip_space()
+        value = 0
+        digits = 0
+        while (self._pos < len(self._text) and
+               '0' <= self._text[self._pos] <= '9'):
+            value = value * 10 + ord(self._text[self._pos]) - ord('0')
+            self._pos += 1
+            digits += 1
+            if digits > _MAX_DIGITS:
+                raise self._error()
+        if digits == 0:
+            raise self._error()
+        # Python 2 writes long integers with a suffix.
+        self.accept('L')
+        return value
+
+    def shape(self):
+        dimensions = []
+        self.expect('(')
+        while not self.accept(')'):
+            dimensions.append(self.integer())
+            if not self.accept(','):
+                self.expect(')')
+                break
+        return dimensions
+
+
+def _parse_header(text):
+    """:return: number of rows and columns"""
+    parser = _HeaderParser(text)
+    descr = ''
+    fortran_order = False
+    shape = None
+    parser.expect('{')
+    while not parser.accept('}'):
+        key = parser.string()
+        parser.expect(':')
+        if key == 'descr':
+            descr = parser.string()
+        elif key == 'fortran_order':
+            fortran_order = parser.boolean()
+        elif key == 'shape':
+            shape = parser.shape()
+        else:
+            raise InvalidMatrixFileError(
+                "unexpected key '%s' in .npy header" % key)
+        if not parser.accept(','):
+            parser.expect('}')
+            break
+    if not parser.at_end() or not descr or shape is None:
+        raise InvalidMatrixFileError('malformed .npy header')
+    if descr != DESCR:
+        raise InvalidMatrixFileError(
+            "unsupported .npy element type '%s'" % descr)
+    if fortran_order:
+        raise InvalidMatrixFileError('unsupported Fortran order .npy array')
+    if len(shape) != 2:
+        raise InvalidMatrixFileError(
+            'unsupported %d-dimensional .npy array' % len(shape))
+    return shape
+
+
+def read_header(data):
+    """Read and check the header of a ``.npy`` file.
+
+    :param data: ``.npy`` file contents, or at least the header
+    :type data: :class:`str`
+    :return: number of rows and columns, and the length of the header
+    :rtype: :class:`list` of :class:`int`
+    :raises stencil_lang.errors.InvalidMatrixFileError: if the header is \
+    invalid or describes anything but a two-dimensional array of \
+    little-endian doubles in C order
+    """
+    if not is_npy(data):
+        raise InvalidMatrixFileError('missing .npy magic string')
+    length = _header_length(data)
+    if length == -1 or len(data) < length:
+        raise InvalidMatrixFileError('truncated header')
+    if ord(data[len(MAGIC)]) == 1:
+        start = _SHORT_PREFIX_LENGTH
+    else:
+        start = _LONG_PREFIX_LENGTH
+    assert length >= start
+    shape = _parse_header(data[start:length])
+    return [shape[0], shape[1], length]
+
+
+def _header(matrix):
+    text = "{'descr': '%s', 'fortran_order': False, 'shape': (%d, %d), }" % (
+        DESCR, matrix.rows, matrix.cols)
+    # Pad the header so that the contents are aligned, as NumPy does.
+    length = _SHORT_PREFIX_LENGTH + len(text) + 1
+    padding = (ALIGNMENT - length % ALIGNMENT) % ALIGNMENT
+    builder = StringBuilder(length + padding)
+    builder.append(MAGIC)
+    builder.append('\x01\x00')
+    binary._write_uint(builder, len(text) + padding + 1, 2)
+    builder.append(text)
+    builder.append_multiple_char(' ', padding)
+    builder.append('\n')
+    return builder.build()
+
+
+def dumps(matrix):
+    """Serialize a matrix in the ``.npy`` format.
+
+    :param matrix: matrix to serialize
+    :type matrix: :class:`stencil_lang.structures.Matrix`
+    :return: the ``.npy`` file contents
+    :rtype: :class:`str`
+    """
+    header = _header(matrix)
+    builder = StringBuilder(
+        len(header) + len(matrix.contents) * binary._REAL_LENGTH)
+    builder.append(header)
+    for real in matrix.contents:
+        binary._append_real(builder, real)
+    return builder.build()
+
+
+def write(stream, matrix, chunk_size):
+    """Write a matrix in the ``.npy`` format, in chunks of about
+    `chunk_size` bytes.
+
+    :param stream: stream to which to write
+    :type stream: :class:`rpython.rlib.streamio.Stream`
+    :param matrix: matrix to write
+    :type matrix: :class:`stencil_lang.structures.Matrix`
+    :param chunk_size: number of bytes to write at a time
+    :type chunk_size: :class:`int`
+    """
+    builder = StringBuilder(chunk_size)
+    builder.append(_header(matrix))
+    binary._write_contents(stream, builder, matrix, chunk_size)
+
+
+def loads(data):
+    """Deserialize a ``.npy`` file.
+
+    :param data: ``.npy`` file contents
+    :type data: :class:`str`
+    :return: the matrix
+    :rtype: :class:`stencil_lang.structures.Matrix`
+    :raises stencil_lang.errors.InvalidMatrixFileError: if `data` is not a \
+    ``.npy`` file of a matrix
+    """
+    header = read_header(data)
+    rows = header[0]
+    cols = header[1]
+    length = header[2]
+    size = binary._num_reals(rows, cols, len(data) - length)
+    return Matrix(rows, cols, binary._decode_reals(data, length, size))
+
+
+class Decoder(binary.Decoder):
+    """Deserializes a ``.npy`` file given in pieces, e.g., as it is
+    decompressed."""
+    def _read_header(self, data):
+        if len(data) < len(MAGIC) and MAGIC.startswith(data):
+            return -1
+        if not is_npy(data):
+            raise InvalidMatrixFileError('missing .npy magic string')
+        length = _header_length(data)
+        if length == -1 or len(data) < length:
+            return -1
+        header = read_header(data)
+        self._rows = header[0]
+        self._cols = header[1]
+        return length
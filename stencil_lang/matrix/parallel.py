@@ -0,0 +1,255 @@
+""":mod:`stencil_lang.matrix.parallel` -- Parallel text matrix reader
+
+Large text matrices are split at line boundaries into one chunk per worker.
+Each worker is a forked process which reads its chunk with
+:class:`stencil_lang.matrix.reader.MatrixReader` and sends the reals back
+through a pipe in the binary format's encoding. The parent checks that the
+chunks agree on the number of columns and decodes each chunk's reals in
+place, in row order.
+
+Workers are processes rather than threads because translated RPython threads
+share a global interpreter lock, under which only one thread reads at a time.
+"""
+
+import os
+
+from rply.errors import LexingError
+from rply.token import SourcePosition
+from rpython.rlib import rthread
+from rpython.rlib.rstring import StringBuilder
+
+from stencil_lang.matrix import binary
+from stencil_lang.matrix.reader import read, MatrixReader
+from stencil_lang.structures import Matrix
+from stencil_lang.errors import (
+    InconsistentMatrixDimensions,
+    ParseError,
+)
+
+DEFAULT_THRESHOLD = 1024 * 1024
+"""Smallest text, in bytes, which is read in parallel."""
+
+_READ_SIZE = 64 * 1024
+
+# Result statuses sent by a worker.
+_OK = 0
+_LEXING_ERROR = 1
+_PARSE_ERROR = 2
+_INCONSISTENT = 3
+
+# Status and three numbers.
+_HEADER_LENGTH = 32
+
+
+class _WorkerFailed(Exception):
+    """Raised when a worker's result can't be read."""
+    pass
+
+
+def split_lines(text, num_chunks):
+    """Split text at line boundaries into at most `num_chunks` chunks of
+    roughly equal size.
+
+    :param text: text to split
+    :type text: :class:`str`
+    :param num_chunks: most chunks to split into
+    :type num_chunks: :class:`int`
+    :return: the offsets at which the chunks start, followed by the length \
+    of the text
+    :rtype: :class:`list` of :class:`int`
+    """
+    bounds = [0]
+    for i in xrange(1, num_chunks):
+        # End the chunk at the first newline at or after its share.
+        start = max(bounds[-1], len(text) * i // num_chunks - 1)
+        assert start >= 0
+        newline = text.find('\n', start)
+        if newline == -1:
+            break
+        if newline + 1 > bounds[-1]:
+            bounds.append(newline + 1)
+    if bounds[-1] != len(text):
+        bounds.append(len(text))
+    return bounds
+
+
+def _write_header(builder, status, a, b, c):
+    binary._write_uint(builder, status, 8)
+    binary._write_uint(builder, a, 8)
+    binary._write_uint(builder, b, 8)
+    binary._write_uint(builder, c, 8)
+
+
+def _encode_result(text, start, end):
+    assert start >= 0 and end >= start
+    builder = StringBuilder()
+    reader = MatrixReader(start)
+    matrix = None
+    try:
+        reader.feed(text[start:end])
+        matrix = reader.finish()
+    except LexingError as error:
+        # Errors also send the number of columns in the chunk's first row,
+        # in case it disagrees with earlier chunks, which would have been
+        # reported first.
+        _write_header(builder, _LEXING_ERROR, error.getsourcepos().idx, 0,
+                      reader.first_row_cols())
+    except ParseError:
+        _write_header(builder, _PARSE_ERROR, 0, 0, reader.first_row_cols())
+    except InconsistentMatrixDimensions as error:
+        _write_header(builder, _INCONSISTENT, 0, error._current_cols,
+                      reader.first_row_cols())
+    if matrix is not None:
+        _write_header(builder, _OK, matrix.rows, matrix.cols,
+                      len(matrix.contents))
+        for real in matrix.contents:
+            binary._append_real(builder, real)
+    return builder.build()
+
+
+def _write_all(fd, data):
+    written = 0
+    while written < len(data):
+        written += os.write(fd, data[written:])
+
+
+def _run_worker(text, start, end, fd):
+    status = 0
+    try:
+        _write_all(fd, _encode_result(text, start, end))
+    except Exception:
+        status = 1
+    # Don't run anything the parent would run on exit.
+    os._exit(status)
+
+
+def _start_worker(text, start, end):
+    """:return: the worker's process id and the pipe from which to read its \
+    result"""
+    fds = os.pipe()
+    opaqueaddr = rthread.gc_thread_before_fork()
+    pid = os.fork()
+    rthread.gc_thread_after_fork(pid, opaqueaddr)
+    if pid == 0:
+        os.close(fds[0])
+        _run_worker(text, start, end, fds[1])
+    os.close(fds[1])
+    return [pid, fds[0]]
+
+
+def _read_exactly(fd, length):
+    builder = StringBuilder(length)
+    remaining = length
+    while remaining > 0:
+        data = os.read(fd, min(remaining, _READ_SIZE))
+        if not data:
+            raise _WorkerFailed()
+        builder.append(data)
+        remaining -= len(data)
+    return builder.build()
+
+
+class _Result(object):
+    """A worker's result header."""
+    def __init__(self, header):
+        self.status = binary._read_uint(header, 0, 8)
+        self.a = binary._read_uint(header, 8, 8)
+        self.b = binary._read_uint(header, 16, 8)
+        self.c = binary._read_uint(header, 24, 8)
+
+
+def _raise_error(result, cols):
+    chunk_cols = result.c
+    if cols != -1 and chunk_cols != -1 and chunk_cols != cols:
+        raise InconsistentMatrixDimensions(cols, chunk_cols)
+    if result.status == _LEXING_ERROR:
+        raise LexingError(None, SourcePosition(result.a, -1, -1))
+    elif result.status == _PARSE_ERROR:
+        raise ParseError('NEWLINE')
+    elif result.status == _INCONSISTENT:
+        raise InconsistentMatrixDimensions(chunk_cols, result.b)
+    raise _WorkerFailed()
+
+
+def _gather(fds):
+    results = []
+    for fd in fds:
+        results.append(_Result(_read_exactly(fd, _HEADER_LENGTH)))
+    # Raise the error which reading the chunks in order would have raised
+    # first.
+    rows = 0
+    cols = -1
+    for result in results:
+        if result.status == _OK:
+            if result.a == 0:
+                continue
+            if cols == -1:
+                cols = result.b
+            elif result.b != cols:
+                raise InconsistentMatrixDimensions(cols, result.b)
+            rows += result.a
+        else:
+            _raise_error(result, cols)
+    if rows == 0:
+        return Matrix(0, 0, [])
+    contents = [0.0] * (rows * cols)
+    index = 0
+    for i in xrange(len(fds)):
+        size = results[i].c
+        if size != results[i].a * results[i].b:
+            raise _WorkerFailed()
+        data = _read_exactly(fds[i], size * binary._REAL_LENGTH)
+        binary._decode_into(contents, index, data, 0, size)
+        index += size
+    return Matrix(rows, cols, contents)
+
+
+class ParallelReader(object):
+    """Reads large text matrices on several worker processes."""
+    def __init__(self, workers, threshold):
+        """:param workers: number of worker processes, one to read in this \
+        process
+        :type workers: :class:`int`
+        :param threshold: smallest text, in bytes, read in parallel
+        :type threshold: :class:`int`
+        """
+        self.workers = workers
+        """Number of worker processes."""
+        self.threshold = threshold
+        """Smallest text, in bytes, read in parallel."""
+
+    def read(self, text):
+        """Read a matrix from text, in parallel if it is large enough.
+        Accepts the same text and raises the same errors as
+        :func:`stencil_lang.matrix.reader.read`. If a worker can't be started
+        or fails, the text is read in this process instead.
+
+        :param text: matrix text to read
+        :type text: :class:`str`
+        :return: the created matrix
+        :rtype: :class:`stencil_lang.structures.Matrix`
+        """
+        if self.workers <= 1 or len(text) < self.threshold:
+            return read(text)
+        bounds = split_lines(text, self.workers)
+        pids = []
+        fds = []
+        try:
+            try:
+                for i in xrange(len(bounds) - 1):
+                    worker = _start_worker(text, bounds[i], bounds[i + 1])
+                    pids.append(worker[0])
+                    fds.append(worker[1])
+                return _gather(fds)
+            finally:
+                for fd in fds:
+                    os.close(fd)
+                for pid in pids:
+                    os.waitpid(pid, 0)
+        except (OSError, _WorkerFailed):
+            return read(text)
+
+
+parallel_reader = ParallelReader(1, DEFAULT_THRESHOLD)
+"""The reader used for text matrix files. Its number of workers is set from
+the command line."""
@@ -0,0 +1,269 @@
+""":mod:`stencil_lang.matrix.prefetch` -- Background matrix file reader
+"""
+
+import os
+
+from rpython.rlib import rgil, rthread
+from rpython.rlib.jit import dont_look_inside
+from rpython.rlib.objectmodel import we_are_translated
+
+from stencil_lang.matrix import from_file
+from stencil_lang.matrix.filecache import file_cache, matrix_bytes
+from stencil_lang.matrix.snapshot import _Event
+from stencil_lang.structures import Matrix
+
+DEFAULT_THREADS = 4
+"""Default number of threads in :data:`prefetcher`."""
+
+
+class _Prefetch(object):
+    """A file being read ahead, and the matrix once it has been read."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.started = False
+        self.size = 0
+        self.mtime = 0.0
+        self.matrix = None
+        self.num_bytes = 0
+        self.ready = _Event()
+
+
+class _Bootstrap(object):
+    """Hands the prefetcher to each of its threads, because RPython can't
+    pass arguments to a new thread."""
+    def __init__(self):
+        self.prefetcher = None
+
+
+_bootstrap = _Bootstrap()
+
+
+def _run_reader():
+    rthread.gc_thread_start()
+    prefetcher = _bootstrap.prefetcher
+    _bootstrap.prefetcher = None
+    assert prefetcher is not None
+    prefetcher._started.set()
+    prefetcher._run()
+    rthread.gc_thread_die()
+
+
+class Prefetcher(object):
+    """Reads matrix files on background threads before ``SMXF`` asks for
+    them, so that a program which reads several files pays for reading them
+    at once instead of one after another.
+
+    A prefetched matrix is only used if the file's size and modification
+    time are still those it had when it was read, and if it hasn't been
+    written by the program since. Otherwise, and if the file couldn't be
+    read, ``SMXF`` reads it again itself, so that errors are raised by the
+    ``SMXF`` which would have raised them without prefetching.
+
+    The matrices waiting for their ``SMXF`` are kept within the budget of
+    :data:`stencil_lang.matrix.filecache.file_cache`, which they join once
+    taken. A matrix which doesn't fit is dropped, and its ``SMXF`` reads the
+    file itself.
+    """
+    def __init__(self, threads):
+        """:param threads: most threads reading at once, zero to disable \
+        prefetching
+        :type threads: :class:`int`
+        """
+        self.threads = threads
+        """Most threads reading at once."""
+        self.taken = 0
+        """Number of reads answered by prefetching."""
+        self._entries = {}
+        self._queue = []
+        # A translated program can't start with locks already allocated, so
+        # they are allocated by the first start().
+        self._mutex = None
+        self._started = None
+        self._finished = None
+        self._num_bytes = 0
+        self._running = 0
+        self._closing = False
+
+    def _cleanup_(self):
+        # Called on the prebuilt prefetcher when it is translated. Untranslated
+        # runs in the same process may have started it, so forget their locks
+        # and prefetched files.
+        self.close()
+        self._mutex = None
+        self._started = None
+        self._finished = None
+
+    def _run(self):
+        while True:
+            self._mutex.acquire(True)
+            if self._closing or not self._queue:
+                self._running -= 1
+                if self._running == 0:
+                    self._finished.set()
+                self._mutex.release()
+                break
+            entry = self._queue.pop(0)
+            entry.started = True
+            self._mutex.release()
+            self._read(entry)
+
+    def _read(self, entry):
+        size = 0
+        mtime = 0.0
+        matrix = None
+        try:
+            st = os.stat(entry.filename)
+            size = st.st_size
+            mtime = st.st_mtime
+            matrix = from_file(entry.filename)
+        except Exception:
+            # Leave the error to SMXF.
+            matrix = None
+        self._mutex.acquire(True)
+        # An entry already taken is handed straight to file_cache, and one
+        # discarded is dropped, so only those still waiting are counted.
+        if (matrix is not None and
+                self._entries.get(entry.filename, None) is entry):
+            num_bytes = matrix_bytes(matrix)
+            if self._num_bytes + num_bytes > file_cache.budget():
+                matrix = None
+            else:
+                entry.num_bytes = num_bytes
+                self._num_bytes += num_bytes
+        entry.size = size
+        entry.mtime = mtime
+        entry.matrix = matrix
+        self._mutex.release()
+        entry.ready.set()
+
+    @dont_look_inside
+    def start(self, filenames):
+        """Start reading files in the background, in order.
+
+        :param filenames: names of the files to read
+        :type filenames: :class:`list` of :class:`str`
+        """
+        if self.threads <= 0 or not filenames:
+            return
+        if self._mutex is None:
+            self._mutex = rthread.allocate_lock()
+            self._started = _Event()
+            self._finished = _Event()
+        self._mutex.acquire(True)
+        for filename in filenames:
+            if filename not in self._entries:
+                entry = _Prefetch(filename)
+                self._entries[filename] = entry
+                self._queue.append(entry)
+        num_threads = min(self.threads - self._running, len(self._queue))
+        self._running += max(num_threads, 0)
+        self._mutex.release()
+        for _ in xrange(num_threads):
+            _bootstrap.prefetcher = self
+            rthread.start_new_thread(_run_reader, ())
+            # Don't let another thread be started before this one has picked
+            # up the prefetcher.
+            self._started.wait()
+
+    def let_readers_run(self):
+        """Give the readers a chance to run while the program computes.
+        Translated, only one thread runs RPython code at a time, and the
+        readers otherwise only run while the program waits."""
+        if we_are_translated() and self._running > 0:
+            rgil.yield_thread()
+
+    def _remove(self, filename):
+        """Remove a file's entry, and take it off the queue if it hasn't been
+        started. The mutex must be held.
+
+        :return: the entry, or :data:`None` if the file isn't being prefetched
+        """
+        entry = self._entries.get(filename, None)
+        if entry is None:
+            return None
+        del self._entries[filename]
+        self._num_bytes -= entry.num_bytes
+        entry.num_bytes = 0
+        if not entry.started:
+            self._queue.remove(entry)
+        return entry
+
+    @dont_look_inside
+    def take(self, filename):
+        """Take the matrix read ahead from a file, waiting for it if it is
+        still being read, or reading it in this thread if no reader has got to
+        it yet. The matrix is also put in
+        :data:`stencil_lang.matrix.filecache.file_cache`.
+
+        :param filename: file name given to ``SMXF``
+        :type filename: :class:`str`
+        :return: the matrix, or :data:`None` if the file is to be read as \
+        usual, because it wasn't prefetched, couldn't be read or has changed \
+        since
+        :rtype: :class:`stencil_lang.structures.Matrix`
+        """
+        if self._mutex is None:
+            return None
+        self._mutex.acquire(True)
+        entry = self._remove(filename)
+        read_here = entry is not None and not entry.started
+        if read_here:
+            entry.started = True
+        self._mutex.release()
+        if entry is None:
+            return None
+        if read_here:
+            self._read(entry)
+        entry.ready.wait()
+        matrix = entry.matrix
+        if matrix is None:
+            return None
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        if st.st_size != entry.size or st.st_mtime != entry.mtime:
+            return None
+        file_cache.add(filename, entry.size, entry.mtime, matrix)
+        self.taken += 1
+        return Matrix(matrix.rows, matrix.cols, matrix.contents)
+
+    @dont_look_inside
+    def discard(self, filename):
+        """Forget the matrix read ahead from a file. Used when the file is
+        written, in case its size and modification time don't change.
+
+        :param filename: name of the file written
+        :type filename: :class:`str`
+        """
+        if self._mutex is None:
+            return
+        self._mutex.acquire(True)
+        self._remove(filename)
+        self._mutex.release()
+
+    @dont_look_inside
+    def close(self):
+        """Stop reading ahead, wait for the files being read and forget all
+        prefetched matrices."""
+        if self._mutex is None:
+            return
+        self._mutex.acquire(True)
+        self._closing = True
+        del self._queue[:]
+        # The event may still be set from the last time all threads finished.
+        # Only the last thread to finish sets it again, with the mutex held.
+        self._finished.clear()
+        while self._running > 0:
+            self._mutex.release()
+            self._finished.wait()
+            self._mutex.acquire(True)
+        self._closing = False
+        self._entries.clear()
+        self._num_bytes = 0
+        self._mutex.release()
+
+
+prefetcher = Prefetcher(DEFAULT_THREADS)
+"""The prefetcher used for ``SMXF``. Its number of threads is set from the
+command line."""
@@ -0,0 +1,113 @@
+""":mod:`stencil_lang.matrix.printer` -- Streaming matrix formatter
+"""
+
+import os
+import sys
+import math
+
+from rpython.rlib.objectmodel import we_are_translated
+from rpython.rlib.rstring import StringBuilder
+
+from stencil_lang.utils import rjust, ljust
+
+CHUNK_SIZE = 64 * 1024
+"""Number of bytes :func:`write_matrix` collects before each write."""
+
+
+class StdoutStream(object):
+    """Writes to standard output in the same order as ``print``."""
+    def write(self, text):
+        """:param text: text to write
+        :type text: :class:`str`
+        """
+        if we_are_translated():
+            # Translated, `print' writes each line to the file descriptor as
+            # soon as it is complete. A pipe may take only part of the text.
+            written = 0
+            while written < len(text):
+                written += os.write(1, text[written:])
+        else:
+            sys.stdout.write(text)
+
+
+stdout = StdoutStream()
+"""Standard output, for :func:`write_matrix`."""
+
+
+def _integer_part(real):
+    # Same formatting as stencil_lang.structures.Matrix._format_as_string.
+    ipart = math.modf(real)[1]
+    sign_str = '-' if real < 0 else ''
+    return sign_str + str(int(abs(ipart)))
+
+
+def _fractional_part(real):
+    fpart = math.modf(real)[0]
+    # Remove negative from fpart and strip the leading zero.
+    return str(abs(fpart))[1:] if fpart != 0 else ''
+
+
+def _widths(matrix):
+    """Return the widest integer and fractional parts, without keeping the
+    formatted parts."""
+    ipart_width = 0
+    fpart_width = 0
+    for real in matrix.contents:
+        ipart_width = max(ipart_width, len(_integer_part(real)))
+        fpart_width = max(fpart_width, len(_fractional_part(real)))
+    return ipart_width, fpart_width
+
+
+def _format_row(matrix, row, ipart_width, fpart_width):
+    builder = StringBuilder()
+    start = row * matrix.cols
+    for i in xrange(start, start + matrix.cols):
+        if i > start:
+            builder.append(' ')
+        real = matrix.contents[i]
+        builder.append(rjust(_integer_part(real), ipart_width))
+        builder.append(ljust(_fractional_part(real), fpart_width))
+    return builder.build()
+
+
+def write_matrix(stream, matrix, bracketed):
+    """Write a matrix as
+    :meth:`stencil_lang.structures.Matrix.as_bracketed_string` or
+    :meth:`stencil_lang.structures.Matrix.as_plain_string` formats it,
+    followed by a newline.
+
+    The widths of the columns are found in a first pass over the contents,
+    and the rows are formatted and written in a second pass, so the formatted
+    matrix is never held in memory at once.
+
+    :param stream: stream to which to write, e.g., :data:`stdout`
+    :type stream: :class:`StdoutStream` or \
+    :class:`rpython.rlib.streamio.Stream`
+    :param matrix: matrix to write
+    :type matrix: :class:`stencil_lang.structures.Matrix`
+    :param bracketed: whether to surround the rows and matrix with brackets
+    :type bracketed: :class:`bool`
+    """
+    if matrix.contents == []:
+        stream.write('Unpopulated matrix of dimensions (%d, %d)\n' % (
+            matrix.rows, matrix.cols))
+        return
+    ipart_width, fpart_width = _widths(matrix)
+    builder = StringBuilder()
+    for row in xrange(matrix.rows):
+        line = _format_row(matrix, row, ipart_width, fpart_width)
+        if bracketed:
+            builder.append('[' if row == 0 else ' ')
+            builder.append('[ ')
+            builder.append(line)
+            builder.append(' ]')
+            if row == matrix.rows - 1:
+                builder.append(']')
+        else:
+            builder.append(line.rstrip())
+        builder.append('\n')
+        if builder.getlength() >= CHUNK_SIZE:
+            stream.write(builder.build())
+            builder = StringBuilder()
+    if builder.getlength() > 0:
+        stream.write(builder.build())
@@ -0,0 +1,164 @@
+""":mod:`stencil_lang.matrix.reader` -- Hand-written matrix reader
+"""
+
+from rply.errors import LexingError
+from rply.token import SourcePosition
+from rpython.rlib.objectmodel import resizelist_hint
+
+from stencil_lang.structures import Matrix
+from stencil_lang.errors import (
+    InconsistentMatrixDimensions,
+    ParseError,
+)
+
+
+def _is_blank(char):
+    # Same characters as the ignore pattern in
+    # :data:`stencil_lang.matrix.tokens.IGNORES`.
+    return (char == ' ' or char == '\t' or char == '\r' or char == '\f' or
+            char == '\v')
+
+
+def _is_digit(char):
+    return '0' <= char <= '9'
+
+
+def _skip_digits(text, pos):
+    end = len(text)
+    while pos < end and _is_digit(text[pos]):
+        pos += 1
+    return pos
+
+
+def _scan_number(text, start):
+    """Return the end of the number at `start`, or `start` if there is none.
+    Matches the `NUMBER` pattern in :data:`stencil_lang.matrix.tokens.TOKENS`.
+    """
+    end = len(text)
+    pos = start
+    if text[pos] == '-':
+        pos += 1
+    if pos == end or not _is_digit(text[pos]):
+        return start
+    pos = _skip_digits(text, pos)
+    if pos < end and text[pos] == '.':
+        pos = _skip_digits(text, pos + 1)
+    if pos < end and text[pos] == 'e':
+        exponent = pos + 1
+        if exponent < end and text[exponent] == '-':
+            exponent += 1
+        if exponent < end and _is_digit(text[exponent]):
+            pos = _skip_digits(text, exponent)
+    return pos
+
+
+class MatrixReader(object):
+    """Reads a matrix from text given in pieces, e.g., as it is decompressed.
+    Each piece is read in a single pass as far as its last complete line, and
+    only the rest of the piece is kept until the next one.
+    """
+    def __init__(self, offset=0):
+        """:param offset: position of the text in a larger text, added to \
+        the positions in errors
+        :type offset: :class:`int`
+        """
+        self._contents = []
+        self._rows = 0
+        self._cols = -1
+        self._row_cols = 0
+        # Position in the whole text of the start of the pending text.
+        self._offset = offset
+        self._pending = ''
+
+    def _read_lines(self, text, end):
+        """Read the text up to `end`, which is either just after a newline or
+        the end of the whole text."""
+        contents = self._contents
+        row_cols = self._row_cols
+        pos = 0
+        while True:
+            while pos < end and _is_blank(text[pos]):
+                pos += 1
+            at_end = pos >= end
+            if at_end or text[pos] == '\n':
+                if row_cols == 0:
+                    if at_end:
+                        break
+                    raise ParseError('NEWLINE')
+                if self._cols == -1:
+                    # The number of columns in the first row determines the
+                    # number of columns for all rows, and so roughly how many
+                    # reals there are.
+                    self._cols = row_cols
+                    resizelist_hint(contents,
+                                    row_cols * (text.count('\n') + 1))
+                elif row_cols != self._cols:
+                    raise InconsistentMatrixDimensions(self._cols, row_cols)
+                self._rows += 1
+                row_cols = 0
+                if at_end:
+                    break
+                pos += 1
+                continue
+            number_end = _scan_number(text, pos)
+            if number_end == pos:
+                raise LexingError(
+                    None, SourcePosition(self._offset + pos, -1, -1))
+            contents.append(float(text[pos:number_end]))
+            row_cols += 1
+            pos = number_end
+        self._row_cols = row_cols
+        self._offset += end
+
+    def first_row_cols(self):
+        """:return: number of columns in the first row, or -1 if no row has \
+        been read yet
+        :rtype: :class:`int`
+        """
+        return self._cols
+
+    def feed(self, text):
+        """Read the next piece of text.
+
+        :param text: piece of matrix text
+        :type text: :class:`str`
+        :raises: the errors of :func:`read`
+        """
+        if self._pending:
+            text = self._pending + text
+        end = text.rfind('\n') + 1
+        assert end >= 0
+        self._read_lines(text, end)
+        self._pending = text[end:]
+
+    def finish(self):
+        """Read the rest of the text.
+
+        :return: the matrix read from all pieces
+        :rtype: :class:`stencil_lang.structures.Matrix`
+        :raises: the errors of :func:`read`
+        """
+        self._read_lines(self._pending, len(self._pending))
+        self._pending = ''
+        if self._rows == 0:
+            return Matrix(0, 0, [])
+        return Matrix(self._rows, self._cols, self._contents)
+
+
+def read(text):
+    """Read a matrix from text in a single pass, without building a token or
+    a box for each number. Accepts the same text and raises the same errors
+    as :func:`stencil_lang.matrix.parser.parse`.
+
+    :param text: matrix text to read
+    :type text: :class:`str`
+    :return: the created matrix
+    :rtype: :class:`stencil_lang.structures.Matrix`
+    :raises rply.errors.LexingError: on a character which can't start a number
+    :raises stencil_lang.errors.ParseError: on an empty line
+    :raises stencil_lang.errors.InconsistentMatrixDimensions: on a row with a
+        different number of columns than the first
+    """
+    reader = MatrixReader()
+    reader._pending = text
+    return reader.finish()
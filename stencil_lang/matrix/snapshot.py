@@ -0,0 +1,267 @@
+""":mod:`stencil_lang.matrix.snapshot` -- Background matrix snapshot writer
+"""
+
+from rpython.rlib import rgil, rthread
+from rpython.rlib.jit import dont_look_inside
+from rpython.rlib.objectmodel import we_are_translated
+
+from stencil_lang.matrix import to_file
+from stencil_lang.matrix.compressed import uncompressed_filename
+from stencil_lang.errors import MatrixWriteError
+
+QUEUE_LENGTH = 4
+"""Most snapshots waiting to be written before ``SNAP`` waits for the
+writer."""
+
+_NUMBER_WIDTH = 6
+
+
+def snapshot_filename(filename, number):
+    """Name of a numbered snapshot file. The number goes before the
+    extension, so that the snapshot is written in the same format, e.g.,
+    ``frame.slmx`` becomes ``frame.000003.slmx`` and ``frame.slmx.gz``
+    becomes ``frame.000003.slmx.gz``.
+
+    :param filename: file name given to ``SNAP``
+    :type filename: :class:`str`
+    :param number: snapshot number
+    :type number: :class:`int`
+    :return: the snapshot file name
+    :rtype: :class:`str`
+    """
+    digits = str(number)
+    if len(digits) < _NUMBER_WIDTH:
+        digits = '0' * (_NUMBER_WIDTH - len(digits)) + digits
+    pos = _number_position(filename)
+    return filename[:pos] + '.' + digits + filename[pos:]
+
+
+def _number_position(filename):
+    """Offset in a file name given to ``SNAP`` at which the snapshot number
+    is inserted."""
+    format_filename = uncompressed_filename(filename)
+    slash = format_filename.rfind('/')
+    dot = format_filename.rfind('.')
+    # A leading dot starts a hidden file name, not an extension.
+    if dot > slash + 1:
+        assert dot > 0
+        return dot
+    return len(format_filename)
+
+
+def is_snapshot_filename(filename, snap_filename):
+    """Determine whether a file name is that of one of the numbered snapshot
+    files which ``SNAP`` writes, see :func:`snapshot_filename`.
+
+    :param filename: file name to check
+    :type filename: :class:`str`
+    :param snap_filename: file name given to ``SNAP``
+    :type snap_filename: :class:`str`
+    :rtype: :class:`bool`
+    """
+    pos = _number_position(snap_filename)
+    prefix = snap_filename[:pos] + '.'
+    suffix = snap_filename[pos:]
+    end = len(filename) - len(suffix)
+    if (end - len(prefix) < _NUMBER_WIDTH or
+            not filename.startswith(prefix) or
+            not filename.endswith(suffix)):
+        return False
+    for i in xrange(len(prefix), end):
+        if not '0' <= filename[i] <= '9':
+            return False
+    return True
+
+
+class _Event(object):
+    """A flag which one thread waits for and another sets. The lock is held
+    while the flag is clear."""
+    def __init__(self):
+        self._lock = rthread.allocate_lock()
+        self._lock.acquire(True)
+
+    def set(self):
+        # Hold the lock whether or not it was set, then set it.
+        self._lock.acquire(False)
+        self._lock.release()
+
+    def wait(self):
+        """Wait until the flag is set, and clear it."""
+        self._lock.acquire(True)
+
+    def clear(self):
+        # Hold the lock, unless it is already held.
+        self._lock.acquire(False)
+
+
+class _Snapshot(object):
+    """A matrix waiting to be written."""
+    def __init__(self, index, filename, matrix):
+        self.index = index
+        self.filename = filename
+        self.matrix = matrix
+
+
+class _Bootstrap(object):
+    """Hands the writer to its thread, because RPython can't pass arguments
+    to a new thread."""
+    def __init__(self):
+        self.writer = None
+
+
+_bootstrap = _Bootstrap()
+
+
+def _run_writer():
+    rthread.gc_thread_start()
+    writer = _bootstrap.writer
+    _bootstrap.writer = None
+    assert writer is not None
+    writer._started.set()
+    writer._run()
+    rthread.gc_thread_die()
+
+
+class SnapshotWriter(object):
+    """Writes matrices to numbered files in a background thread, so that the
+    program goes on as soon as a snapshot is queued.
+
+    A queued snapshot shares its contents with the matrix in the program.
+    Matrix contents are never modified in place, only replaced with a new
+    list, so the snapshot keeps the contents it was taken with without being
+    copied.
+
+    At most a fixed number of snapshots wait to be written. When the queue is
+    full, taking a snapshot waits until the writer has taken one off, so a
+    program which takes snapshots faster than they can be written is slowed
+    down to the speed of the disk instead of filling memory.
+
+    The thread is started by the first snapshot, and :meth:`close` waits for
+    it to write all queued snapshots.
+    """
+    def __init__(self, queue_length):
+        """:param queue_length: most snapshots waiting to be written
+        :type queue_length: :class:`int`
+        """
+        self._queue_length = queue_length
+        self._queue = []
+        self._mutex = rthread.allocate_lock()
+        self._added = _Event()
+        self._removed = _Event()
+        self._started = _Event()
+        self._finished = _Event()
+        self._running = False
+        self._closing = False
+        # The first error the writer ran into, raised in the program's
+        # thread.
+        self._error_index = -1
+        self._error_reason = ''
+        self.numbers = {}
+        """Number of the next snapshot of each file name given to ``SNAP``.
+        Saved in checkpoints, so that a program restarted from one goes on
+        numbering its snapshots where it left off."""
+
+    def _start(self):
+        _bootstrap.writer = self
+        rthread.start_new_thread(_run_writer, ())
+        # Don't let another writer replace this one before its thread has
+        # picked it up.
+        self._started.wait()
+        self._running = True
+
+    def _run(self):
+        while True:
+            self._mutex.acquire(True)
+            while not self._queue and not self._closing:
+                self._mutex.release()
+                self._added.wait()
+                self._mutex.acquire(True)
+            if not self._queue:
+                self._mutex.release()
+                break
+            snapshot = self._queue.pop(0)
+            self._mutex.release()
+            self._removed.set()
+            self._write(snapshot)
+        self._finished.set()
+
+    def _write(self, snapshot):
+        reason = ''
+        try:
+            to_file(snapshot.filename, snapshot.matrix)
+        except ValueError:
+            reason = 'non-finite reals can only be written in binary'
+        except Exception:
+            reason = 'cannot write %s' % snapshot.filename
+        if reason:
+            self._mutex.acquire(True)
+            if self._error_index == -1:
+                self._error_index = snapshot.index
+                self._error_reason = reason
+            self._mutex.release()
+
+    def _raise_error(self):
+        self._mutex.acquire(True)
+        index = self._error_index
+        reason = self._error_reason
+        self._mutex.release()
+        if index != -1:
+            raise MatrixWriteError(index, reason)
+
+    def let_writer_run(self):
+        """Give the writer a chance to run while the program computes.
+        Translated, only one thread runs RPython code at a time, and the
+        writer otherwise only runs while the program waits."""
+        if we_are_translated() and self._running:
+            rgil.yield_thread()
+
+    @dont_look_inside
+    def put(self, index, filename, matrix):
+        """Queue a matrix to be written to the next numbered snapshot file,
+        see :func:`snapshot_filename`.
+
+        :param index: matrix index, for errors
+        :type index: :class:`int`
+        :param filename: file name given to ``SNAP``
+        :type filename: :class:`str`
+        :param matrix: matrix to write
+        :type matrix: :class:`stencil_lang.structures.Matrix`
+        :return: the snapshot file name
+        :rtype: :class:`str`
+        :raises stencil_lang.errors.MatrixWriteError: if an earlier snapshot \
+        could not be written
+        """
+        self._raise_error()
+        number = self.numbers.get(filename, 0)
+        self.numbers[filename] = number + 1
+        numbered_filename = snapshot_filename(filename, number)
+        if not self._running:
+            self._start()
+        self._mutex.acquire(True)
+        while len(self._queue) >= self._queue_length:
+            self._mutex.release()
+            self._removed.wait()
+            self._mutex.acquire(True)
+        self._queue.append(_Snapshot(index, numbered_filename, matrix))
+        self._mutex.release()
+        self._added.set()
+        self.let_writer_run()
+        return numbered_filename
+
+    @dont_look_inside
+    def close(self):
+        """Wait until all queued snapshots have been written, and stop the
+        thread.
+
+        :raises stencil_lang.errors.MatrixWriteError: if a snapshot could not \
+        be written
+        """
+        if self._running:
+            self._mutex.acquire(True)
+            self._closing = True
+            self._mutex.release()
+            self._added.set()
+            self._finished.wait()
+            self._running = False
+            self._closing = False
+        self._raise_error()
@@ -0,0 +1,267 @@
+""":mod:`stencil_lang.server` -- Interpreter server on a Unix domain socket
+
+The server listens on a Unix domain socket and runs the program sent over
+each connection. A fixed pool of worker processes accepts connections, so at
+most that many programs run at once. Each program runs in a process forked
+from its worker, so that it starts without loading anything and can't affect
+later programs. Once the server is killed, its workers exit after answering
+the connections they have accepted, and remove the socket.
+
+Every message is a frame: one byte giving its kind, the length of its payload
+as four little-endian bytes, then the payload. A client sends one
+:data:`PROGRAM` frame holding source code. The server answers with
+:data:`OUTPUT` frames holding what the program prints, as it prints it, at
+most one :data:`ERROR` frame holding the error which stopped the program,
+and an empty :data:`END` frame, after which it closes the connection.
+"""
+
+import os
+import sys
+
+from rpython.rlib import rsignal, rsocket, rthread
+from rpython.rlib.objectmodel import we_are_translated
+from rpython.rlib.rstring import StringBuilder
+
+from stencil_lang.interpreter import run
+from stencil_lang.matrix.binary import _read_uint, _write_uint
+from stencil_lang.errors import StencilLanguageError
+
+PROGRAM = 'P'
+"""Kind of the frame holding the program to run."""
+
+OUTPUT = 'O'
+"""Kind of the frames holding the program's output."""
+
+ERROR = 'E'
+"""Kind of the frame holding the error which stopped the program."""
+
+END = 'X'
+"""Kind of the last frame of the answer."""
+
+HEADER_LENGTH = 5
+"""Number of bytes before the payload of a frame."""
+
+MAX_PROGRAM_LENGTH = 64 * 1024 * 1024
+"""Longest program the server accepts, in bytes."""
+
+DEFAULT_WORKERS = 4
+"""Default number of programs run at once."""
+
+_READ_SIZE = 64 * 1024
+_BACKLOG = 64
+
+# Seconds a worker waits for a connection before checking that the server
+# is still running.
+_PARENT_CHECK_INTERVAL = 0.5
+
+
+class _ConnectionClosed(Exception):
+    """Raised when the client closes the connection before a whole frame has
+    been read."""
+    pass
+
+
+def encode_frame(kind, payload):
+    """Encode a frame.
+
+    :param kind: kind of the frame, e.g., :data:`PROGRAM`
+    :type kind: :class:`str`
+    :param payload: payload of the frame
+    :type payload: :class:`str`
+    :return: the encoded frame
+    :rtype: :class:`str`
+    """
+    builder = StringBuilder(HEADER_LENGTH + len(payload))
+    builder.append(kind)
+    _write_uint(builder, len(payload), 4)
+    builder.append(payload)
+    return builder.build()
+
+
+def _read_exactly(fd, length):
+    builder = StringBuilder(length)
+    remaining = length
+    while remaining > 0:
+        data = os.read(fd, min(remaining, _READ_SIZE))
+        if not data:
+            raise _ConnectionClosed()
+        builder.append(data)
+        remaining -= len(data)
+    return builder.build()
+
+
+def _read_all(fd):
+    builder = StringBuilder()
+    while True:
+        data = os.read(fd, _READ_SIZE)
+        if not data:
+            return builder.build()
+        builder.append(data)
+
+
+def _write_all(fd, data):
+    written = 0
+    while written < len(data):
+        written += os.write(fd, data[written:])
+
+
+def _send(fd, kind, payload):
+    _write_all(fd, encode_frame(kind, payload))
+
+
+def _flush_stdout():
+    if not we_are_translated():
+        # Untranslated, output is buffered, and would be written again by
+        # each forked process.
+        sys.stdout.flush()
+
+
+def _run_program(source_code, output_fd, error_fd):
+    """Run a program with its output going to one pipe and its error to
+    another. Runs in the forked process, and never returns."""
+    status = 0
+    try:
+        if we_are_translated():
+            # Stop when the worker stops reading, like any other program.
+            rsignal.pypysig_default(rsignal.SIGPIPE)
+        os.dup2(output_fd, 1)
+        os.close(output_fd)
+        message = ''
+        try:
+            run(source_code)
+        except StencilLanguageError as error:
+            message = '%s: %s' % (error.name, error.__str__())
+        except OSError as error:
+            message = 'OSError: %s' % os.strerror(error.errno)
+        _flush_stdout()
+        if message:
+            _write_all(error_fd, message)
+    except Exception:
+        status = 1
+    # Don't run anything the worker would run on exit.
+    os._exit(status)
+
+
+def _answer(fd, source_code):
+    """Run a program and send its output and error to the client."""
+    output_fds = os.pipe()
+    error_fds = os.pipe()
+    _flush_stdout()
+    opaqueaddr = rthread.gc_thread_before_fork()
+    pid = os.fork()
+    rthread.gc_thread_after_fork(pid, opaqueaddr)
+    if pid == 0:
+        os.close(fd)
+        os.close(output_fds[0])
+        os.close(error_fds[0])
+        _run_program(source_code, output_fds[1], error_fds[1])
+    os.close(output_fds[1])
+    os.close(error_fds[1])
+    try:
+        while True:
+            data = os.read(output_fds[0], _READ_SIZE)
+            if not data:
+                break
+            _send(fd, OUTPUT, data)
+        # The error is written after all output, and is short enough that
+        # the pipe never fills.
+        message = _read_all(error_fds[0])
+    finally:
+        os.close(output_fds[0])
+        os.close(error_fds[0])
+        status = os.waitpid(pid, 0)[1]
+    if not message and status != 0:
+        message = 'the program stopped unexpectedly'
+    if message:
+        _send(fd, ERROR, message)
+    _send(fd, END, '')
+
+
+def handle(fd):
+    """Read a program from a connection, run it and answer.
+
+    :param fd: file descriptor of the connection
+    :type fd: :class:`int`
+    """
+    try:
+        header = _read_exactly(fd, HEADER_LENGTH)
+        length = _read_uint(header, 1, 4)
+        if header[0] != PROGRAM or length > MAX_PROGRAM_LENGTH:
+            _send(fd, ERROR, 'invalid request')
+            _send(fd, END, '')
+            return
+        source_code = _read_exactly(fd, length)
+    except _ConnectionClosed:
+        return
+    _answer(fd, source_code)
+
+
+def _remove_socket(path, inode):
+    """Remove the socket, unless it has been replaced since the server
+    created it."""
+    try:
+        if os.stat(path).st_ino == inode:
+            os.unlink(path)
+    except OSError:
+        # Another worker got to it first.
+        pass
+
+
+def _run_worker(listener, server_pid):
+    """Accept and answer connections until the server dies. Runs in a worker
+    process."""
+    # The worker is handed to init once the server dies.
+    while os.getppid() == server_pid:
+        try:
+            fd = listener.accept()[0]
+        except rsocket.SocketError:
+            # Timed out, or another worker accepted the connection.
+            continue
+        try:
+            handle(fd)
+        except OSError:
+            # The client went away; go on with the next one.
+            pass
+        os.close(fd)
+
+
+def _start_worker(listener, path, inode):
+    _flush_stdout()
+    server_pid = os.getpid()
+    pid = os.fork()
+    if pid == 0:
+        if we_are_translated():
+            # A client which goes away shouldn't kill the worker. Python
+            # already ignores the signal.
+            rsignal.pypysig_ignore(rsignal.SIGPIPE)
+        _run_worker(listener, server_pid)
+        _remove_socket(path, inode)
+        os._exit(0)
+    return pid
+
+
+def serve(path, workers):
+    """Listen on a Unix domain socket and run the programs sent to it, until
+    the server is killed. The workers then exit and remove the socket.
+
+    :param path: file name of the socket, which must not exist
+    :type path: :class:`str`
+    :param workers: number of programs run at once
+    :type workers: :class:`int`
+    :raises rpython.rlib.rsocket.SocketError: if the socket can't be created
+    """
+    listener = rsocket.RSocket(rsocket.AF_UNIX, rsocket.SOCK_STREAM)
+    listener.bind(rsocket.UNIXAddress(path))
+    listener.listen(_BACKLOG)
+    # Wake the workers now and then to check on the server.
+    listener.settimeout(_PARENT_CHECK_INTERVAL)
+    inode = os.stat(path).st_ino
+    pids = {}
+    for _ in xrange(workers):
+        pids[_start_worker(listener, path, inode)] = True
+    while True:
+        pid = os.waitpid(-1, 0)[0]
+        # Replace a worker which has died, so that the pool stays full.
+        if pid in pids:
+            del pids[pid]
+            pids[_start_worker(listener, path, inode)] = True
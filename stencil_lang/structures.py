@@ -220,6 +220,15 @@ class Matrix(BaseBox):
 class Bytecode(BaseBox):
     """Base bytecode class.
     """
+    opcode = ''
+    """Instruction name, set for each language bytecode in
+    :mod:`stencil_lang.interpreter.bytecodes`."""
+    line = 0
+    """Source line of the statement this bytecode was compiled from, zero if
+    unknown. Only set for programs being profiled. A bytecode which replaces
+    several only has the line of one of them: ``ADDBNE`` and ``PDELOOP`` that
+    of their ``ADD``, ``LOOP`` that of its ``BNE``."""
+
     def eval(self, context):
         """Evaluate this bytecode.
 
@@ -228,15 +237,43 @@ class Bytecode(BaseBox):
         """
         raise NotImplementedError()
 
+    def as_source_string(self):
+        """Format this bytecode as stencil language source code.
+
+        :return: the source code
+        :rtype: :class:`str`
+        """
+        raise NotImplementedError()
+
+    def replaced_by(self, bytecode):
+        """Give a bytecode which replaces this one in a transformed program
+        this one's source line.
+
+        :param bytecode: the replacement
+        :type bytecode: :class:`Bytecode`
+        :return: the replacement
+        :rtype: :class:`Bytecode`
+        """
+        bytecode.line = self.line
+        return bytecode
+
     def __eq__(self, other):
-        # RPython does not honor this method, so it is mostly for testing.
-        return type(self) is type(other) and self.__dict__ == other.__dict__
+        # RPython does not honor this method, so it is mostly for testing. The
+        # source line doesn't change what the bytecode does.
+        return type(self) is type(other) and (_fields(self) ==
+                                              _fields(other))
 
     def __ne__(self, other):
         # RPython does not honor this method, so it is mostly for testing.
         return not (self == other)
 
 
+def _fields(bytecode):
+    fields = bytecode.__dict__.copy()
+    fields.pop('line', None)
+    return fields
+
+
 class Context(object):
     """Execution context/environment for the interpreter.
     """
@@ -258,3 +295,15 @@ class Context(object):
         function to use."""
         self.program_length = -1
         """Number of bytecodes in the program. Intended to be set elsewhere."""
+        self.stats = None
+        """:class:`stencil_lang.interpreter.stats.Stats` in which to record
+        matrix I/O and stencil applications, or :data:`None`."""
+        self.snapshots = None
+        """:class:`stencil_lang.matrix.snapshot.SnapshotWriter` started by
+        the first ``SNAP``, or :data:`None`."""
+        self.profile = None
+        """:class:`stencil_lang.interpreter.profiler.Profile` in which to
+        record each bytecode run, or :data:`None`."""
+        self.checkpointer = None
+        """:class:`stencil_lang.interpreter.checkpoint.Checkpointer` to which
+        to hand the context after each bytecode, or :data:`None`."""
@@ -1,6 +1,9 @@
 """:mod:`stencil_lang.utils` -- Various utility functions
 """
 
+from rpython.rlib.objectmodel import we_are_translated
+from rpython.rlib.rfloat import formatd, isinf
+
 
 def rjust(text, width):
     """Right-justify a string. Provided because RPython lacks
@@ -24,3 +27,34 @@ def ljust(text, width):
     :type width: :class:`int`
     """
     return text + max(width - len(text), 0) * ' '
+
+
+def format_real(value):
+    """Format a real number so that it reads back exactly as the same value.
+    Provided because RPython lacks :func:`repr` for floats and the lexers do
+    not accept a ``+`` in the exponent.
+
+    :param value: number to format
+    :type value: :class:`float`
+    :return: the formatted number
+    :rtype: :class:`str`
+    """
+    if isinf(value):
+        # Large enough to overflow back to infinity when read.
+        return '-1e999' if value < 0 else '1e999'
+    if we_are_translated():
+        # The shortest string which reads back as the same float.
+        text = formatd(value, 'r', 0)
+    else:
+        # Untranslated, formatd goes through ll2ctypes, which is far too slow
+        # for a whole matrix. This is the same string, except that formatd
+        # leaves off the `.0'.
+        text = repr(value)
+        if text.endswith('.0'):
+            text = text[:-2]
+    # RPython's str.replace only replaces single characters.
+    plus = text.find('e+')
+    if plus == -1:
+        return text
+    assert plus >= 0
+    return text[:plus + 1] + text[plus + 2:]
@@ -0,0 +1,10 @@
+from pytest import fixture
+
+from stencil_lang.matrix.filecache import file_cache
+
+
+@fixture(autouse=True)
+def clear_file_cache():
+    """Don't let matrices cached by one test change what another test
+    reads."""
+    file_cache.clear()
@@ -1,4 +1,4 @@
-from pytest import fixture, raises
+from pytest import fixture, raises, mark
 from mock import create_autospec, sentinel
 
 from stencil_lang.interpreter.stencil import apply_stencil
@@ -11,8 +11,12 @@ from stencil_lang.errors import (
     ArgumentError,
     InvalidBranchOffsetError,
     MatrixDimensionMismatchError,
+    MatrixWriteError,
 )
 from stencil_lang.interpreter.evaluator import eval_
+from stencil_lang.matrix import from_file
+from stencil_lang.matrix.snapshot import QUEUE_LENGTH
+from stencil_lang.matrix.prefetch import prefetcher
 
 from tests.helpers import assert_exc_info_msg, open_matrix, fixture_path
 
@@ -230,6 +234,24 @@ class TestSmxf(object):
             1, 1, 1,
         ])
 
+    def test_binary(self, context):
+        eval_([
+            Cmx(4, 2, 2),
+            Smxf(4, fixture_path('simple-binary'))
+        ], context)
+        assert context.matrices[4] == Matrix(2, 2, [11.7, 52, -34, -12.2])
+
+    def test_prefetched(self, context):
+        filename = fixture_path('simple-binary')
+        taken = prefetcher.taken
+        prefetcher.start([filename])
+        try:
+            eval_([Cmx(4, 2, 2), Smxf(4, filename)], context)
+        finally:
+            prefetcher.close()
+        assert context.matrices[4] == Matrix(2, 2, [11.7, 52, -34, -12.2])
+        assert prefetcher.taken == taken + 1
+
     def test_dimension_mismatch(self, context):
         with raises(MatrixDimensionMismatchError) as exc_info:
             eval_([
@@ -253,6 +275,148 @@ class TestSmxf(object):
             'Matrix 7 is not initialized. Please CMX first.')
 
 
+class TestWmxf(object):
+    def test_discards_prefetched(self, context, tmpdir):
+        path = tmpdir.join('matrix')
+        path.write('1\n')
+        prefetcher.start([str(path)])
+        try:
+            eval_([
+                Cmx(0, 1, 1),
+                Smx(0, [2]),
+                Wmxf(0, str(path)),
+                Smxf(0, str(path)),
+            ], context)
+        finally:
+            prefetcher.close()
+        assert context.matrices[0] == Matrix(1, 1, [2])
+
+    @mark.parametrize('filename', ['matrix', 'matrix.slmx'])
+    def test_round_trip(self, context, tmpdir, filename):
+        path = str(tmpdir.join(filename))
+        eval_([
+            Cmx(0, 2, 2),
+            Smx(0, [0.1, -2, 3e-20, 4]),
+            Wmxf(0, path),
+            Cmx(1, 2, 2),
+            Smxf(1, path),
+        ], context)
+        assert context.matrices[1] == Matrix(2, 2, [0.1, -2, 3e-20, 4])
+
+    def test_binary(self, context, tmpdir):
+        path = tmpdir.join('matrix.slmx')
+        eval_([
+            Cmx(0, 1, 1),
+            Smx(0, [1]),
+            Wmxf(0, str(path)),
+        ], context)
+        assert path.read('rb').startswith('SLMX')
+
+    def test_rewritten_file_is_read_again(self, context, tmpdir):
+        path = str(tmpdir.join('matrix'))
+        eval_([
+            Cmx(0, 1, 1),
+            Smx(0, [1]),
+            Wmxf(0, path),
+            Smxf(0, path),
+            Smx(0, [2]),
+            Wmxf(0, path),
+            Cmx(1, 1, 1),
+            Smxf(1, path),
+        ], context)
+        assert context.matrices[1] == Matrix(1, 1, [2])
+
+    def test_unpopulated(self, context, tmpdir):
+        with raises(MatrixWriteError) as exc_info:
+            eval_([
+                Cmx(3, 2, 2),
+                Wmxf(3, str(tmpdir.join('matrix'))),
+            ], context)
+        assert_exc_info_msg(
+            exc_info, 'Cannot write matrix 3: it is not populated')
+
+    def test_non_finite_text(self, context, tmpdir):
+        with raises(MatrixWriteError) as exc_info:
+            eval_([
+                Cmx(3, 1, 1),
+                Smx(3, [float('nan')]),
+                Wmxf(3, str(tmpdir.join('matrix'))),
+            ], context)
+        assert_exc_info_msg(
+            exc_info,
+            'Cannot write matrix 3: '
+            'non-finite reals can only be written in binary')
+
+    def test_uninitialized(self, context, tmpdir):
+        with raises(UninitializedVariableError) as exc_info:
+            eval_([Wmxf(7, str(tmpdir.join('matrix')))], context)
+        assert_exc_info_msg(
+            exc_info,
+            'Matrix 7 is not initialized. Please CMX first.')
+
+
+class TestSnap(object):
+    def test_numbered(self, context, tmpdir):
+        eval_([
+            Cmx(0, 1, 2),
+            Smx(0, [1, 2]),
+            Snap(0, str(tmpdir.join('frame.slmx'))),
+            Smx(0, [3, 4]),
+            Snap(0, str(tmpdir.join('frame.slmx'))),
+            Snap(0, str(tmpdir.join('other'))),
+        ], context)
+        context.snapshots.close()
+        assert sorted(path.basename for path in tmpdir.listdir()) == [
+            'frame.000000.slmx',
+            'frame.000001.slmx',
+            'other.000000',
+        ]
+        assert from_file(str(tmpdir.join('frame.000000.slmx'))) == Matrix(
+            1, 2, [1, 2])
+        assert from_file(str(tmpdir.join('frame.000001.slmx'))) == Matrix(
+            1, 2, [3, 4])
+        assert tmpdir.join('other.000000').read() == '3 4\n'
+
+    def test_more_than_queue_length(self, context, tmpdir):
+        bytecodes = [Cmx(0, 1, 1)]
+        for i in xrange(QUEUE_LENGTH * 3):
+            bytecodes += [Smx(0, [i]), Snap(0, str(tmpdir.join('frame')))]
+        eval_(bytecodes, context)
+        context.snapshots.close()
+        for i in xrange(QUEUE_LENGTH * 3):
+            assert tmpdir.join('frame.%06d' % i).read() == '%d\n' % i
+
+    def test_unpopulated(self, context, tmpdir):
+        with raises(MatrixWriteError) as exc_info:
+            eval_([
+                Cmx(3, 2, 2),
+                Snap(3, str(tmpdir.join('frame'))),
+            ], context)
+        assert_exc_info_msg(
+            exc_info, 'Cannot write matrix 3: it is not populated')
+
+    def test_non_finite_text(self, context, tmpdir):
+        eval_([
+            Cmx(3, 1, 1),
+            Smx(3, [float('nan')]),
+            Snap(3, str(tmpdir.join('frame'))),
+        ], context)
+        # The error is raised once the writer has run into it.
+        with raises(MatrixWriteError) as exc_info:
+            context.snapshots.close()
+        assert_exc_info_msg(
+            exc_info,
+            'Cannot write matrix 3: '
+            'non-finite reals can only be written in binary')
+
+    def test_uninitialized(self, context, tmpdir):
+        with raises(UninitializedVariableError) as exc_info:
+            eval_([Snap(7, str(tmpdir.join('frame')))], context)
+        assert_exc_info_msg(
+            exc_info,
+            'Matrix 7 is not initialized. Please CMX first.')
+
+
 class TestPde(object):
     def test_cmx_smx_pde(self, context, mock_apply_stencil):
         mock_apply_stencil.return_value = sentinel.transformed_matrix
@@ -370,3 +534,45 @@ class TestBne(object):
         assert_exc_info_msg(
             exc_info,
             'Register 0 is not initialized. Please STO first.')
+
+
+class TestAsSourceString(object):
+    def test_all_bytecodes(self):
+        bytecodes = [
+            Sto(1, -32),
+            Pr(1),
+            Add(1, 4),
+            Cmx(2, 1, 3),
+            Pmx(2),
+            Smx(2, [1.0, -0.1, 1e20]),
+            Smxf(2, 'file/name/with spaces'),
+            Wmxf(2, 'output.slmx'),
+            Snap(2, 'frame.slmx'),
+            Pde(3, 2),
+            Bne(1, 10, -2),
+        ]
+        assert [bytecode.as_source_string() for bytecode in bytecodes] == [
+            'STO 1 -32',
+            'PR 1',
+            'ADD 1 4',
+            'CMX 2 1 3',
+            'PMX 2',
+            'SMX 2 1 -0.1 1e20',
+            'SMXF 2 "file/name/with spaces"',
+            'WMXF 2 "output.slmx"',
+            'SNAP 2 "frame.slmx"',
+            'PDE 3 2',
+            'BNE 1 10 -2',
+        ]
+
+    def test_round_trip(self):
+        from stencil_lang.interpreter.lexer import lex
+        from stencil_lang.interpreter.parser import parse
+        bytecodes = [
+            Cmx(2, 2, 2),
+            Smx(2, [0.1 + 0.2, -1e-5, 3.0, 123456789.123]),
+            Bne(1, -10, -1),
+        ]
+        source_code = '\n'.join(
+            [bytecode.as_source_string() for bytecode in bytecodes]) + '\n'
+        assert parse(lex(source_code)) == bytecodes
@@ -0,0 +1,102 @@
+import errno
+
+from pytest import fixture
+from mock import patch
+
+from stencil_lang.interpreter.bytecodes import *  # NOQA
+from stencil_lang.interpreter.cache import (
+    MAGIC,
+    cache_filename,
+    dumps,
+    loads,
+    read_cache,
+    write_cache,
+)
+
+SOURCE = 'source code'
+
+
+@fixture
+def bytecodes():
+    return [
+        Sto(0, -3),
+        Pr(0),
+        Add(0, 1 << 40),
+        Cmx(1, 2, 2),
+        Pmx(1),
+        Smx(1, [1.5, -0.0, 1e300, float('inf')]),
+        Smxf(1, 'path/to/matrix'),
+        Wmxf(1, 'path/to/output'),
+        Snap(1, 'path/to/frame'),
+        Pde(1, 2),
+        Bne(0, 10, -2),
+    ]
+
+
+class TestCacheFilename(object):
+    def test_sl(self):
+        assert cache_filename('dir/program.sl') == 'dir/program.slc'
+
+    def test_other(self):
+        assert cache_filename('program') == 'program.slc'
+
+
+class TestDumpsLoads(object):
+    def test_round_trip(self, bytecodes):
+        assert loads(SOURCE, dumps(SOURCE, bytecodes)) == bytecodes
+
+    def test_empty(self):
+        assert loads(SOURCE, dumps(SOURCE, [])) == []
+
+    def test_magic(self, bytecodes):
+        assert dumps(SOURCE, bytecodes).startswith(MAGIC)
+
+    def test_stale(self, bytecodes):
+        assert loads('other source', dumps(SOURCE, bytecodes)) is None
+
+    def test_wrong_magic(self, bytecodes):
+        data = dumps(SOURCE, bytecodes)
+        assert loads(SOURCE, 'XXXX' + data[len(MAGIC):]) is None
+
+    def test_truncated(self, bytecodes):
+        data = dumps(SOURCE, bytecodes)
+        for length in xrange(len(data)):
+            assert loads(SOURCE, data[:length]) is None
+
+    def test_trailing_data(self, bytecodes):
+        assert loads(SOURCE, dumps(SOURCE, bytecodes) + 'S') is None
+
+    def test_unknown_tag(self):
+        data = dumps(SOURCE, [Pr(0)])
+        tag_pos = len(data) - 9
+        assert loads(SOURCE, data[:tag_pos] + '?' + data[tag_pos + 1:]) is None
+
+
+class TestReadWriteCache(object):
+    def test_round_trip(self, tmpdir, bytecodes):
+        filename = str(tmpdir.join('program.slc'))
+        write_cache(filename, SOURCE, bytecodes)
+        assert read_cache(filename, SOURCE) == bytecodes
+
+    def test_missing(self, tmpdir):
+        assert read_cache(str(tmpdir.join('missing.slc')), SOURCE) is None
+
+    def test_unwritable(self, tmpdir, bytecodes):
+        filename = str(tmpdir.join('missing', 'program.slc'))
+        # Should not raise.
+        write_cache(filename, SOURCE, bytecodes)
+        assert read_cache(filename, SOURCE) is None
+
+    def test_replaces_atomically(self, tmpdir, bytecodes):
+        path = tmpdir.join('program.slc')
+        path.write('stale')
+        with patch('stencil_lang.interpreter.cache.os.rename',
+                   side_effect=OSError(errno.EXDEV, 'rename failed')):
+            write_cache(str(path), SOURCE, bytecodes)
+        # A write which doesn't finish leaves the old cache alone, and no
+        # temporary file behind.
+        assert path.read() == 'stale'
+        assert tmpdir.listdir() == [path]
+        write_cache(str(path), SOURCE, bytecodes)
+        assert read_cache(str(path), SOURCE) == bytecodes
+        assert tmpdir.listdir() == [path]
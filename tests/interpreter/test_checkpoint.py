@@ -0,0 +1,218 @@
+from pytest import fixture, raises
+from mock import create_autospec
+
+from stencil_lang.interpreter import load, run_checkpointed
+from stencil_lang.interpreter.stencil import apply_stencil
+from stencil_lang.interpreter.bytecodes import *  # NOQA
+from stencil_lang.interpreter.checkpoint import (
+    MAGIC,
+    program_digest,
+    dumps,
+    loads,
+    save,
+    restore,
+    Checkpointer,
+)
+from stencil_lang.interpreter.evaluator import eval_
+from stencil_lang.matrix.snapshot import SnapshotWriter
+from stencil_lang.structures import Context, Matrix
+from stencil_lang.errors import CheckpointError
+from tests.helpers import assert_exc_info_msg
+
+DIGEST = 'd' * 16
+
+
+@fixture
+def context():
+    return Context(create_autospec(apply_stencil, spec_set=True))
+
+
+class TestProgramDigest(object):
+    def test_same_program(self):
+        assert (program_digest([Sto(0, 1), Pr(0)]) ==
+                program_digest([Sto(0, 1), Pr(0)]))
+
+    def test_different_program(self):
+        assert (program_digest([Sto(0, 1), Pr(0)]) !=
+                program_digest([Sto(0, 2), Pr(0)]))
+
+    def test_length(self):
+        assert len(program_digest([])) == 16
+
+
+class TestDumpsLoads(object):
+    def test_round_trip(self, context):
+        context.pc = 3
+        context.registers = {0: 7, 5: -2}
+        context.matrices = {
+            1: Matrix(2, 2, [1.5, -2.0, 0.0, 1e300]),
+            4: Matrix(3, 1, []),
+        }
+        data = dumps(DIGEST, context)
+        assert data.startswith(MAGIC + DIGEST)
+        restored = Context(context.apply_stencil)
+        loads(DIGEST, data, restored)
+        assert restored.pc == 3
+        assert restored.registers == {0: 7, 5: -2}
+        assert sorted(restored.matrices.keys()) == [1, 4]
+        assert restored.matrices[1].rows == 2
+        assert restored.matrices[1].cols == 2
+        assert restored.matrices[1].contents == [1.5, -2.0, 0.0, 1e300]
+        assert restored.matrices[4].rows == 3
+        assert restored.matrices[4].cols == 1
+        assert restored.matrices[4].contents == []
+        assert restored.snapshots is None
+
+    def test_snapshot_numbers(self, context):
+        context.snapshots = SnapshotWriter(1)
+        context.snapshots.numbers = {'frame.slmx': 3, 'other': 12}
+        restored = Context(context.apply_stencil)
+        loads(DIGEST, dumps(DIGEST, context), restored)
+        assert restored.snapshots.numbers == {'frame.slmx': 3, 'other': 12}
+
+    def test_not_checkpoint(self, context):
+        with raises(CheckpointError) as exc_info:
+            loads(DIGEST, 'SLC\x01' + DIGEST + '\0' * 16, context)
+        assert_exc_info_msg(
+            exc_info, 'Cannot restart from checkpoint: not a checkpoint file')
+
+    def test_short(self, context):
+        with raises(CheckpointError) as exc_info:
+            loads(DIGEST, MAGIC, context)
+        assert_exc_info_msg(
+            exc_info, 'Cannot restart from checkpoint: not a checkpoint file')
+
+    def test_different_program(self, context):
+        data = dumps('e' * 16, context)
+        with raises(CheckpointError) as exc_info:
+            loads(DIGEST, data, context)
+        assert_exc_info_msg(
+            exc_info, 'Cannot restart from checkpoint: '
+            'it was saved by a different program')
+
+    def test_truncated(self, context):
+        context.registers = {0: 1}
+        data = dumps(DIGEST, context)
+        with raises(CheckpointError) as exc_info:
+            loads(DIGEST, data[:-1], context)
+        assert_exc_info_msg(
+            exc_info, 'Cannot restart from checkpoint: it is corrupt')
+
+    def test_trailing(self, context):
+        data = dumps(DIGEST, context)
+        with raises(CheckpointError) as exc_info:
+            loads(DIGEST, data + '\0', context)
+        assert_exc_info_msg(
+            exc_info, 'Cannot restart from checkpoint: it is corrupt')
+
+    def test_context_unchanged_on_error(self, context):
+        context.registers = {0: 1}
+        data = dumps(DIGEST, context)
+        context.registers = {2: 3}
+        with raises(CheckpointError):
+            loads(DIGEST, data[:-1], context)
+        assert context.registers == {2: 3}
+
+
+class TestSaveRestore(object):
+    def test_round_trip(self, tmpdir, context):
+        filename = str(tmpdir.join('checkpoint'))
+        context.pc = 2
+        context.registers = {1: 4}
+        save(filename, dumps(DIGEST, context))
+        restored = Context(context.apply_stencil)
+        restore(filename, DIGEST, restored)
+        assert restored.pc == 2
+        assert restored.registers == {1: 4}
+
+    def test_replaces(self, tmpdir, context):
+        checkpoint = tmpdir.join('checkpoint')
+        checkpoint.write('old')
+        save(str(checkpoint), 'new')
+        assert checkpoint.read() == 'new'
+        # The temporary file has been renamed over the checkpoint.
+        assert tmpdir.listdir() == [checkpoint]
+
+    def test_restore_missing(self, tmpdir, context):
+        filename = str(tmpdir.join('missing'))
+        with raises(CheckpointError) as exc_info:
+            restore(filename, DIGEST, context)
+        assert_exc_info_msg(
+            exc_info, 'Cannot restart from checkpoint: cannot read ' +
+            filename)
+
+
+class TestCheckpointer(object):
+    def test_every(self, tmpdir, context):
+        checkpoint = tmpdir.join('checkpoint')
+        context.checkpointer = Checkpointer(str(checkpoint), 2, DIGEST)
+        eval_([Sto(0, 1), Sto(1, 2), Sto(2, 3)], context)
+        # Saved after the second bytecode only.
+        restored = Context(context.apply_stencil)
+        restore(str(checkpoint), DIGEST, restored)
+        assert restored.pc == 2
+        assert restored.registers == {0: 1, 1: 2}
+        assert context.registers == {0: 1, 1: 2, 2: 3}
+
+    def test_never(self, tmpdir, context):
+        checkpoint = tmpdir.join('checkpoint')
+        context.checkpointer = Checkpointer(str(checkpoint), 0, DIGEST)
+        eval_([Sto(0, 1)], context)
+        assert not checkpoint.check()
+        assert context.registers == {0: 1}
+
+
+class TestRunCheckpointed(object):
+    SOURCE = 'STO 0 0\nADD 0 1\nBNE 0 5 -1\nPR 0\n'
+
+    def test_restart(self, tmpdir, capsys):
+        checkpoint = tmpdir.join('checkpoint')
+        # ADD and BNE are fused, so 7 bytecodes run; the last checkpoint is
+        # saved after the fifth.
+        run_checkpointed(self.SOURCE, str(checkpoint), 5)
+        out, err = capsys.readouterr()
+        assert out == '5\n'
+        # Restarting from the last checkpoint runs only the rest of the loop.
+        digest = program_digest(load(self.SOURCE))
+        context = Context(apply_stencil)
+        restore(str(checkpoint), digest, context)
+        assert context.pc == 1
+        assert context.registers == {0: 4}
+        run_checkpointed(self.SOURCE, '', 0, str(checkpoint))
+        out, err = capsys.readouterr()
+        assert out == '5\n'
+
+    def test_stencil_loop_not_fused(self, tmpdir):
+        checkpoint = tmpdir.join('checkpoint')
+        source = ('CMX 0 1 1\nSMX 0 1\nCMX 1 1 1\nSMX 1 2\nSTO 0 0\n'
+                  'ADD 0 1\nPDE 0 1\nBNE 0 3 -2\n')
+        # The checkpoint is saved within the loop, after its first
+        # iteration.
+        run_checkpointed(source, str(checkpoint), 8)
+        digest = program_digest(load(source))
+        context = Context(apply_stencil)
+        restore(str(checkpoint), digest, context)
+        assert context.pc == 5
+        assert context.registers == {0: 1}
+
+    def test_restart_snapshot_numbers(self, tmpdir):
+        checkpoint = tmpdir.join('checkpoint')
+        frame = tmpdir.join('frame')
+        source = ('CMX 0 1 1\nSMX 0 1\nSTO 0 0\nSNAP 0 "%s"\nADD 0 1\n'
+                  'BNE 0 3 -2\n' % frame)
+        # The checkpoint is saved after the second snapshot.
+        run_checkpointed(source, str(checkpoint), 7)
+        for path in tmpdir.listdir():
+            if path.basename.startswith('frame.'):
+                path.remove()
+        run_checkpointed(source, '', 0, str(checkpoint))
+        # Only the last snapshot is taken again, with its own number.
+        assert sorted(path.basename for path in tmpdir.listdir()
+                      if path.basename.startswith('frame.')) == [
+            'frame.000002']
+
+    def test_restart_different_program(self, tmpdir):
+        checkpoint = tmpdir.join('checkpoint')
+        run_checkpointed('STO 0 1\n', str(checkpoint), 1)
+        with raises(CheckpointError):
+            run_checkpointed('STO 0 2\n', '', 0, str(checkpoint))
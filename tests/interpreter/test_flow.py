@@ -0,0 +1,60 @@
+from stencil_lang.interpreter.bytecodes import *  # NOQA
+from stencil_lang.interpreter.peephole import AddBne
+from stencil_lang.interpreter.flow import successors, relocate
+
+
+class TestSuccessors(object):
+    def test_fall_through(self):
+        assert successors([Sto(0, 0), Pr(0)], 0) == [1]
+
+    def test_end_of_program(self):
+        assert successors([Sto(0, 0), Pr(0)], 1) == [2]
+
+    def test_bne(self):
+        assert successors([Sto(0, 0), Bne(0, 1, -1)], 1) == [2, 0]
+
+    def test_add_bne(self):
+        assert successors([Sto(0, 0), AddBne(0, 1, 3, 1)], 1) == [2, 1]
+
+
+class TestRelocate(object):
+    def test_forward_and_backward(self):
+        assert relocate([
+            Sto(0, 0),
+            Sto(1, 0),
+            Add(0, 1),
+            Sto(1, 0),
+            Bne(0, 10, -3),
+            Bne(0, 10, 2),
+            Sto(1, 0),
+            Pr(0),
+        ], [False, True, False, True, False, False, True, False]) == [
+            Sto(0, 0),
+            Add(0, 1),
+            Bne(0, 10, -1),
+            Bne(0, 10, 1),
+            Pr(0),
+        ]
+
+    def test_keeps_destination_at_end(self):
+        assert relocate([
+            Sto(0, 0),
+            Bne(0, 10, 2),
+            Sto(1, 0),
+            Sto(2, 0),
+        ], [False, False, True, True]) == [
+            Sto(0, 0),
+            Bne(0, 10, 1),
+            Sto(2, 0),
+        ]
+
+    def test_keeps_destination_of_self_loop(self):
+        assert relocate([
+            Sto(0, 0),
+            Sto(1, 0),
+            Bne(0, 10, -1),
+        ], [False, True, False]) == [
+            Sto(0, 0),
+            Sto(1, 0),
+            Bne(0, 10, -1),
+        ]
@@ -1,16 +1,23 @@
-from pytest import raises
+from pytest import raises, fixture
 import pytest
 parametrize = pytest.mark.parametrize
 from rply import Token
 from rply.errors import LexingError
 
 from stencil_lang.interpreter.lexer import lex
+from stencil_lang.interpreter.scanner import scan
 
 from tests.helpers import lit
 
 
-def assert_lex_token_list(code, expected_token_tuples):
-    stream = lex(code)
+# The hand-written scanner must behave exactly like the generated lexer.
+@fixture(params=[lex, scan])
+def lexer(request):
+    return request.param
+
+
+def assert_lex_token_list(lexer, code, expected_token_tuples):
+    stream = lexer(code)
 
     # For some reason, pytest always says there is a diff at index 0, even when
     # it occurs elsewhere in the list. Falling back to asserting in a loop.
@@ -29,64 +36,70 @@ def assert_lex_token_list(code, expected_token_tuples):
 
 class TestLexer(object):
     class TestValid(object):
-        def test_sto(self):
-            assert_lex_token_list('STO', [lit('STO')])
+        def test_sto(self, lexer):
+            assert_lex_token_list(lexer, 'STO', [lit('STO')])
+
+        def test_pr(self, lexer):
+            assert_lex_token_list(lexer, 'PR', [lit('PR')])
 
-        def test_pr(self):
-            assert_lex_token_list('PR', [lit('PR')])
+        def test_add(self, lexer):
+            assert_lex_token_list(lexer, 'ADD', [lit('ADD')])
 
-        def test_add(self):
-            assert_lex_token_list('ADD', [lit('ADD')])
+        def test_cmx(self, lexer):
+            assert_lex_token_list(lexer, 'CMX', [lit('CMX')])
 
-        def test_cmx(self):
-            assert_lex_token_list('CMX', [lit('CMX')])
+        def test_pmx(self, lexer):
+            assert_lex_token_list(lexer, 'PMX', [lit('PMX')])
 
-        def test_pmx(self):
-            assert_lex_token_list('PMX', [lit('PMX')])
+        def test_smx(self, lexer):
+            assert_lex_token_list(lexer, 'SMX', [lit('SMX')])
 
-        def test_smx(self):
-            assert_lex_token_list('SMX', [lit('SMX')])
+        def test_smxf(self, lexer):
+            assert_lex_token_list(lexer, 'SMXF', [lit('SMXF')])
 
-        def test_smxf(self):
-            assert_lex_token_list('SMXF', [lit('SMXF')])
+        def test_wmxf(self, lexer):
+            assert_lex_token_list(lexer, 'WMXF', [lit('WMXF')])
 
-        def test_pde(self):
-            assert_lex_token_list('PDE', [lit('PDE')])
+        def test_snap(self, lexer):
+            assert_lex_token_list(lexer, 'SNAP', [lit('SNAP')])
 
-        def test_bne(self):
-            assert_lex_token_list('BNE', [lit('BNE')])
+        def test_pde(self, lexer):
+            assert_lex_token_list(lexer, 'PDE', [lit('PDE')])
 
-        def test_pos_int(self):
-            assert_lex_token_list('20', [('POS_INT', '20')])
+        def test_bne(self, lexer):
+            assert_lex_token_list(lexer, 'BNE', [lit('BNE')])
 
-        def test_pos_int_leading_zero(self):
-            assert_lex_token_list('0020', [('POS_INT', '0020')])
+        def test_pos_int(self, lexer):
+            assert_lex_token_list(lexer, '20', [('POS_INT', '20')])
 
-        def test_neg_int(self):
-            assert_lex_token_list('-78', [('NEG_INT', '-78')])
+        def test_pos_int_leading_zero(self, lexer):
+            assert_lex_token_list(lexer, '0020', [('POS_INT', '0020')])
 
-        def test_neg_int_leading_zero(self):
-            assert_lex_token_list('-078', [('NEG_INT', '-078')])
+        def test_neg_int(self, lexer):
+            assert_lex_token_list(lexer, '-78', [('NEG_INT', '-78')])
+
+        def test_neg_int_leading_zero(self, lexer):
+            assert_lex_token_list(lexer, '-078', [('NEG_INT', '-078')])
 
         @parametrize('real', ['1.2e10', '10e2', '-9.1e-3', '5e-6'])
-        def test_real_scientific_notation(self, real):
-            assert_lex_token_list(real, [('REAL_SCI', real)])
+        def test_real_scientific_notation(self, lexer, real):
+            assert_lex_token_list(lexer, real, [('REAL_SCI', real)])
 
-        def test_filename_without_spaces(self):
-            assert_lex_token_list('"file/name/withoutspaces"',
+        def test_filename_without_spaces(self, lexer):
+            assert_lex_token_list(lexer, '"file/name/withoutspaces"',
                                   [('FILENAME', '"file/name/withoutspaces"')])
 
-        def test_filename_with_spaces(self):
-            assert_lex_token_list('"file/name/with spaces"',
+        def test_filename_with_spaces(self, lexer):
+            assert_lex_token_list(lexer, '"file/name/with spaces"',
                                   [('FILENAME', '"file/name/with spaces"')])
 
-        def test_sto_pr(self):
+        def test_sto_pr(self, lexer):
             code = '''STO 1 32.3
 PR 2
 STO 10 -0.1
 PR 32
 '''
-            assert_lex_token_list(code, [
+            assert_lex_token_list(lexer, code, [
                 lit('STO'),
                 ('POS_INT', '1'),
                 ('REAL', '32.3'),
@@ -99,12 +112,12 @@ PR 32
                 ('POS_INT', '32'),
             ])
 
-        def test_pr_cmx_add(self):
+        def test_pr_cmx_add(self, lexer):
             code = '''CMX 32 11 7
 PR 11
 ADD 1 2.2
 '''
-            assert_lex_token_list(code, [
+            assert_lex_token_list(lexer, code, [
                 lit('CMX'),
                 ('POS_INT', '32'),
                 ('POS_INT', '11'),
@@ -117,42 +130,72 @@ ADD 1 2.2
             ])
 
     class TestInvalid(object):
-        def test_nothing(self):
-            stream = lex('')
+        def test_nothing(self, lexer):
+            stream = lexer('')
             with raises(StopIteration):
                 next(stream)
 
-        def test_invalid_token(self):
-            stream = lex('ABCD')
+        def test_invalid_token(self, lexer):
+            stream = lexer('ABCD')
             with raises(LexingError):
                 next(stream)
 
-        def test_invalid_sto(self):
-            stream = lex('STO 1 hello')
+        def test_invalid_sto(self, lexer):
+            stream = lexer('STO 1 hello')
             for _ in xrange(2):
                 next(stream)
             with raises(LexingError):
                 next(stream)
 
-        def test_invalid_next_instruction(self):
-            stream = lex('STO 1 123.3\nawesome')
+        def test_invalid_next_instruction(self, lexer):
+            stream = lexer('STO 1 123.3\nawesome')
             for _ in xrange(3):
                 next(stream)
             with raises(LexingError):
                 next(stream)
 
-        def test_invalid_continues_to_raise_lexing_errors(self):
-            stream = lex('ABCD')
+        def test_invalid_continues_to_raise_lexing_errors(self, lexer):
+            stream = lexer('ABCD')
             for _ in xrange(5):
                 with raises(LexingError):
                     next(stream)
 
-        def test_unclosed_file_name(self):
-            stream = lex('"')
+        def test_unclosed_file_name(self, lexer):
+            stream = lexer('"')
             with raises(LexingError):
                 next(stream)
 
-        def test_empty_file_name(self):
-            stream = lex('""')
+        def test_empty_file_name(self, lexer):
+            stream = lexer('""')
             with raises(LexingError):
                 next(stream)
+
+
+def token_tuples(lexer, code):
+    """Lex all of `code`, including the position of each token and of any
+    error.
+    """
+    stream = lexer(code)
+    tuples = []
+    while True:
+        try:
+            token = next(stream)
+        except StopIteration:
+            return tuples
+        except LexingError as error:
+            tuples.append(('error', error.getsourcepos().idx))
+            return tuples
+        pos = token.getsourcepos()
+        tuples.append((token.name, token.value, pos.idx, pos.lineno,
+                       pos.colno))
+
+
+class TestScannerMatchesGenerated(object):
+    @parametrize('code', [
+        'SMX 1 1.5 -2. 3e4 -5.5e-6\n\tSMXF 2 "a\nb"\r\n  PR 3 ',
+        'STO1', '1STO', '1.STO', '1e5STO', 'SMXFF', 'STO_', 'sto',
+        '1e', '1e-', '1.e5', '1.5.3', '-', '-.5', '--1', '-e5', '1-2',
+        '12abc', '"', '""', '"abc', '"a" "b"', '\x0b\x0cPR 1', 'PR\n\n1\n x',
+    ])
+    def test_same_tokens(self, code):
+        assert token_tuples(scan, code) == token_tuples(lex, code)
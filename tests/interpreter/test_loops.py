@@ -0,0 +1,206 @@
+from pytest import fixture
+from mock import create_autospec, sentinel
+
+from stencil_lang.interpreter.stencil import apply_stencil
+from stencil_lang.interpreter.bytecodes import *  # NOQA
+from stencil_lang.interpreter.loops import CountedLoop, lower_loops
+from stencil_lang.interpreter.verifier import (
+    verify,
+    UncheckedAdd,
+    UncheckedPr,
+    UncheckedPde,
+)
+from stencil_lang.interpreter.evaluator import eval_
+from stencil_lang.structures import Context
+
+
+@fixture
+def mock_apply_stencil():
+    return create_autospec(apply_stencil, spec_set=True)
+
+
+@fixture
+def context(mock_apply_stencil):
+    return Context(mock_apply_stencil)
+
+
+class TestLowerLoops(object):
+    def test_empty_body(self):
+        assert lower_loops([
+            Sto(0, 0),
+            Add(0, 1),
+            Bne(0, 10, -1),
+            Pr(0),
+        ]) == [
+            Sto(0, 0),
+            CountedLoop(0, 10, [], True, 10),
+            Pr(0),
+        ]
+
+    def test_body(self):
+        assert lower_loops([
+            Sto(0, 0),
+            Add(0, 1),
+            Pde(0, 1),
+            Bne(0, 12, -2),
+        ]) == [
+            Sto(0, 0),
+            CountedLoop(0, 12, [Pde(0, 1)], True, 12),
+        ]
+
+    def test_body_reads_counter(self):
+        assert lower_loops([
+            Sto(0, 0),
+            Add(0, 2),
+            Pr(0),
+            Bne(0, 6, -2),
+        ]) == [
+            Sto(0, 0),
+            CountedLoop(0, 3, [Add(0, 2), Pr(0)], False, 6),
+        ]
+
+    def test_counting_down(self):
+        assert lower_loops([
+            Sto(0, 5),
+            Add(0, -1),
+            Bne(0, 0, -1),
+        ]) == [
+            Sto(0, 5),
+            CountedLoop(0, 5, [], True, 0),
+        ]
+
+    def test_nested(self):
+        assert lower_loops([
+            Sto(0, 0),
+            Add(0, 1),
+            Sto(1, 0),
+            Add(1, 1),
+            Pde(0, 1),
+            Bne(1, 3, -2),
+            Bne(0, 2, -5),
+        ]) == [
+            Sto(0, 0),
+            CountedLoop(0, 2, [
+                Sto(1, 0),
+                CountedLoop(1, 3, [Pde(0, 1)], True, 3),
+            ], True, 2),
+        ]
+
+    def test_relocates_branches(self):
+        assert lower_loops([
+            Sto(1, 0),
+            Bne(1, 1, 4),
+            Sto(0, 0),
+            Add(0, 1),
+            Bne(0, 10, -1),
+            Pr(1),
+        ]) == [
+            Sto(1, 0),
+            Bne(1, 1, 3),
+            Sto(0, 0),
+            CountedLoop(0, 10, [], True, 10),
+            Pr(1),
+        ]
+
+    def test_never_ends(self):
+        bytecodes = [
+            Sto(0, 0),
+            Add(0, 2),
+            Bne(0, 5, -1),
+        ]
+        assert lower_loops(bytecodes) == bytecodes
+
+    def test_wrong_direction(self):
+        bytecodes = [
+            Sto(0, 10),
+            Add(0, 1),
+            Bne(0, 5, -1),
+        ]
+        assert lower_loops(bytecodes) == bytecodes
+
+    def test_counter_stored_in_body(self):
+        bytecodes = [
+            Sto(0, 0),
+            Add(0, 1),
+            Sto(0, 3),
+            Bne(0, 10, -2),
+        ]
+        assert lower_loops(bytecodes) == bytecodes
+
+    def test_two_increments(self):
+        bytecodes = [
+            Sto(0, 0),
+            Add(0, 1),
+            Add(0, 1),
+            Bne(0, 10, -2),
+        ]
+        assert lower_loops(bytecodes) == bytecodes
+
+    def test_no_sto(self):
+        bytecodes = [
+            Add(0, 1),
+            Bne(0, 10, -1),
+        ]
+        assert lower_loops(bytecodes) == bytecodes
+
+    def test_branch_into_body(self):
+        bytecodes = [
+            Sto(0, 0),
+            Bne(0, 1, 3),
+            Sto(0, 0),
+            Add(0, 1),
+            Pr(0),
+            Bne(0, 10, -2),
+        ]
+        assert lower_loops(bytecodes) == bytecodes
+
+
+class TestCountedLoop(object):
+    def test_eval(self, context, mock_apply_stencil):
+        mock_apply_stencil.return_value = sentinel.transformed_matrix
+        eval_([
+            Cmx(0, 1, 1),
+            Cmx(1, 1, 1),
+            Sto(0, 0),
+            CountedLoop(0, 4, [Pde(0, 1)], True, 4),
+        ], context)
+        assert mock_apply_stencil.call_count == 4
+        assert context.registers[0] == 4
+        assert context.matrices[1] == sentinel.transformed_matrix
+
+    def test_eval_reads_counter(self, context, capsys):
+        eval_([
+            Sto(0, 0),
+            CountedLoop(0, 3, [Add(0, 2), Pr(0)], False, 6),
+        ], context)
+        assert context.registers[0] == 6
+        out, err = capsys.readouterr()
+        assert '2\n4\n6\n' == out
+
+    def test_verify_body(self):
+        assert verify([
+            Sto(0, 0),
+            Cmx(1, 1, 1),
+            CountedLoop(0, 3, [Add(0, 1), Pr(0), Pde(1, 2), Cmx(2, 1, 1)],
+                        False, 3),
+        ]) == [
+            Sto(0, 0),
+            Cmx(1, 1, 1),
+            CountedLoop(0, 3, [UncheckedAdd(0, 1), UncheckedPr(0),
+                               Pde(1, 2), Cmx(2, 1, 1)],
+                        False, 3),
+        ]
+
+    def test_verify_nested_body(self):
+        assert verify([
+            Cmx(0, 1, 1),
+            Cmx(1, 1, 1),
+            CountedLoop(0, 2, [CountedLoop(1, 3, [Pde(0, 1)], True, 3)],
+                        True, 2),
+        ]) == [
+            Cmx(0, 1, 1),
+            Cmx(1, 1, 1),
+            CountedLoop(0, 2, [
+                CountedLoop(1, 3, [UncheckedPde(0, 1)], True, 3),
+            ], True, 2),
+        ]
@@ -0,0 +1,248 @@
+from pytest import raises
+
+from stencil_lang.interpreter.bytecodes import *  # NOQA
+from stencil_lang.interpreter.optimizer import (
+    optimize,
+    propagate_constants,
+    eliminate_dead_stores,
+    eliminate_unused_matrices,
+)
+from stencil_lang.errors import InvalidBranchOffsetError
+
+
+class TestPropagateConstants(object):
+    def test_add_becomes_sto(self):
+        assert propagate_constants([
+            Sto(0, 10),
+            Add(0, 5),
+            Pr(0),
+        ]) == [
+            Sto(0, 10),
+            Sto(0, 15),
+            Pr(0),
+        ]
+
+    def test_add_zero(self):
+        assert propagate_constants([
+            Sto(0, 0),
+            Add(0, 1),
+            Bne(0, 10, -1),
+            Add(0, 0),
+            Pr(0),
+        ]) == [
+            Sto(0, 0),
+            Add(0, 1),
+            Bne(0, 10, -1),
+            Pr(0),
+        ]
+
+    def test_add_zero_uninitialized(self):
+        # Must still raise an error.
+        bytecodes = [Add(0, 0)]
+        assert propagate_constants(bytecodes) == bytecodes
+
+    def test_loop_counter_is_not_constant(self):
+        bytecodes = [
+            Sto(0, 0),
+            Add(0, 1),
+            Bne(0, 10, -1),
+            Pr(0),
+        ]
+        assert propagate_constants(bytecodes) == bytecodes
+
+    def test_never_taken_branch(self):
+        assert propagate_constants([
+            Sto(0, 10),
+            Bne(0, 10, 2),
+            Pr(0),
+            Sto(1, 3),
+        ]) == [
+            Sto(0, 10),
+            Pr(0),
+            Sto(1, 3),
+        ]
+
+    def test_always_taken_branch(self):
+        assert propagate_constants([
+            Sto(0, 10),
+            Bne(0, 20, 3),
+            Pr(0),
+            Sto(1, 30),
+            Pr(1),
+        ]) == [
+            Sto(0, 10),
+            Bne(0, 20, 1),
+            Pr(1),
+        ]
+
+    def test_branch_to_next(self):
+        assert propagate_constants([
+            Sto(0, 0),
+            Add(0, 1),
+            Bne(0, 10, -1),
+            Bne(0, 3, 1),
+            Pr(0),
+        ]) == [
+            Sto(0, 0),
+            Add(0, 1),
+            Bne(0, 10, -1),
+            Pr(0),
+        ]
+
+
+class TestEliminateDeadStores(object):
+    def test_overwritten(self):
+        assert eliminate_dead_stores([
+            Sto(0, 1),
+            Sto(0, 2),
+            Pr(0),
+        ]) == [
+            Sto(0, 2),
+            Pr(0),
+        ]
+
+    def test_never_read(self):
+        assert eliminate_dead_stores([
+            Sto(0, 1),
+            Sto(1, 2),
+            Pr(1),
+        ]) == [
+            Sto(1, 2),
+            Pr(1),
+        ]
+
+    def test_dead_add_chain(self):
+        assert eliminate_dead_stores([
+            Sto(0, 1),
+            Add(0, 2),
+            Sto(1, 2),
+            Pr(1),
+        ]) == [
+            Sto(1, 2),
+            Pr(1),
+        ]
+
+    def test_dead_add_uninitialized(self):
+        # Must still raise an error.
+        bytecodes = [Add(0, 2)]
+        assert eliminate_dead_stores(bytecodes) == bytecodes
+
+    def test_read_in_loop(self):
+        bytecodes = [
+            Sto(0, 0),
+            Add(0, 1),
+            Bne(0, 10, -1),
+        ]
+        assert eliminate_dead_stores(bytecodes) == bytecodes
+
+
+class TestEliminateUnusedMatrices(object):
+    def test_unused(self):
+        assert eliminate_unused_matrices([
+            Cmx(0, 1, 2),
+            Smx(0, [1, 2]),
+            Cmx(1, 1, 1),
+            Pmx(1),
+        ]) == [
+            Cmx(1, 1, 1),
+            Pmx(1),
+        ]
+
+    def test_used_by_pde(self):
+        bytecodes = [
+            Cmx(0, 1, 1),
+            Cmx(1, 1, 1),
+            Pde(0, 1),
+        ]
+        assert eliminate_unused_matrices(bytecodes) == bytecodes
+
+    def test_invalid_dimensions(self):
+        bytecodes = [Cmx(0, 0, 2)]
+        assert eliminate_unused_matrices(bytecodes) == bytecodes
+
+    def test_wrong_number_of_values(self):
+        bytecodes = [
+            Cmx(0, 1, 2),
+            Smx(0, [1, 2, 3]),
+        ]
+        assert eliminate_unused_matrices(bytecodes) == bytecodes
+
+    def test_uninitialized(self):
+        bytecodes = [
+            Smx(0, [1, 2]),
+            Cmx(0, 1, 2),
+        ]
+        assert eliminate_unused_matrices(bytecodes) == bytecodes
+
+    def test_smxf(self):
+        bytecodes = [
+            Cmx(0, 3, 3),
+            Smxf(0, 'does-not-exist'),
+        ]
+        assert eliminate_unused_matrices(bytecodes) == bytecodes
+
+    def test_wmxf(self):
+        bytecodes = [
+            Cmx(0, 1, 2),
+            Smx(0, [1, 2]),
+            Wmxf(0, 'output'),
+        ]
+        assert eliminate_unused_matrices(bytecodes) == bytecodes
+
+    def test_snap(self):
+        bytecodes = [
+            Cmx(0, 1, 2),
+            Smx(0, [1, 2]),
+            Snap(0, 'frame'),
+        ]
+        assert eliminate_unused_matrices(bytecodes) == bytecodes
+
+    def test_branch_target(self):
+        # Removing the matrix would keep the SMX the branch goes to without
+        # the CMX before it.
+        bytecodes = [
+            Cmx(1, 1, 1),
+            Smx(1, [5]),
+            Bne(0, 1, -1),
+            Pr(0),
+        ]
+        assert eliminate_unused_matrices(bytecodes) == bytecodes
+
+
+class TestOptimize(object):
+    def test_donor_cell(self):
+        bytecodes = [
+            Cmx(0, 3, 3),
+            Smxf(0, 'stencil'),
+            Cmx(1, 3, 3),
+            Smxf(1, 'psi'),
+            Sto(0, 0),
+            Add(0, 1),
+            Pde(0, 1),
+            Bne(0, 12, -2),
+            Pmx(1),
+        ]
+        assert optimize(bytecodes) == bytecodes
+
+    def test_folds_straight_line_program(self):
+        assert optimize([
+            Sto(10, 45),
+            Add(10, 0),
+            Pr(10),
+            Add(10, 54),
+            Pr(10),
+            Cmx(3, 2, 2),
+            Smx(3, [1, 2, 3, 4]),
+        ]) == [
+            Sto(10, 45),
+            Pr(10),
+            Sto(10, 99),
+            Pr(10),
+        ]
+
+    def test_rejects_invalid_branch(self):
+        with raises(InvalidBranchOffsetError):
+            optimize([
+                Sto(0, 10),
+                Bne(0, 20, 100),
+            ])
@@ -204,6 +204,28 @@ class TestSmxf(object):
         ]
 
 
+class TestWmxf(object):
+    def test_wmxf(self):
+        assert parse(mkiter([
+            lit('WMXF'),
+            ('POS_INT', '31'),
+            ('FILENAME', '"a/random/file name"')
+        ])) == [
+            Wmxf(31, 'a/random/file name'),
+        ]
+
+
+class TestSnap(object):
+    def test_snap(self):
+        assert parse(mkiter([
+            lit('SNAP'),
+            ('POS_INT', '4'),
+            ('FILENAME', '"frames/frame.slmx"')
+        ])) == [
+            Snap(4, 'frames/frame.slmx'),
+        ]
+
+
 class TestPde(object):
     def test_pde(self):
         parse(mkiter([
@@ -0,0 +1,187 @@
+from pytest import fixture, raises
+from mock import create_autospec, sentinel
+
+from stencil_lang.interpreter.stencil import apply_stencil
+from stencil_lang.interpreter.bytecodes import *  # NOQA
+from stencil_lang.interpreter.peephole import fuse, AddBne, PdeLoop
+from stencil_lang.interpreter.evaluator import eval_
+from stencil_lang.structures import Context, Matrix
+from stencil_lang.errors import UninitializedVariableError
+
+from tests.helpers import assert_exc_info_msg
+
+
+@fixture
+def mock_apply_stencil():
+    return create_autospec(apply_stencil, spec_set=True)
+
+
+@fixture
+def context(mock_apply_stencil):
+    return Context(mock_apply_stencil)
+
+
+class TestFuse(object):
+    def test_no_fusion(self):
+        bytecodes = [Sto(0, 1), Pr(0), Add(0, 2)]
+        assert fuse(bytecodes) == bytecodes
+
+    def test_add_bne(self):
+        assert fuse([
+            Sto(0, 0),
+            Add(0, 1),
+            Bne(0, 10, -1),
+            Pr(0),
+        ]) == [
+            Sto(0, 0),
+            AddBne(0, 1, 10, 1),
+            Pr(0),
+        ]
+
+    def test_add_bne_different_registers(self):
+        bytecodes = [
+            Sto(0, 0),
+            Sto(1, 0),
+            Add(0, 1),
+            Bne(1, 10, -1),
+        ]
+        assert fuse(bytecodes) == bytecodes
+
+    def test_add_pde_bne(self):
+        assert fuse([
+            Sto(0, 0),
+            Add(0, 1),
+            Pde(1, 2),
+            Bne(0, 12, -2),
+            Pmx(2),
+        ]) == [
+            Sto(0, 0),
+            PdeLoop(0, 1, 1, 2, 12),
+            Pmx(2),
+        ]
+
+    def test_whole_loops_not_fused(self):
+        assert fuse([
+            Sto(0, 0),
+            Add(0, 1),
+            Pde(1, 2),
+            Bne(0, 12, -2),
+            Add(0, 1),
+            Bne(0, 20, -1),
+        ], whole_loops=False) == [
+            Sto(0, 0),
+            Add(0, 1),
+            Pde(1, 2),
+            Bne(0, 12, -2),
+            AddBne(0, 1, 20, 4),
+        ]
+
+    def test_add_pde_bne_not_a_loop(self):
+        # Branches to the PDE, so it is not the counted loop. The ADD and BNE
+        # are not adjacent either, so nothing can be fused.
+        bytecodes = [
+            Sto(0, 0),
+            Add(0, 1),
+            Pde(1, 2),
+            Bne(0, 12, -1),
+        ]
+        assert fuse(bytecodes) == bytecodes
+
+    def test_interior_branch_target(self):
+        # The BNE is itself a branch target, so it cannot be fused into the
+        # ADD before it.
+        bytecodes = [
+            Sto(0, 0),
+            Bne(0, 1, 2),
+            Add(0, 1),
+            Bne(0, 10, -1),
+        ]
+        assert fuse(bytecodes) == bytecodes
+
+    def test_relocates_branches(self):
+        assert fuse([
+            Sto(0, 0),
+            Sto(1, 0),
+            Add(1, 1),
+            Bne(1, 5, -1),
+            Bne(0, 1, -4),
+            Bne(0, 0, 2),
+            Pr(0),
+            Pr(1),
+        ]) == [
+            Sto(0, 0),
+            Sto(1, 0),
+            AddBne(1, 1, 5, 2),
+            Bne(0, 1, -3),
+            Bne(0, 0, 2),
+            Pr(0),
+            Pr(1),
+        ]
+
+    def test_invalid_branch_unchanged(self):
+        bytecodes = [
+            Sto(0, 0),
+            Add(0, 1),
+            Bne(0, 10, -100),
+        ]
+        assert fuse(bytecodes) == bytecodes
+
+
+class TestAddBne(object):
+    def test_loop(self, context):
+        eval_(fuse([
+            Sto(0, 0),
+            Add(0, 1),
+            Bne(0, 10, -1),
+        ]), context)
+        assert context.registers[0] == 10
+
+    def test_uninitialized(self, context):
+        with raises(UninitializedVariableError) as exc_info:
+            eval_([AddBne(3, 1, 10, 0)], context)
+        assert_exc_info_msg(
+            exc_info, 'Register 3 is not initialized. Please STO first.')
+
+
+class TestPdeLoop(object):
+    def test_loop(self, context, mock_apply_stencil):
+        mock_apply_stencil.return_value = sentinel.transformed_matrix
+        eval_(fuse([
+            Cmx(1, 1, 1),
+            Cmx(2, 1, 1),
+            Sto(0, 0),
+            Add(0, 1),
+            Pde(1, 2),
+            Bne(0, 3, -2),
+        ]), context)
+        assert context.registers[0] == 3
+        assert mock_apply_stencil.call_count == 3
+        assert context.matrices[2] == sentinel.transformed_matrix
+
+    def test_uninitialized_matrix(self, context, mock_apply_stencil):
+        with raises(UninitializedVariableError) as exc_info:
+            eval_([
+                Cmx(1, 1, 1),
+                Sto(0, 0),
+                PdeLoop(0, 1, 1, 2, 3),
+            ], context)
+        assert_exc_info_msg(
+            exc_info, 'Matrix 2 is not initialized. Please CMX first.')
+        # The counter was incremented before the PDE failed.
+        assert context.registers[0] == 1
+        assert mock_apply_stencil.call_count == 0
+
+    def test_applies_real_stencil(self):
+        context = Context(apply_stencil)
+        eval_(fuse([
+            Cmx(0, 1, 1),
+            Smx(0, [1]),
+            Cmx(1, 1, 2),
+            Smx(1, [1, 2]),
+            Sto(0, 0),
+            Add(0, 1),
+            Pde(0, 1),
+            Bne(0, 2, -2),
+        ]), context)
+        # Each application doubles the matrix.
+        assert context.matrices[1] == Matrix(1, 2, [4, 8])
@@ -0,0 +1,104 @@
+from pytest import fixture, raises
+from mock import create_autospec, patch
+
+from stencil_lang.interpreter.stencil import apply_stencil
+from stencil_lang.interpreter.bytecodes import *  # NOQA
+from stencil_lang.interpreter.evaluator import eval_, eval_profiled
+from stencil_lang.interpreter.profiler import statement_lines, Profile
+from stencil_lang.structures import Context
+from stencil_lang.errors import UninitializedVariableError
+
+
+@fixture
+def context():
+    return Context(create_autospec(apply_stencil, spec_set=True))
+
+
+def rows(entries):
+    return [(entry.name, entry.count, entry.seconds) for entry in entries]
+
+
+class TestStatementLines(object):
+    def test_lines(self):
+        assert statement_lines('''STO 0 1
+
+SMX 1 1 2
+  3 4 PR 0
+PR
+0''') == [1, 3, 4, 5]
+
+    def test_empty(self):
+        assert statement_lines('') == []
+
+
+def at_line(bytecode, line):
+    bytecode.line = line
+    return bytecode
+
+
+class TestProfile(object):
+    def test_record(self):
+        profile = Profile()
+        profile.record(at_line(Sto(0, 1), 1), 1.0)
+        profile.record(at_line(Pr(0), 1), 2.0)
+        pr = at_line(Pr(0), 2)
+        profile.record(pr, 4.0)
+        profile.record(pr, 8.0)
+        assert rows(profile.opcode_entries()) == [
+            ('PR', 3, 14.0),
+            ('STO', 1, 1.0),
+        ]
+        assert rows(profile.line_entries()) == [
+            ('2', 2, 12.0),
+            ('1', 2, 3.0),
+        ]
+
+    def test_format(self):
+        profile = Profile()
+        profile.record(at_line(Sto(0, 1), 1), 0.5)
+        assert profile.format() == '''\
+opcode          count        seconds
+STO                 1       0.500000
+
+line            count        seconds
+1                   1       0.500000
+'''
+
+
+class TestEvalProfiled(object):
+    def test_loop(self, context):
+        context.profile = Profile()
+        with patch('stencil_lang.interpreter.evaluator.time') as mock_time:
+            mock_time.time.side_effect = [float(i) for i in xrange(14)]
+            eval_profiled([
+                at_line(Sto(0, 0), 1),
+                at_line(Add(0, 1), 2),
+                at_line(Bne(0, 3, -1), 3),
+            ], context)
+        assert context.registers[0] == 3
+        assert sorted(rows(context.profile.opcode_entries())) == [
+            ('ADD', 3, 3.0),
+            ('BNE', 3, 3.0),
+            ('STO', 1, 1.0),
+        ]
+        assert sorted(rows(context.profile.line_entries())) == [
+            ('1', 1, 1.0),
+            ('2', 3, 3.0),
+            ('3', 3, 3.0),
+        ]
+
+    def test_error(self, context):
+        context.profile = Profile()
+        with raises(UninitializedVariableError):
+            eval_profiled([at_line(Sto(0, 0), 1), at_line(Pr(1), 2)],
+                          context)
+        # Bytecodes which ran before the error are still recorded.
+        assert [entry.name for entry in
+                context.profile.opcode_entries()] == ['STO']
+
+    def test_not_profiled(self, context):
+        # Only eval_profiled records, even if the context has a profile.
+        context.profile = Profile()
+        with patch('stencil_lang.interpreter.evaluator.time') as mock_time:
+            eval_([Sto(0, 0)], context)
+        assert not mock_time.time.called
@@ -0,0 +1,101 @@
+from pytest import fixture
+
+from stencil_lang.interpreter.stencil import apply_stencil
+from stencil_lang.interpreter.bytecodes import *  # NOQA
+from stencil_lang.interpreter.peephole import PdeLoop
+from stencil_lang.interpreter.verifier import UncheckedPde
+from stencil_lang.interpreter.evaluator import eval_
+from stencil_lang.interpreter.stats import Stats
+from stencil_lang.structures import Context, Matrix
+
+from tests.helpers import fixture_path
+
+
+@fixture
+def stats():
+    return Stats()
+
+
+@fixture
+def context(stats):
+    context = Context(apply_stencil)
+    context.stats = stats
+    return context
+
+
+STENCIL = [0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0]
+
+
+class TestStats(object):
+    def test_phases(self, stats):
+        stats.add_phase('lex', 1.0)
+        stats.add_phase('parse', 2.0)
+        stats.add_phase('lex', 0.5)
+        assert stats.phase_seconds('lex') == 1.5
+        assert stats.phase_seconds('parse') == 2.0
+        assert stats.phase_seconds('eval') == 0.0
+
+    def test_cells_per_second(self, stats):
+        assert stats.cells_per_second() == 0.0
+        stats.record_pde(100, 2.0)
+        stats.record_pde(50, 1.0)
+        assert stats.cells_per_second() == 50.0
+
+    def test_peak_matrix_bytes(self, stats):
+        stats.record_matrices({0: Matrix(1, 2, [1.0, 2.0])}, 3)
+        stats.record_matrices({}, 0)
+        assert stats.peak_matrix_bytes == 40
+
+    def test_format(self, stats):
+        stats.add_phase('lex', 0.25)
+        stats.record_io(0.5)
+        stats.record_read(10)
+        stats.record_pde(9, 0.5)
+        stats.record_matrices({0: Matrix(1, 1, [1.0])}, 0)
+        assert stats.format() == '''\
+lex_seconds=0.250000
+io_seconds=0.500000
+pde_seconds=0.500000
+cells_updated=9
+cells_per_second=18
+matrix_bytes_read=10
+peak_matrix_bytes=8
+'''
+
+
+class TestRecording(object):
+    def test_pde(self, context, stats):
+        eval_([
+            Cmx(0, 3, 3),
+            Smx(0, STENCIL),
+            Cmx(1, 2, 2),
+            Smx(1, [1.0, 2.0, 3.0, 4.0]),
+            Pde(0, 1),
+            UncheckedPde(0, 1),
+            Sto(0, 0),
+            PdeLoop(0, 1, 0, 1, 2),
+        ], context)
+        assert stats.cells_updated == 16
+        assert stats.peak_matrix_bytes == (9 + 4 + 4) * 8
+
+    def test_smxf(self, context, stats, capsys):
+        filename = fixture_path('stencil/ints')
+        eval_([
+            Cmx(0, 3, 3),
+            Smxf(0, filename),
+            Pmx(0),
+        ], context)
+        with open(filename) as matrix_file:
+            assert stats.bytes_read == len(matrix_file.read())
+        assert stats.io_seconds > 0.0
+        assert stats.peak_matrix_bytes == 9 * 8
+
+    def test_smxf_cached(self, context, stats):
+        filename = fixture_path('stencil/ints')
+        eval_([
+            Cmx(0, 3, 3),
+            Smxf(0, filename),
+            Smxf(0, filename),
+        ], context)
+        with open(filename) as matrix_file:
+            assert stats.bytes_read == len(matrix_file.read())
@@ -0,0 +1,146 @@
+from pytest import fixture, raises
+import pytest
+from mock import create_autospec
+from rply.errors import LexingError
+
+from stencil_lang.interpreter.stencil import apply_stencil
+from stencil_lang.interpreter.scanner import scan
+from stencil_lang.interpreter.parser import parse
+from stencil_lang.interpreter.streaming import (
+    TokenReader,
+    StatementReader,
+    run_stream,
+)
+from stencil_lang.structures import Context
+from stencil_lang.errors import ParseError, InvalidBranchOffsetError
+
+parametrize = pytest.mark.parametrize
+
+
+class FakeStream(object):
+    """Stream which returns at most `chunk_size` bytes per read, like a
+    pipe.
+    """
+    def __init__(self, text, chunk_size):
+        self._text = text
+        self._chunk_size = chunk_size
+
+    def read(self, n):
+        n = min(n, self._chunk_size)
+        data = self._text[:n]
+        self._text = self._text[n:]
+        return data
+
+
+class FailingStream(object):
+    """Stream which fails when read past its text."""
+    def __init__(self, text):
+        self._text = text
+
+    def read(self, n):
+        if not self._text:
+            raise IOError('read past end')
+        data = self._text
+        self._text = ''
+        return data
+
+
+@fixture
+def context():
+    return Context(create_autospec(apply_stencil, spec_set=True))
+
+
+@fixture(params=[1, 2, 3, 7, 1000])
+def chunk_size(request):
+    return request.param
+
+
+def read_tokens(code, chunk_size):
+    reader = TokenReader(FakeStream(code, chunk_size))
+    tokens = []
+    while True:
+        token = reader.next()
+        if token is None:
+            return tokens
+        tokens.append((token.name, token.value))
+
+
+def read_statements(code, chunk_size):
+    reader = StatementReader(TokenReader(FakeStream(code, chunk_size)))
+    bytecodes = []
+    while True:
+        bytecode = reader.next_statement()
+        if bytecode is None:
+            return bytecodes
+        bytecodes.append(bytecode)
+
+
+PROGRAM = '''CMX 0 2 2
+SMX 0 1 -2. 3.5e2 -4e-1 SMXF 0 "file name with spaces"
+STO 10 -5 ADD 10 1
+PR 10 PMX 0 PDE 0 1 WMXF 0 "out file" SNAP 0 "frame"
+BNE 10 0 -2
+'''
+
+
+class TestTokenReader(object):
+    def test_same_as_scan(self, chunk_size):
+        assert read_tokens(PROGRAM, chunk_size) == [
+            (token.name, token.value) for token in scan(PROGRAM)]
+
+    def test_empty(self):
+        assert read_tokens('', 1) == []
+
+    def test_lexing_error(self, chunk_size):
+        with raises(LexingError):
+            read_tokens('STO 1 hello', chunk_size)
+
+    def test_unclosed_file_name(self, chunk_size):
+        with raises(LexingError):
+            read_tokens('SMXF 1 "abc def', chunk_size)
+
+
+class TestStatementReader(object):
+    def test_same_as_parse(self, chunk_size):
+        assert read_statements(PROGRAM, chunk_size) == parse(scan(PROGRAM))
+
+    @parametrize('code', [
+        'PR', 'PR 1 2', '1 PR 1', 'SMX 1', 'SMX 1 PR 2', 'STO 1 2.5',
+        'BNE 0 1', 'CMX 1 -1 2', 'SMXF 1 2', 'PR -1', 'SMX 1 2 "f"',
+        'WMXF 1', 'WMXF "f"', 'SNAP 1', 'SNAP "f"',
+    ])
+    def test_same_errors_as_parse(self, code):
+        with raises(ParseError) as expected:
+            parse(scan(code))
+        with raises(ParseError) as actual:
+            read_statements(code, 3)
+        assert str(actual.value) == str(expected.value)
+
+
+class TestRunStream(object):
+    def test_backward_branch(self, context, capsys):
+        run_stream(FakeStream('STO 0 0\nADD 0 1\nPR 0\nBNE 0 3 -2\n', 4),
+                   context)
+        out, err = capsys.readouterr()
+        assert out == '1\n2\n3\n'
+
+    def test_forward_branch(self, context, capsys):
+        run_stream(FakeStream('STO 0 0\nBNE 0 1 3\nPR 0\nPR 0\nSTO 0 5\n'
+                              'PR 0\n', 4), context)
+        out, err = capsys.readouterr()
+        assert out == '5\n'
+
+    def test_runs_before_input_ends(self, context, capsys):
+        with raises(IOError):
+            run_stream(FailingStream('STO 0 1\nPR 0\n'), context)
+        out, err = capsys.readouterr()
+        assert out == '1\n'
+
+    def test_empty(self, context):
+        with raises(ParseError) as exc_info:
+            run_stream(FakeStream('', 1), context)
+        assert str(exc_info.value) == "Unexpected `$end'"
+
+    def test_branch_past_end(self, context):
+        with raises(InvalidBranchOffsetError):
+            run_stream(FakeStream('STO 0 0\nBNE 0 1 5\nPR 0\n', 1), context)
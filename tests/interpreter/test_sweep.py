@@ -0,0 +1,120 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from stencil_lang.interpreter.stencil import apply_stencil
+from stencil_lang.interpreter.sweep import Parameters, sweep_values, sweep
+from stencil_lang.structures import Context, Matrix
+
+parametrize = pytest.mark.parametrize
+
+
+class WritingRunner(object):
+    """Runner which writes straight to the file descriptor, which is the
+    pipe in the forked process, instead of printing to the captured
+    stdout."""
+    def run(self, value):
+        os.write(1, 'run %d\n' % value)
+
+
+class FailingRunner(object):
+    def run(self, value):
+        if value == 1:
+            raise Exception('failed')
+        os.write(1, 'run %d\n' % value)
+
+
+class TestParameters(object):
+    def test_seed(self):
+        matrix = Matrix(1, 2, [1.0, 2.0])
+        parameters = Parameters()
+        parameters.registers = {0: 3, 2: -1}
+        parameters.matrices = {1: matrix}
+        context = Context(apply_stencil)
+        context.registers[2] = 5
+        parameters.seed(context)
+        assert context.registers == {0: 3, 2: -1}
+        assert context.matrices == {1: matrix}
+
+    def test_seed_copies_matrices(self):
+        matrix = Matrix(1, 2, [1.0, 2.0])
+        parameters = Parameters()
+        parameters.matrices = {1: matrix}
+        context = Context(apply_stencil)
+        parameters.seed(context)
+        context.matrices[1].contents[0] = 9.0
+        assert context.matrices[1] is not matrix
+        assert matrix.contents == [1.0, 2.0]
+
+    def test_empty(self):
+        context = Context(apply_stencil)
+        Parameters().seed(context)
+        assert context.registers == {}
+        assert context.matrices == {}
+
+
+class TestSweepValues(object):
+    @parametrize(('start', 'stop', 'step'), [
+        (0, 10, 1),
+        (0, 10, 3),
+        (-5, 5, 2),
+        (10, 0, -3),
+        (0, 0, 1),
+        (5, 0, 1),
+        (0, 5, -1),
+    ])
+    def test_like_range(self, start, stop, step):
+        assert sweep_values(start, stop, step) == range(start, stop, step)
+
+
+class TestSweep(object):
+    @parametrize('jobs', [1, 2, 8])
+    def test_in_order(self, jobs, capfd):
+        sweep(WritingRunner(), 3, [5, 1, 4], jobs)
+        out, err = capfd.readouterr()
+        assert out == ('==> 3=5 <==\nrun 5\n'
+                       '==> 3=1 <==\nrun 1\n'
+                       '==> 3=4 <==\nrun 4\n')
+
+    def test_no_values(self, capfd):
+        sweep(WritingRunner(), 0, [], 2)
+        out, err = capfd.readouterr()
+        assert out == ''
+
+    def test_failed_run(self, capfd):
+        sweep(FailingRunner(), 0, [0, 1, 2], 2)
+        out, err = capfd.readouterr()
+        assert out == ('==> 0=0 <==\nrun 0\n'
+                       '==> 0=1 <==\nthe program stopped unexpectedly\n'
+                       '==> 0=2 <==\nrun 2\n')
+
+
+class TestRunSweep(object):
+    def run_main(self, *args):
+        # Run in a new process, because the programs print to sys.stdout,
+        # which is captured in this one.
+        return subprocess.check_output(
+            [sys.executable, '-m', 'stencil_lang.main'] + list(args),
+            stderr=open(os.devnull, 'w'))
+
+    def test_sweep(self, tmpdir):
+        source = tmpdir.join('program.sl')
+        source.write('ADD 0 1\nPR 0\nPR 1\nPMX 2\n')
+        matrix = tmpdir.join('matrix')
+        matrix.write('1 2\n')
+        out = self.run_main('--sweep=0=0:6:2', '--jobs=2', '--register=1=7',
+                            '--matrix=2=%s' % matrix, str(source))
+        assert out == ('==> 0=0 <==\n1\n7\n[[ 1 2 ]]\n'
+                       '==> 0=2 <==\n3\n7\n[[ 1 2 ]]\n'
+                       '==> 0=4 <==\n5\n7\n[[ 1 2 ]]\n')
+
+    def test_errors(self, tmpdir):
+        source = tmpdir.join('program.sl')
+        source.write('PR 0\nPR 1\n')
+        out = self.run_main('--sweep=0=2:0:-1', str(source))
+        assert out == ('==> 0=2 <==\n2\nUninitializedVariableError: '
+                       'Register 1 is not initialized. Please STO first.\n'
+                       '==> 0=1 <==\n1\nUninitializedVariableError: '
+                       'Register 1 is not initialized. Please STO first.\n')
@@ -0,0 +1,213 @@
+from pytest import fixture, raises
+from mock import create_autospec, sentinel
+
+from stencil_lang.interpreter.stencil import apply_stencil
+from stencil_lang.interpreter.bytecodes import *  # NOQA
+from stencil_lang.interpreter.peephole import AddBne, PdeLoop
+from stencil_lang.interpreter.verifier import (
+    verify,
+    check_branches,
+    initialized_variables,
+    UncheckedAdd,
+    UncheckedPr,
+    UncheckedPde,
+    UncheckedBne,
+    UncheckedAddBne,
+)
+from stencil_lang.interpreter.evaluator import eval_
+from stencil_lang.structures import Context
+from stencil_lang.errors import InvalidBranchOffsetError
+
+from tests.helpers import assert_exc_info_msg
+
+
+@fixture
+def mock_apply_stencil():
+    return create_autospec(apply_stencil, spec_set=True)
+
+
+@fixture
+def context(mock_apply_stencil):
+    return Context(mock_apply_stencil)
+
+
+def registers_at(bytecodes, pc):
+    return sorted(initialized_variables(bytecodes)[pc].registers)
+
+
+class TestCheckBranches(object):
+    def test_valid(self):
+        check_branches([
+            Sto(0, 0),
+            Add(0, 1),
+            Bne(0, 10, -1),
+        ])
+
+    def test_offset_zero(self):
+        with raises(InvalidBranchOffsetError) as exc_info:
+            check_branches([
+                Sto(0, 10),
+                Bne(0, 20, 0),
+            ])
+        assert_exc_info_msg(
+            exc_info,
+            'Cannot branch to current location. Invalid branch offset: 0')
+
+    def test_offset_too_small(self):
+        with raises(InvalidBranchOffsetError) as exc_info:
+            check_branches([
+                Sto(0, 10),
+                Bne(0, 20, -100),
+            ])
+        assert_exc_info_msg(
+            exc_info,
+            'Cannot branch before beginning of program. '
+            'Invalid branch offset: -100 with destination: -99')
+
+    def test_offset_too_large(self):
+        with raises(InvalidBranchOffsetError) as exc_info:
+            check_branches([
+                Sto(0, 10),
+                Bne(0, 20, 100),
+            ])
+        assert_exc_info_msg(
+            exc_info,
+            'Cannot branch past end of program. '
+            'Invalid branch offset: 100 with destination: 101')
+
+    def test_unreachable_branch(self):
+        # Branches are rejected even if they would never run.
+        with raises(InvalidBranchOffsetError):
+            check_branches([
+                Sto(0, 0),
+                Bne(0, 1, 2),
+                Bne(0, 1, 5),
+                Pr(0),
+            ])
+
+
+class TestInitializedVariables(object):
+    def test_empty(self):
+        assert initialized_variables([]) == []
+
+    def test_straight_line(self):
+        bytecodes = [
+            Sto(0, 1),
+            Cmx(1, 3, 3),
+            Pr(0),
+        ]
+        facts = initialized_variables(bytecodes)
+        assert facts[0].registers == {}
+        assert sorted(facts[2].registers) == [0]
+        assert sorted(facts[2].matrices) == [1]
+
+    def test_skipped_by_forward_branch(self):
+        bytecodes = [
+            Sto(0, 1),
+            Bne(0, 1, 2),
+            Sto(1, 2),
+            Pr(1),
+        ]
+        # Register 1 is not stored on the path which takes the branch.
+        assert registers_at(bytecodes, 3) == [0]
+
+    def test_loop(self):
+        bytecodes = [
+            Sto(0, 0),
+            Add(0, 1),
+            Sto(1, 0),
+            Bne(0, 10, -2),
+        ]
+        assert registers_at(bytecodes, 1) == [0]
+        assert registers_at(bytecodes, 3) == [0, 1]
+
+
+class TestVerify(object):
+    def test_specializes_initialized(self):
+        assert verify([
+            Sto(0, 0),
+            Cmx(1, 3, 3),
+            Cmx(2, 3, 3),
+            Add(0, 1),
+            Pde(1, 2),
+            Pr(0),
+            Bne(0, 10, -3),
+        ]) == [
+            Sto(0, 0),
+            Cmx(1, 3, 3),
+            Cmx(2, 3, 3),
+            UncheckedAdd(0, 1),
+            UncheckedPde(1, 2),
+            UncheckedPr(0),
+            UncheckedBne(0, 10, 3),
+        ]
+
+    def test_keeps_checks_when_unproven(self):
+        bytecodes = [
+            Sto(0, 1),
+            Bne(0, 1, 2),
+            Sto(1, 2),
+            Add(1, 1),
+            Pde(1, 2),
+            Bne(1, 3, -3),
+        ]
+        assert verify(bytecodes) == [
+            Sto(0, 1),
+            UncheckedBne(0, 1, 3),
+            Sto(1, 2),
+            Add(1, 1),
+            Pde(1, 2),
+            UncheckedBne(1, 3, 2),
+        ]
+
+    def test_superinstructions(self):
+        assert verify([
+            Sto(0, 0),
+            AddBne(0, 1, 10, 1),
+            PdeLoop(0, 1, 1, 2, 3),
+        ]) == [
+            Sto(0, 0),
+            UncheckedAddBne(0, 1, 10, 1),
+            PdeLoop(0, 1, 1, 2, 3),
+        ]
+
+    def test_rejects_invalid_branch(self):
+        with raises(InvalidBranchOffsetError):
+            verify([
+                Sto(0, 10),
+                Bne(0, 20, 100),
+            ])
+
+    def test_does_not_modify_input(self):
+        bytecodes = [Sto(0, 0), Add(0, 1)]
+        verify(bytecodes)
+        assert bytecodes == [Sto(0, 0), Add(0, 1)]
+
+
+class TestUnchecked(object):
+    def test_loop(self, context, capsys):
+        eval_(verify([
+            Sto(0, 0),
+            Add(0, 1),
+            Pr(0),
+            Bne(0, 3, -2),
+        ]), context)
+        assert context.registers[0] == 3
+        out, err = capsys.readouterr()
+        assert '1\n2\n3\n' == out
+
+    def test_pde(self, context, mock_apply_stencil):
+        mock_apply_stencil.return_value = sentinel.transformed_matrix
+        eval_(verify([
+            Cmx(1, 1, 1),
+            Cmx(2, 1, 1),
+            Pde(1, 2),
+        ]), context)
+        assert context.matrices[2] == sentinel.transformed_matrix
+
+    def test_add_bne(self, context):
+        eval_([
+            Sto(0, 0),
+            UncheckedAddBne(0, 2, 10, 1),
+        ], context)
+        assert context.registers[0] == 10
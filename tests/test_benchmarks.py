@@ -0,0 +1,158 @@
+import os
+
+from pytest import fixture, mark
+from mock import patch
+
+from benchmarks import suite
+
+parametrize = mark.parametrize
+
+
+@fixture
+def generated(tmpdir):
+    directory = tmpdir.join('generated')
+    with patch.object(suite, 'GENERATED_DIRECTORY', str(directory)):
+        yield directory
+
+
+class TestCompare(object):
+    baseline = {
+        'stencil': {'pde-64-r1': 1.0, 'register-loop': 2.0},
+    }
+
+    @parametrize(('seconds', 'regressed'), [
+        (0.5, False),
+        (1.0, False),
+        # Within the tolerance.
+        (1.1, False),
+        (1.11, True),
+        (3.0, True),
+    ])
+    def test_threshold(self, seconds, regressed):
+        results = {'stencil': {'pde-64-r1': seconds}}
+        regressions = suite.compare(results, self.baseline, 0.1)
+        if regressed:
+            assert regressions == [('stencil', 'pde-64-r1', seconds, 1.0)]
+        else:
+            assert regressions == []
+
+    def test_zero_tolerance(self):
+        results = {'stencil': {'pde-64-r1': 1.0, 'register-loop': 2.01}}
+        assert suite.compare(results, self.baseline, 0.0) == [
+            ('stencil', 'register-loop', 2.01, 2.0)]
+
+    def test_missing_from_baseline(self):
+        # New builds and benchmarks have nothing to regress from.
+        results = {
+            'stencil': {'parse-literal': 100.0},
+            'stencil-jit': {'pde-64-r1': 100.0},
+        }
+        assert suite.compare(results, self.baseline, 0.1) == []
+
+    def test_sorted(self):
+        results = {
+            'stencil-jit': {'pde-64-r1': 5.0},
+            'stencil': {'register-loop': 5.0, 'pde-64-r1': 5.0},
+        }
+        baseline = {
+            'stencil-jit': {'pde-64-r1': 1.0},
+            'stencil': {'register-loop': 1.0, 'pde-64-r1': 1.0},
+        }
+        assert [regression[:2] for regression in
+                suite.compare(results, baseline, 0.1)] == [
+            ('stencil', 'pde-64-r1'),
+            ('stencil', 'register-loop'),
+            ('stencil-jit', 'pde-64-r1'),
+        ]
+
+
+class TestGenerate(object):
+    def test_generate(self, generated):
+        benchmark = suite._stencil_benchmark(4, 1)
+        program_path = suite.generate(benchmark)
+        assert program_path == str(
+            generated.join('pde-4-r1', 'pde-4-r1.sl'))
+        lines = generated.join('pde-4-r1', 'pde-4-r1.matrix').readlines()
+        assert len(lines) == 4
+        assert all(len(line.split()) == 4 for line in lines)
+        program = generated.join('pde-4-r1', 'pde-4-r1.sl').read()
+        assert program.startswith('CMX 0 3 3\n')
+        assert program.endswith('BNE 0 %d -2\n' % suite.PDE_ITERATIONS)
+
+    def test_deterministic(self, generated):
+        benchmark = suite._stencil_benchmark(4, 2)
+        first = generated.join('pde-4-r2', 'pde-4-r2.matrix')
+        suite.generate(benchmark)
+        contents = first.read()
+        generated.remove()
+        suite.generate(benchmark)
+        assert first.read() == contents
+
+    def test_reused(self, generated):
+        calls = []
+
+        def generate(directory):
+            calls.append(directory)
+            return os.path.join(directory, 'program.sl')
+        benchmark = suite.Benchmark('fake', 0, generate)
+        first = suite.generate(benchmark)
+        assert suite.generate(benchmark) == first
+        assert calls == [str(generated.join('fake'))]
+
+    def test_interrupted(self, generated):
+        # Without the stamp, the files are generated again.
+        calls = []
+
+        def generate(directory):
+            calls.append(directory)
+            return os.path.join(directory, 'program.sl')
+        benchmark = suite.Benchmark('fake', 0, generate)
+        suite.generate(benchmark)
+        generated.join('fake', 'program').remove()
+        suite.generate(benchmark)
+        assert len(calls) == 2
+
+    def test_names_unique(self):
+        names = [benchmark.name for benchmark in suite.get_benchmarks()]
+        assert len(names) == len(set(names))
+
+
+class TestTimeRun(object):
+    @patch.object(suite.subprocess, 'check_call')
+    @patch.object(suite.time, 'time')
+    def test_fastest(self, mock_time, mock_check_call, tmpdir):
+        program = tmpdir.join('program.sl')
+        program.write('PR 0\n')
+        mock_time.side_effect = [0.0, 3.0, 10.0, 11.5, 20.0, 22.0]
+        seconds = suite.time_run(['interpreter'], str(program), 3)
+        assert seconds == 1.5
+        assert mock_check_call.call_count == 3
+        args, kwargs = mock_check_call.call_args
+        assert args == (['interpreter', str(program)],)
+
+    @patch.object(suite.subprocess, 'check_call')
+    def test_removes_cache(self, mock_check_call, tmpdir):
+        program = tmpdir.join('program.sl')
+        program.write('PR 0\n')
+        cache = tmpdir.join('program.slc')
+        exists = []
+
+        def check_call(command, stdout):
+            exists.append(cache.check())
+            cache.write('stale')
+        mock_check_call.side_effect = check_call
+        cache.write('stale')
+        suite.time_run(['interpreter'], str(program), 2)
+        # Every run parses the program.
+        assert exists == [False, False]
+
+
+class TestJson(object):
+    def test_round_trip(self, tmpdir):
+        path = str(tmpdir.join('results.json'))
+        results = {'stencil': {'pde-64-r1': 1.5}}
+        suite.save_json(path, results)
+        assert suite.load_json(path) == results
+
+    def test_missing(self, tmpdir):
+        assert suite.load_json(str(tmpdir.join('missing.json'))) is None
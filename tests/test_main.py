@@ -1,7 +1,10 @@
-from pytest import fixture
+from pytest import fixture, mark
+from mock import patch
 
 from stencil_lang import metadata
 from stencil_lang.main import _main
+from stencil_lang.interpreter.sweep import DEFAULT_JOBS
+from stencil_lang.server import DEFAULT_WORKERS
 
 
 @fixture(params=['-h', '--help'])
@@ -34,3 +37,494 @@ class TestMain(object):
         assert out == '{0} {1}\n'.format(metadata.project, metadata.version)
         # Should exit with zero return code.
         assert status_code == 0
+
+    def test_dump_optimized(self, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        source.write('''STO 0 1
+STO 0 2
+ADD 0 3
+PR 0
+CMX 1 1 1
+''')
+        status_code = _main(['progname', '--dump-optimized', str(source)])
+        out, err = capsys.readouterr()
+        assert out == 'STO 0 5\nPR 0\n'
+        assert status_code == 0
+
+    def test_cache(self, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        source.write('STO 0 1\nPR 0\n')
+        _main(['progname', str(source)])
+        assert tmpdir.join('program.slc').check()
+        with patch('stencil_lang.interpreter.parse') as mock_parse:
+            _main(['progname', str(source)])
+        assert not mock_parse.called
+        out, err = capsys.readouterr()
+        assert out == '1\n1\n'
+
+    def test_stale_cache(self, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        source.write('STO 0 1\nPR 0\n')
+        _main(['progname', str(source)])
+        source.write('STO 0 2\nPR 0\n')
+        _main(['progname', str(source)])
+        out, err = capsys.readouterr()
+        assert out == '1\n2\n'
+
+    def test_rply_lexer(self, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        source.write('STO 0 1\nPR 0\n')
+        with patch('stencil_lang.interpreter.scan') as mock_scan:
+            status_code = _main(['progname', '--rply-lexer', str(source)])
+        assert not mock_scan.called
+        out, err = capsys.readouterr()
+        assert out == '1\n'
+        assert status_code == 0
+
+    def test_stream(self, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        source.write('STO 0 0\nADD 0 1\nPR 0\nBNE 0 2 -2\n')
+        status_code = _main(['progname', '--stream', str(source)])
+        out, err = capsys.readouterr()
+        assert out == '1\n2\n'
+        assert status_code == 0
+        # The program is not cached, as it is never read as a whole.
+        assert not tmpdir.join('program.slc').check()
+
+    def test_stream_dump_optimized(self, capsys):
+        status_code = _main(['progname', '--stream', '--dump-optimized'])
+        out, err = capsys.readouterr()
+        assert 'usage' in out
+        assert status_code == 1
+
+    def test_profile(self, tmpdir, capfd):
+        source = tmpdir.join('program.sl')
+        source.write('STO 0 0\nADD 0 1\nBNE 0 2 -1\nPR 0\n')
+        status_code = _main(['progname', '--profile', str(source)])
+        out, err = capfd.readouterr()
+        assert out == '2\n'
+        assert err.startswith('opcode ')
+        # The loop is lowered, and runs as one bytecode on the BNE's line.
+        assert '\nLOOP                1 ' in err
+        assert '\n3                   1 ' in err
+        assert 'ADD ' not in err
+        assert status_code == 0
+
+    def test_profile_fused(self, tmpdir, capfd):
+        source = tmpdir.join('program.sl')
+        # The counter's start isn't known, so the loop can't be lowered.
+        source.write('ADD 0 1\nBNE 0 3 -1\nPR 0\n')
+        status_code = _main(['progname', '--profile', '--register=0=0',
+                             str(source)])
+        out, err = capfd.readouterr()
+        assert out == '3\n'
+        assert '\nADDBNE              3 ' in err
+        assert '\n1                   3 ' in err
+        assert '\n3                   1 ' in err
+        assert status_code == 0
+
+    def test_stats(self, tmpdir, capfd):
+        source = tmpdir.join('program.sl')
+        source.write('CMX 0 1 1\nSMX 0 1\nPDE 0 0\nPMX 0\n')
+        status_code = _main(['progname', '--stats', str(source)])
+        out, err = capfd.readouterr()
+        assert out == '[[ 2 ]]\n'
+        keys = [line.split('=')[0] for line in err.splitlines()]
+        assert keys == [
+            'read_seconds',
+            'cache_seconds',
+            'lex_seconds',
+            'parse_seconds',
+            'optimize_seconds',
+            'eval_seconds',
+            'io_seconds',
+            'pde_seconds',
+            'cells_updated',
+            'cells_per_second',
+            'matrix_bytes_read',
+            'peak_matrix_bytes',
+        ]
+        assert 'cells_updated=1\n' in err
+        assert status_code == 0
+
+    @patch('stencil_lang.main.file_cache')
+    def test_matrix_cache(self, mock_file_cache, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        source.write('STO 0 1\nPR 0\n')
+        status_code = _main(
+            ['progname', '--matrix-cache=1024', str(source)])
+        out, err = capsys.readouterr()
+        assert out == '1\n'
+        mock_file_cache.set_budget.assert_called_once_with(1024)
+        assert status_code == 0
+
+    @mark.parametrize('arg', ['--matrix-cache=', '--matrix-cache=big',
+                              '--matrix-cache=-1'])
+    def test_matrix_cache_invalid(self, arg, capsys):
+        status_code = _main(['progname', arg])
+        out, err = capsys.readouterr()
+        assert 'usage' in out
+        assert status_code == 1
+
+    def test_checkpoint(self, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        source.write('STO 0 0\nADD 0 1\nBNE 0 5 -1\nPR 0\n')
+        checkpoint = tmpdir.join('checkpoint')
+        status_code = _main(
+            ['progname', '--checkpoint-every=5',
+             '--checkpoint-file=' + str(checkpoint), str(source)])
+        out, err = capsys.readouterr()
+        assert out == '5\n'
+        assert checkpoint.check()
+        assert status_code == 0
+        status_code = _main(
+            ['progname', '--restart-from=' + str(checkpoint), str(source)])
+        out, err = capsys.readouterr()
+        assert out == '5\n'
+        assert status_code == 0
+
+    def test_restart_different_program(self, tmpdir, capsys):
+        checkpoint = tmpdir.join('checkpoint')
+        checkpoint.write('garbage')
+        source = tmpdir.join('program.sl')
+        source.write('PR 0\n')
+        status_code = _main(
+            ['progname', '--restart-from=' + str(checkpoint), str(source)])
+        out, err = capsys.readouterr()
+        assert out == ('CheckpointError: Cannot restart from checkpoint: '
+                       'not a checkpoint file\n')
+        assert status_code == 0
+
+    @mark.parametrize('args', [
+        ['--checkpoint-every=5'],
+        ['--checkpoint-file=checkpoint'],
+        ['--checkpoint-every=', '--checkpoint-file=checkpoint'],
+        ['--checkpoint-every=often', '--checkpoint-file=checkpoint'],
+        ['--checkpoint-every=0', '--checkpoint-file=checkpoint'],
+        ['--checkpoint-every=5', '--checkpoint-file='],
+        ['--restart-from='],
+        ['--restart-from=checkpoint', '--stream'],
+        ['--restart-from=checkpoint', '--profile'],
+        ['--restart-from=checkpoint', '--stats'],
+        ['--restart-from=checkpoint', '--dump-optimized'],
+    ])
+    def test_checkpoint_invalid(self, args, capsys):
+        status_code = _main(['progname'] + args)
+        out, err = capsys.readouterr()
+        assert 'usage' in out
+        assert status_code == 1
+
+    def test_snapshots_written_before_exit(self, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        frame = tmpdir.join('frame')
+        source.write('CMX 0 1 1\nSTO 0 0\nSMX 0 1\nSNAP 0 "%s"\n'
+                     'ADD 0 1\nBNE 0 10 -2\n' % frame)
+        status_code = _main(['progname', str(source)])
+        assert status_code == 0
+        for i in xrange(10):
+            assert tmpdir.join('frame.%06d' % i).read() == '1\n'
+
+    @patch('stencil_lang.main.parallel_reader')
+    def test_parse_workers(self, mock_parallel_reader, tmpdir, capsys):
+        mock_parallel_reader.threshold = 1024
+        source = tmpdir.join('program.sl')
+        source.write('STO 0 1\nPR 0\n')
+        status_code = _main(
+            ['progname', '--parse-workers=4', str(source)])
+        out, err = capsys.readouterr()
+        assert out == '1\n'
+        assert mock_parallel_reader.workers == 4
+        assert status_code == 0
+
+    @patch('stencil_lang.main.prefetcher')
+    def test_prefetch_threads(self, mock_prefetcher, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        source.write('STO 0 1\nPR 0\n')
+        status_code = _main(
+            ['progname', '--prefetch-threads=0', str(source)])
+        out, err = capsys.readouterr()
+        assert out == '1\n'
+        assert mock_prefetcher.threads == 0
+        assert status_code == 0
+
+    @mark.parametrize('arg', ['--prefetch-threads=',
+                              '--prefetch-threads=many',
+                              '--prefetch-threads=-1'])
+    def test_prefetch_threads_invalid(self, arg, capsys):
+        status_code = _main(['progname', arg])
+        out, err = capsys.readouterr()
+        assert 'usage' in out
+        assert status_code == 1
+
+    def test_prefetched_files_read(self, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        matrix = tmpdir.join('matrix')
+        matrix.write('1 2\n')
+        copy = tmpdir.join('copy')
+        copy.write('0 0\n')
+        source.write('CMX 0 1 2\nSMXF 0 "%s"\nWMXF 0 "%s"\n'
+                     'CMX 1 1 2\nSMXF 1 "%s"\nPMX 1\n' %
+                     (matrix, copy, copy))
+        status_code = _main(['progname', str(source)])
+        out, err = capsys.readouterr()
+        assert out == '[[ 1 2 ]]\n'
+        assert status_code == 0
+
+    @patch('stencil_lang.interpreter.prefetcher')
+    def test_written_files_not_prefetched(self, mock_prefetcher, tmpdir,
+                                          capsys):
+        source = tmpdir.join('program.sl')
+        matrix = tmpdir.join('matrix')
+        matrix.write('1 2\n')
+        copy = tmpdir.join('copy')
+        # Read before it is written, so that the snapshot isn't being written
+        # while it is read.
+        snapshot = tmpdir.join('frame.000000')
+        snapshot.write('1 2\n')
+        source.write('CMX 0 1 2\nSMXF 0 "%s"\nWMXF 0 "%s"\nSMXF 0 "%s"\n'
+                     'SMXF 0 "%s"\nSNAP 0 "%s"\nPMX 0\n' %
+                     (matrix, copy, copy, snapshot, tmpdir.join('frame')))
+        status_code = _main(['progname', str(source)])
+        out, err = capsys.readouterr()
+        assert out == '[[ 1 2 ]]\n'
+        assert status_code == 0
+        mock_prefetcher.start.assert_called_once_with([str(matrix)])
+
+    def test_batch(self, tmpdir, capsys):
+        first = tmpdir.join('first.sl')
+        first.write('STO 0 1\nPR 0\n')
+        second = tmpdir.join('second.sl')
+        second.write('PR 0\n')
+        third = tmpdir.join('third.sl')
+        third.write('STO 0 3\nPR 0\n')
+        status_code = _main(
+            ['progname', str(first), str(second), str(third)])
+        out, err = capsys.readouterr()
+        # Registers don't carry over, and an error doesn't stop the batch.
+        assert out == (
+            '==> %s <==\n1\n'
+            '==> %s <==\n'
+            'UninitializedVariableError: '
+            'Register 0 is not initialized. Please STO first.\n'
+            '==> %s <==\n3\n' % (first, second, third))
+        assert status_code == 0
+
+    def test_batch_missing_file(self, tmpdir, capsys):
+        missing = tmpdir.join('missing.sl')
+        program = tmpdir.join('program.sl')
+        program.write('STO 0 1\nPR 0\n')
+        status_code = _main(['progname', str(missing), str(program)])
+        out, err = capsys.readouterr()
+        assert out == ('==> %s <==\nOSError: No such file or directory\n'
+                       '==> %s <==\n1\n' % (missing, program))
+        assert status_code == 0
+
+    def test_manifest(self, tmpdir, capsys):
+        first = tmpdir.join('first.sl')
+        first.write('STO 0 1\nPR 0\n')
+        second = tmpdir.join('second.sl')
+        second.write('STO 0 2\nPR 0\n')
+        manifest = tmpdir.join('manifest')
+        manifest.write('# parameter study\n%s\n\n  %s  \n' % (first, second))
+        status_code = _main(['progname', '--manifest=%s' % manifest])
+        out, err = capsys.readouterr()
+        assert out == '==> %s <==\n1\n==> %s <==\n2\n' % (first, second)
+        assert status_code == 0
+
+    def test_manifest_empty(self, tmpdir, capsys):
+        manifest = tmpdir.join('manifest')
+        manifest.write('')
+        status_code = _main(['progname', '--manifest=%s' % manifest])
+        out, err = capsys.readouterr()
+        assert out == ''
+        assert status_code == 0
+
+    def test_batch_dump_optimized(self, tmpdir, capsys):
+        program = tmpdir.join('program.sl')
+        program.write('STO 0 1\nPR 0\n')
+        status_code = _main(['progname', '--dump-optimized', str(program),
+                             str(program)])
+        out, err = capsys.readouterr()
+        assert out == '==> %s <==\nSTO 0 1\nPR 0\n' % program * 2
+        assert status_code == 0
+
+    @mark.parametrize('args', [
+        ['--stream', 'a.sl', 'b.sl'],
+        ['--checkpoint-every=1', '--checkpoint-file=c', 'a.sl', 'b.sl'],
+        ['--restart-from=c', '--manifest=m'],
+    ])
+    def test_batch_invalid(self, args, capsys):
+        status_code = _main(['progname'] + args)
+        out, err = capsys.readouterr()
+        assert 'usage' in out
+        assert status_code == 1
+
+    def test_register(self, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        source.write('ADD 0 1\nPR 0\nPR 1\n')
+        status_code = _main(['progname', '--register=0=4',
+                             '--register=1=-2', '--register=0=9',
+                             str(source)])
+        out, err = capsys.readouterr()
+        assert out == '10\n-2\n'
+        assert status_code == 0
+
+    def test_branch_to_unused_matrix(self, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        source.write('CMX 1 1 1\nSMX 1 5\nBNE 0 1 -1\nPR 0\n')
+        status_code = _main(['progname', '--register=0=1', str(source)])
+        out, err = capsys.readouterr()
+        assert out == '1\n'
+        assert status_code == 0
+
+    def test_matrix(self, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        source.write('PMX 3\n')
+        matrix = tmpdir.join('matrix')
+        matrix.write('1 2\n3 4\n')
+        status_code = _main(['progname', '--matrix=3=%s' % matrix,
+                             str(source)])
+        out, err = capsys.readouterr()
+        assert out == '[[ 1 2 ]\n [ 3 4 ]]\n'
+        assert status_code == 0
+
+    def test_parameters_batch(self, tmpdir, capsys):
+        first = tmpdir.join('first.sl')
+        first.write('PR 0\nSTO 0 5\n')
+        second = tmpdir.join('second.sl')
+        second.write('PR 0\n')
+        status_code = _main(['progname', '--register=0=1', str(first),
+                             str(second)])
+        out, err = capsys.readouterr()
+        # Every program starts with the same registers.
+        assert out == '==> %s <==\n1\n==> %s <==\n1\n' % (first, second)
+        assert status_code == 0
+
+    def test_matrix_batch(self, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        source.write('PMX 0\nSMX 0 9 9\nPMX 0\n')
+        matrix = tmpdir.join('matrix')
+        matrix.write('1 2\n')
+        status_code = _main(['progname', '--matrix=0=%s' % matrix,
+                             str(source), str(source)])
+        out, err = capsys.readouterr()
+        # The SMX of one program doesn't change the matrix the next starts
+        # with.
+        run = '[[ 1 2 ]]\n[[ 9 9 ]]\n'
+        assert out == '==> %s <==\n%s==> %s <==\n%s' % (source, run,
+                                                        source, run)
+        assert status_code == 0
+
+    def test_matrix_invalid_file(self, tmpdir, capsys):
+        matrix = tmpdir.join('matrix')
+        matrix.write('1 2\n3\n')
+        status_code = _main(['progname', '--matrix=0=%s' % matrix])
+        out, err = capsys.readouterr()
+        assert out.startswith('InconsistentMatrixDimensions: ')
+        assert status_code == 1
+
+    def test_matrix_missing_file(self, tmpdir, capsys):
+        matrix = tmpdir.join('missing')
+        status_code = _main(['progname', '--matrix=0=%s' % matrix])
+        out, err = capsys.readouterr()
+        assert out == 'Cannot read %s: No such file or directory\n' % matrix
+        assert status_code == 1
+
+    @mark.parametrize('arg', ['--register=', '--register=0',
+                              '--register=a=1', '--register=0=a',
+                              '--register=0=1.5', '--matrix=0',
+                              '--matrix=0=', '--matrix=a=matrix'])
+    def test_parameters_invalid(self, arg, capsys):
+        status_code = _main(['progname', arg])
+        out, err = capsys.readouterr()
+        assert 'usage' in out
+        assert status_code == 1
+
+    @patch('stencil_lang.main.run_sweep')
+    def test_sweep(self, mock_run_sweep, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        source.write('PR 0\n')
+        status_code = _main(['progname', '--sweep=2=1:8:3', '--jobs=3',
+                             str(source)])
+        assert mock_run_sweep.call_count == 1
+        args = mock_run_sweep.call_args[0]
+        assert args[:5] == ('PR 0\n', 2, [1, 4, 7], 3,
+                            str(source) + 'c')
+        assert status_code == 0
+
+    @patch('stencil_lang.main.run_sweep')
+    def test_sweep_default_step(self, mock_run_sweep, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        source.write('PR 0\n')
+        _main(['progname', '--sweep=0=-1:2', str(source)])
+        args = mock_run_sweep.call_args[0]
+        assert args[1:4] == (0, [-1, 0, 1], DEFAULT_JOBS)
+
+    @mark.parametrize('args', [
+        ['--sweep='],
+        ['--sweep=0'],
+        ['--sweep=0=1'],
+        ['--sweep=0=1:2:3:4'],
+        ['--sweep=0=1:2:0'],
+        ['--sweep=0=a:2'],
+        ['--sweep=0=0:2', '--jobs=0'],
+        ['--sweep=0=0:2', '--jobs=many'],
+        ['--jobs=2'],
+        ['--sweep=0=0:2', 'first.sl', 'second.sl'],
+        ['--sweep=0=0:2', '--manifest=programs.txt'],
+        ['--sweep=0=0:2', '--dump-optimized'],
+        ['--sweep=0=0:2', '--stream'],
+        ['--sweep=0=0:2', '--profile'],
+        ['--sweep=0=0:2', '--stats'],
+        ['--sweep=0=0:2', '--restart-from=checkpoint'],
+        ['--sweep=0=0:2', '--serve=/tmp/socket'],
+        ['--register=0=1', '--serve=/tmp/socket'],
+    ])
+    def test_sweep_invalid(self, args, capsys):
+        status_code = _main(['progname'] + args)
+        out, err = capsys.readouterr()
+        assert 'usage' in out
+        assert status_code == 1
+
+    @patch('stencil_lang.main.serve')
+    def test_serve(self, mock_serve, capsys):
+        status_code = _main(['progname', '--serve-workers=2',
+                             '--serve=/tmp/socket'])
+        mock_serve.assert_called_once_with('/tmp/socket', 2)
+        assert status_code == 0
+
+    @patch('stencil_lang.main.serve')
+    def test_serve_default_workers(self, mock_serve, capsys):
+        _main(['progname', '--serve=/tmp/socket'])
+        mock_serve.assert_called_once_with('/tmp/socket', DEFAULT_WORKERS)
+
+    def test_serve_socket_error(self, tmpdir, capsys):
+        path = tmpdir.join('missing', 'socket')
+        status_code = _main(['progname', '--serve=%s' % path])
+        out, err = capsys.readouterr()
+        assert out == 'Cannot listen on %s\n' % path
+        assert status_code == 1
+
+    @mark.parametrize('args', [
+        ['--serve='],
+        ['--serve-workers=2'],
+        ['--serve=/tmp/socket', '--serve-workers=0'],
+        ['--serve=/tmp/socket', '--serve-workers=many'],
+        ['--serve=/tmp/socket', 'program.sl'],
+        ['--serve=/tmp/socket', '--manifest=programs.txt'],
+        ['--serve=/tmp/socket', '--stream'],
+        ['--serve=/tmp/socket', '--stats'],
+    ])
+    def test_serve_invalid(self, args, capsys):
+        status_code = _main(['progname'] + args)
+        out, err = capsys.readouterr()
+        assert 'usage' in out
+        assert status_code == 1
+
+    @mark.parametrize('arg', ['--parse-workers=', '--parse-workers=many',
+                              '--parse-workers=0'])
+    def test_parse_workers_invalid(self, arg, capsys):
+        status_code = _main(['progname', arg])
+        out, err = capsys.readouterr()
+        assert 'usage' in out
+        assert status_code == 1
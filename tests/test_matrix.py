@@ -1,8 +1,39 @@
-from pytest import raises, fixture
+import gzip
+import zlib
+from StringIO import StringIO
+
+from pytest import raises, fixture, mark
+from mock import patch
 from rply.errors import LexingError
 
-from stencil_lang.matrix import from_string, from_file
-from stencil_lang.errors import InconsistentMatrixDimensions
+from stencil_lang.matrix import (
+    binary,
+    from_string,
+    from_data,
+    from_file,
+    to_string,
+    to_file,
+)
+from stencil_lang.matrix.convert import convert, _main
+from stencil_lang.matrix.filecache import MatrixFileCache
+from stencil_lang.matrix.printer import write_matrix, stdout
+from stencil_lang.matrix.snapshot import (
+    is_snapshot_filename,
+    snapshot_filename,
+    SnapshotWriter,
+)
+from stencil_lang.matrix.lexer import lex
+from stencil_lang.matrix.parser import parse
+from stencil_lang.matrix.reader import read, MatrixReader
+from stencil_lang.matrix import compressed, npy
+from stencil_lang.matrix.parallel import ParallelReader, split_lines
+from stencil_lang.matrix.prefetch import Prefetcher
+from stencil_lang.errors import (
+    InconsistentMatrixDimensions,
+    InvalidMatrixFileError,
+    MatrixWriteError,
+    ParseError,
+)
 from stencil_lang.structures import Matrix
 
 from tests.helpers import assert_exc_info_msg, fixture_path
@@ -39,11 +70,48 @@ class TestFromString(object):
         with raises(LexingError):
             from_string('ABCD')
 
-    # TODO: cannot test ParsingError because there is nothing that the parser
-    # knows about but doesn't expect (e.g., numbers).
+    def test_empty_line(self):
+        with raises(ParseError) as exc_info:
+            from_string('1 2\n\n3 4\n')
+        assert_exc_info_msg(exc_info, "Unexpected `NEWLINE'")
+
+
+def _outcome(function, text):
+    try:
+        return function(text)
+    except LexingError as error:
+        return ('LexingError', error.getsourcepos().idx)
+    except (ParseError, InconsistentMatrixDimensions) as error:
+        return (type(error).__name__, str(error))
 
 
-@fixture(params=['simple-newline', 'simple-no-newline'])
+class TestReaderMatchesGenerated(object):
+    @mark.parametrize('text', [
+        '',
+        '  \t',
+        '1',
+        '1\n',
+        '1 2 3\n4 5 6',
+        '  -1.5e-3\t2.\r\n3 1.e5 \n',
+        '1-2\n3 4\n',
+        '0.25e4 7e 3\n',
+        '\n',
+        '\n1',
+        '1\n\n',
+        '1 2\n3\n\n',
+        '1 2\n3 4 5\n',
+        '1 2\n3',
+        '1 2\n3 x',
+        '1.5.5',
+        '-',
+        '1 2\n3 4\nABCD',
+    ])
+    def test_same_result(self, text):
+        assert _outcome(read, text) == _outcome(lambda t: parse(lex(t)), text)
+
+
+@fixture(params=[
+    'simple-newline', 'simple-no-newline', 'simple-binary', 'simple-npy'])
 def matrix_name(request):
     return request.param
 
@@ -52,3 +120,839 @@ class TestFromFile(object):
     def test_simple(self, matrix_name):
         assert (from_file(fixture_path(matrix_name)) ==
                 Matrix(2, 2, [11.7, 52, -34, -12.2]))
+
+
+class TestBinary(object):
+    def test_round_trip(self):
+        matrix = Matrix(2, 3, [1.5, -2, 1e300, -0.0, 5e-324, 0.1])
+        assert binary.loads(binary.dumps(matrix)) == matrix
+
+    def test_header(self):
+        data = binary.dumps(Matrix(2, 3, [0.0] * 6))
+        assert data[:4] == binary.MAGIC
+        assert len(data) == binary.HEADER_LENGTH + 6 * 8
+        assert binary.read_header(data) == [2, 3]
+
+    def test_little_endian(self):
+        data = binary.dumps(Matrix(1, 1, [1.0]))
+        assert data[binary.HEADER_LENGTH:] == '\x00' * 6 + '\xf0\x3f'
+
+    def test_empty(self):
+        matrix = Matrix(0, 0, [])
+        assert binary.loads(binary.dumps(matrix)) == matrix
+
+    def test_is_binary(self):
+        assert binary.is_binary(binary.dumps(Matrix(1, 1, [1.0])))
+        assert not binary.is_binary('1 2\n3 4\n')
+
+    def test_missing_magic(self):
+        with raises(InvalidMatrixFileError) as exc_info:
+            binary.loads('1 2\n3 4\n')
+        assert_exc_info_msg(
+            exc_info, 'Invalid binary matrix file: missing magic number')
+
+    def test_truncated_header(self):
+        with raises(InvalidMatrixFileError) as exc_info:
+            binary.loads(binary.MAGIC + '\x01')
+        assert_exc_info_msg(
+            exc_info, 'Invalid binary matrix file: truncated header')
+
+    def test_unsupported_version(self):
+        data = binary.dumps(Matrix(1, 1, [1.0]))
+        with raises(InvalidMatrixFileError) as exc_info:
+            binary.loads(data[:4] + '\x02' + data[5:])
+        assert_exc_info_msg(
+            exc_info, 'Invalid binary matrix file: unsupported version 2')
+
+    def test_unsupported_dtype(self):
+        data = binary.dumps(Matrix(1, 1, [1.0]))
+        with raises(InvalidMatrixFileError) as exc_info:
+            binary.loads(data[:24] + '\x07' + data[25:])
+        assert_exc_info_msg(
+            exc_info,
+            'Invalid binary matrix file: unsupported element type 7')
+
+    def test_truncated_contents(self):
+        data = binary.dumps(Matrix(2, 2, [1.0, 2.0, 3.0, 4.0]))
+        with raises(InvalidMatrixFileError) as exc_info:
+            binary.loads(data[:-8])
+        assert_exc_info_msg(
+            exc_info,
+            'Invalid binary matrix file: '
+            'contents do not match dimensions (2, 2)')
+
+
+class TestFromData(object):
+    def test_text(self):
+        assert from_data('1 2\n') == Matrix(1, 2, [1, 2])
+
+    def test_binary(self):
+        matrix = Matrix(1, 2, [1, 2])
+        assert from_data(binary.dumps(matrix)) == matrix
+
+    def test_npy(self):
+        matrix = Matrix(1, 2, [1, 2])
+        assert from_data(npy.dumps(matrix)) == matrix
+
+
+class TestToString(object):
+    def test_format(self):
+        assert (to_string(Matrix(2, 2, [11.7, 52, -34, -12.2])) ==
+                '11.7 52\n-34 -12.2\n')
+
+    def test_round_trip(self):
+        matrix = Matrix(2, 3, [0.1, 1e300, -2.5e-10, 1e16, 123456789.123, 0])
+        assert from_string(to_string(matrix)) == matrix
+
+    def test_non_finite(self):
+        with raises(ValueError):
+            to_string(Matrix(1, 1, [float('inf')]))
+
+
+class TestToFile(object):
+    @mark.parametrize('filename', ['matrix', 'matrix.slmx', 'matrix.npy'])
+    @mark.parametrize('chunk_size', [1, 7, 1024 * 1024])
+    def test_round_trip(self, tmpdir, filename, chunk_size):
+        matrix = Matrix(3, 2, [0.1, -2, 3e-20, 4, 1e300, 6])
+        path = str(tmpdir.join(filename))
+        with patch('stencil_lang.matrix.WRITE_CHUNK_SIZE', chunk_size):
+            to_file(path, matrix)
+        assert from_file(path) == matrix
+
+    def test_text(self, tmpdir):
+        path = tmpdir.join('matrix')
+        to_file(str(path), Matrix(2, 2, [11.7, 52, -34, -12.2]))
+        assert path.read() == '11.7 52\n-34 -12.2\n'
+
+    def test_binary(self, tmpdir):
+        matrix = Matrix(2, 2, [11.7, 52, -34, -12.2])
+        path = tmpdir.join('matrix.slmx')
+        to_file(str(path), matrix)
+        assert path.read('rb') == binary.dumps(matrix)
+
+    def test_npy(self, tmpdir):
+        path = tmpdir.join('matrix.npy')
+        to_file(str(path), Matrix(2, 2, [11.7, 52, -34, -12.2]))
+        with open(fixture_path('simple-npy'), 'rb') as npy_file:
+            assert path.read('rb') == npy_file.read()
+
+    @mark.parametrize('filename', ['matrix', 'matrix.gz'])
+    def test_non_finite_leaves_file(self, tmpdir, filename):
+        path = tmpdir.join(filename)
+        path.write('old contents')
+        with raises(ValueError):
+            to_file(str(path), Matrix(1, 2, [1, float('nan')]))
+        assert path.read() == 'old contents'
+
+    def test_non_finite_binary(self, tmpdir):
+        matrix = Matrix(1, 2, [float('inf'), -float('inf')])
+        path = str(tmpdir.join('matrix.slmx'))
+        to_file(path, matrix)
+        assert from_file(path) == matrix
+
+
+class TestNpy(object):
+    def test_round_trip(self):
+        matrix = Matrix(2, 3, [1.5, -2, 1e300, -0.0, 5e-324, float('inf')])
+        assert npy.loads(npy.dumps(matrix)) == matrix
+
+    def test_empty(self):
+        assert npy.loads(npy.dumps(Matrix(0, 3, []))) == Matrix(0, 3, [])
+
+    def test_numpy_header(self):
+        # Byte for byte what numpy.save writes for a 2 by 3 float64 array.
+        data = npy.dumps(Matrix(2, 3, [0.0] * 6))
+        header = ("{'descr': '<f8', 'fortran_order': False, "
+                  "'shape': (2, 3), }")
+        assert data[:10] == npy.MAGIC + '\x01\x00\x76\x00'
+        assert data[10:128] == header + ' ' * (117 - len(header)) + '\n'
+        assert len(data) == 128 + 6 * 8
+        assert npy.read_header(data) == [2, 3, 128]
+
+    def test_is_npy(self):
+        assert npy.is_npy(npy.dumps(Matrix(1, 1, [1.0])))
+        assert not npy.is_npy(binary.dumps(Matrix(1, 1, [1.0])))
+        assert not npy.is_npy('1 2\n')
+
+    @mark.parametrize('header', [
+        "{'descr': '<f8', 'fortran_order': False, 'shape': (1, 2)}",
+        '{"shape": (1L, 2L), "fortran_order": False, "descr": "<f8",}',
+        "{ 'descr' : '<f8' , 'fortran_order' : False , 'shape' : ( 1 , 2 ) }",
+    ])
+    def test_header_spelling(self, header):
+        data = (npy.MAGIC + '\x01\x00' + chr(len(header) + 1) + '\x00' +
+                header + '\n' + binary.dumps(Matrix(1, 2, [1.0, 2.0]))[32:])
+        assert npy.loads(data) == Matrix(1, 2, [1.0, 2.0])
+
+    def test_version_2(self):
+        header = "{'descr': '<f8', 'fortran_order': False, 'shape': (1, 1), }"
+        data = (npy.MAGIC + '\x02\x00' + chr(len(header) + 1) + '\x00' * 3 +
+                header + '\n' + '\x00' * 6 + '\xf0\x3f')
+        assert npy.loads(data) == Matrix(1, 1, [1.0])
+
+    def npy_with_header(self, header):
+        return (npy.MAGIC + '\x01\x00' + chr(len(header) + 1) + '\x00' +
+                header + '\n')
+
+    @mark.parametrize(('header', 'reason'), [
+        ("{'descr': '>f8', 'fortran_order': False, 'shape': (1, 1), }",
+         "unsupported .npy element type '>f8'"),
+        ("{'descr': '<i8', 'fortran_order': False, 'shape': (1, 1), }",
+         "unsupported .npy element type '<i8'"),
+        ("{'descr': '<f8', 'fortran_order': True, 'shape': (1, 1), }",
+         'unsupported Fortran order .npy array'),
+        ("{'descr': '<f8', 'fortran_order': False, 'shape': (3,), }",
+         'unsupported 1-dimensional .npy array'),
+        ("{'descr': '<f8', 'fortran_order': False, 'shape': (1, 1, 1), }",
+         'unsupported 3-dimensional .npy array'),
+        ("{'descr': '<f8', 'shape': (1, 1), 'extra': 1}",
+         "unexpected key 'extra' in .npy header"),
+        ("{'descr': '<f8', 'fortran_order': False}", 'malformed .npy header'),
+        ("{'descr': '<f8', 'shape': (1, 1)} 1", 'malformed .npy header'),
+        ("{'descr': '<f8' 'shape': (1, 1)}", 'malformed .npy header'),
+        ("{'descr': '<f8', 'shape': (1, x)}", 'malformed .npy header'),
+        ("{'descr': [('a', '<f8')], 'shape': (1,)}", 'malformed .npy header'),
+    ])
+    def test_invalid_header(self, header, reason):
+        with raises(InvalidMatrixFileError) as exc_info:
+            npy.loads(self.npy_with_header(header) + '\0' * 8)
+        assert_exc_info_msg(
+            exc_info, 'Invalid binary matrix file: ' + reason)
+
+    def test_unsupported_version(self):
+        with raises(InvalidMatrixFileError) as exc_info:
+            npy.loads(npy.MAGIC + '\x04\x00' + '\0' * 8)
+        assert_exc_info_msg(
+            exc_info,
+            'Invalid binary matrix file: unsupported .npy version 4.0')
+
+    @mark.parametrize('length', [6, 9, 20])
+    def test_truncated_header(self, length):
+        with raises(InvalidMatrixFileError) as exc_info:
+            npy.loads(npy.dumps(Matrix(1, 1, [1.0]))[:length])
+        assert_exc_info_msg(
+            exc_info, 'Invalid binary matrix file: truncated header')
+
+    def test_truncated_contents(self):
+        with raises(InvalidMatrixFileError) as exc_info:
+            npy.loads(npy.dumps(Matrix(2, 2, [1.0, 2.0, 3.0, 4.0]))[:-8])
+        assert_exc_info_msg(
+            exc_info,
+            'Invalid binary matrix file: '
+            'contents do not match dimensions (2, 2)')
+
+    @mark.parametrize('size', [1, 7, 1000])
+    def test_decoder(self, size):
+        matrix = Matrix(2, 3, [1.5, -2, 1e300, -0.0, 5e-324, 0.1])
+        decoder = npy.Decoder()
+        for piece in pieces(npy.dumps(matrix), size):
+            decoder.feed(piece)
+        assert decoder.finish() == matrix
+
+    def test_decoder_truncated_header(self):
+        decoder = npy.Decoder()
+        decoder.feed(npy.MAGIC + '\x01')
+        with raises(InvalidMatrixFileError) as exc_info:
+            decoder.finish()
+        assert_exc_info_msg(
+            exc_info, 'Invalid binary matrix file: truncated header')
+
+
+class TestConvert(object):
+    def test_text_to_binary(self):
+        assert (convert('11.7 52\n-34 -12.2\n') ==
+                binary.dumps(Matrix(2, 2, [11.7, 52, -34, -12.2])))
+
+    def test_binary_to_text(self):
+        assert (convert(binary.dumps(Matrix(2, 2, [11.7, 52, -34, -12.2])))
+                == '11.7 52\n-34 -12.2\n')
+
+    def test_main(self, tmpdir):
+        binary_path = str(tmpdir.join('matrix.bin'))
+        text_path = str(tmpdir.join('matrix.txt'))
+        assert _main(['convert', fixture_path('simple-newline'),
+                      binary_path]) == 0
+        assert from_file(binary_path) == Matrix(2, 2, [11.7, 52, -34, -12.2])
+        assert _main(['convert', binary_path, text_path]) == 0
+        assert from_file(text_path) == Matrix(2, 2, [11.7, 52, -34, -12.2])
+
+    def test_main_usage(self, capsys):
+        assert _main(['convert', 'only-one']) == 1
+        out, err = capsys.readouterr()
+        assert out.startswith('usage: convert INPUT_FILENAME OUTPUT_FILENAME')
+
+
+@fixture
+def matrix_path(tmpdir):
+    path = tmpdir.join('matrix')
+    path.write('1 2\n3 4\n')
+    return path
+
+
+class TestMatrixFileCache(object):
+    def test_hit(self, matrix_path):
+        cache = MatrixFileCache(1024)
+        first = cache.read(str(matrix_path))
+        second = cache.read(str(matrix_path))
+        assert first == second == Matrix(2, 2, [1, 2, 3, 4])
+        assert first is not second
+        assert first.contents is second.contents
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert cache.num_bytes() == 32
+
+    def test_replaced_contents_stay_cached(self, matrix_path):
+        cache = MatrixFileCache(1024)
+        matrix = cache.read(str(matrix_path))
+        matrix.contents = [5.0, 6.0, 7.0, 8.0]
+        assert cache.read(str(matrix_path)) == Matrix(2, 2, [1, 2, 3, 4])
+
+    def test_changed_file(self, matrix_path):
+        cache = MatrixFileCache(1024)
+        cache.read(str(matrix_path))
+        matrix_path.write('1 2 3\n')
+        assert cache.read(str(matrix_path)) == Matrix(1, 3, [1, 2, 3])
+        assert cache.misses == 2
+        assert cache.num_bytes() == 24
+
+    def test_changed_mtime(self, matrix_path):
+        cache = MatrixFileCache(1024)
+        cache.read(str(matrix_path))
+        matrix_path.write('5 6\n7 8\n')
+        matrix_path.setmtime(matrix_path.mtime() + 10)
+        assert cache.read(str(matrix_path)) == Matrix(2, 2, [5, 6, 7, 8])
+        assert cache.misses == 2
+
+    def test_evicts_least_recently_used(self, tmpdir):
+        paths = []
+        for i in xrange(3):
+            path = tmpdir.join(str(i))
+            path.write('%d %d\n' % (i, i))
+            paths.append(str(path))
+        cache = MatrixFileCache(32)
+        cache.read(paths[0])
+        cache.read(paths[1])
+        cache.read(paths[0])
+        cache.read(paths[2])
+        assert cache.num_bytes() == 32
+        cache.read(paths[0])
+        cache.read(paths[2])
+        assert (cache.hits, cache.misses) == (3, 3)
+        cache.read(paths[1])
+        assert cache.misses == 4
+
+    def test_too_large(self, matrix_path):
+        cache = MatrixFileCache(31)
+        cache.read(str(matrix_path))
+        cache.read(str(matrix_path))
+        assert (cache.hits, cache.misses) == (0, 2)
+        assert cache.num_bytes() == 0
+
+    def test_set_budget(self, matrix_path):
+        cache = MatrixFileCache(1024)
+        cache.read(str(matrix_path))
+        cache.set_budget(0)
+        assert cache.num_bytes() == 0
+        cache.read(str(matrix_path))
+        assert cache.misses == 2
+
+    def test_discard(self, matrix_path):
+        cache = MatrixFileCache(1024)
+        cache.read(str(matrix_path))
+        cache.discard(str(matrix_path))
+        cache.discard('not-cached')
+        assert cache.num_bytes() == 0
+        cache.read(str(matrix_path))
+        assert cache.misses == 2
+
+    def test_clear(self, matrix_path):
+        cache = MatrixFileCache(1024)
+        cache.read(str(matrix_path))
+        cache.clear()
+        assert cache.num_bytes() == 0
+        cache.read(str(matrix_path))
+        assert cache.misses == 2
+
+
+class ListStream(object):
+    def __init__(self):
+        self.writes = []
+
+    def write(self, text):
+        self.writes.append(text)
+
+
+@fixture(params=[
+    Matrix(1, 1, [2]),
+    Matrix(2, 2, [11.7, 52, -34, -12.2]),
+    Matrix(2, 3, [-0.5, 0.25, 100, 1e-7, -3, 7.125]),
+    Matrix(3, 1, [1, -1, 0]),
+    Matrix(2, 2, []),
+])
+def printed_matrix(request):
+    return request.param
+
+
+class TestWriteMatrix(object):
+    def test_bracketed(self, printed_matrix):
+        stream = ListStream()
+        write_matrix(stream, printed_matrix, True)
+        assert (''.join(stream.writes) ==
+                printed_matrix.as_bracketed_string() + '\n')
+
+    def test_plain(self, printed_matrix):
+        stream = ListStream()
+        write_matrix(stream, printed_matrix, False)
+        assert (''.join(stream.writes) ==
+                printed_matrix.as_plain_string() + '\n')
+
+    def test_chunks(self):
+        matrix = Matrix(3, 2, [1.5, -2, 3, 4.25, 5, 6])
+        stream = ListStream()
+        with patch('stencil_lang.matrix.printer.CHUNK_SIZE', 1):
+            write_matrix(stream, matrix, True)
+        assert stream.writes == [
+            '[[  1.5  -2    ]\n',
+            ' [  3     4.25 ]\n',
+            ' [  5     6    ]]\n',
+        ]
+
+    def test_stdout(self, capsys):
+        write_matrix(stdout, Matrix(1, 2, [1, 2]), True)
+        out, err = capsys.readouterr()
+        assert out == '[[ 1 2 ]]\n'
+
+    def test_stdout_partial_writes(self):
+        writes = []
+
+        def write(fd, text):
+            # Like a full pipe, take at most three bytes at a time.
+            writes.append(text[:3])
+            return len(text[:3])
+        with patch('stencil_lang.matrix.printer.we_are_translated',
+                   return_value=True):
+            with patch('stencil_lang.matrix.printer.os.write', write):
+                write_matrix(stdout, Matrix(1, 2, [1, 2]), True)
+        assert ''.join(writes) == '[[ 1 2 ]]\n'
+
+
+class TestSnapshotFilename(object):
+    @mark.parametrize(('filename', 'number', 'expected'), [
+        ('frame.slmx', 3, 'frame.000003.slmx'),
+        ('frame', 12, 'frame.000012'),
+        ('frames/frame.txt', 0, 'frames/frame.000000.txt'),
+        ('frames.d/frame', 1, 'frames.d/frame.000001'),
+        ('.frame', 1, '.frame.000001'),
+        ('frame', 1234567, 'frame.1234567'),
+        ('frame.slmx.gz', 3, 'frame.000003.slmx.gz'),
+        ('frame.gz', 3, 'frame.000003.gz'),
+    ])
+    def test_snapshot_filename(self, filename, number, expected):
+        assert snapshot_filename(filename, number) == expected
+
+    @mark.parametrize(('filename', 'snap_filename'), [
+        ('frame.000003.slmx', 'frame.slmx'),
+        ('frame.1234567', 'frame'),
+        ('frames/frame.000000.txt', 'frames/frame.txt'),
+        ('.frame.000001', '.frame'),
+        ('frame.000003.slmx.gz', 'frame.slmx.gz'),
+    ])
+    def test_is_snapshot_filename(self, filename, snap_filename):
+        assert is_snapshot_filename(filename, snap_filename)
+
+    @mark.parametrize(('filename', 'snap_filename'), [
+        ('frame.slmx', 'frame.slmx'),
+        ('frame.00003.slmx', 'frame.slmx'),
+        ('frame.00000a.slmx', 'frame.slmx'),
+        ('frame.000003.slmx', 'frame.npy'),
+        ('frame.000003.slmx', 'other.slmx'),
+        ('frame.000003.slmx.gz', 'frame.slmx'),
+        ('frame', 'frame'),
+    ])
+    def test_is_not_snapshot_filename(self, filename, snap_filename):
+        assert not is_snapshot_filename(filename, snap_filename)
+
+
+class TestSnapshotWriter(object):
+    def test_close_without_snapshots(self):
+        SnapshotWriter(1).close()
+
+    def test_restarts_after_close(self, tmpdir):
+        writer = SnapshotWriter(1)
+        filename = str(tmpdir.join('frame'))
+        assert writer.put(0, filename, Matrix(1, 1, [1])) == filename + \
+            '.000000'
+        writer.close()
+        assert writer.put(0, filename, Matrix(1, 1, [2])) == filename + \
+            '.000001'
+        writer.close()
+        assert tmpdir.join('frame.000000').read() == '1\n'
+        assert tmpdir.join('frame.000001').read() == '2\n'
+
+    def test_error(self, tmpdir):
+        writer = SnapshotWriter(1)
+        writer.put(5, str(tmpdir.join('missing', 'frame')),
+                   Matrix(1, 1, [1]))
+        with raises(MatrixWriteError) as exc_info:
+            writer.close()
+        assert_exc_info_msg(
+            exc_info, 'Cannot write matrix 5: cannot write ' +
+            str(tmpdir.join('missing', 'frame.000000')))
+        # Later snapshots raise it too, instead of going unwritten silently.
+        with raises(MatrixWriteError):
+            writer.put(0, str(tmpdir.join('frame')), Matrix(1, 1, [1]))
+
+
+def pieces(data, size):
+    return [data[i:i + size] for i in xrange(0, len(data), size)]
+
+
+class TestMatrixReader(object):
+    @mark.parametrize('size', [1, 2, 5, 100])
+    def test_pieces(self, size):
+        reader = MatrixReader()
+        for piece in pieces('1 -2.5 3e2\n4 5 6\n7 8 9', size):
+            reader.feed(piece)
+        assert reader.finish() == Matrix(
+            3, 3, [1, -2.5, 300, 4, 5, 6, 7, 8, 9])
+
+    def test_nothing(self):
+        assert MatrixReader().finish() == Matrix(0, 0, [])
+
+    def test_error_position(self):
+        reader = MatrixReader()
+        reader.feed('1 2\n')
+        with raises(LexingError) as exc_info:
+            reader.feed('3 x\n')
+        assert exc_info.value.source_pos.idx == 6
+
+    def test_inconsistent(self):
+        reader = MatrixReader()
+        reader.feed('1 2\n3')
+        with raises(InconsistentMatrixDimensions):
+            reader.finish()
+
+
+class TestBinaryDecoder(object):
+    @mark.parametrize('size', [1, 7, 33, 1000])
+    def test_pieces(self, size):
+        matrix = Matrix(2, 3, [1.5, -2, 1e300, -0.0, 5e-324, 0.1])
+        decoder = binary.Decoder()
+        for piece in pieces(binary.dumps(matrix), size):
+            decoder.feed(piece)
+        assert decoder.finish() == matrix
+
+    def test_truncated_header(self):
+        decoder = binary.Decoder()
+        decoder.feed(binary.MAGIC)
+        with raises(InvalidMatrixFileError) as exc_info:
+            decoder.finish()
+        assert_exc_info_msg(
+            exc_info, 'Invalid binary matrix file: truncated header')
+
+    def test_truncated_contents(self):
+        decoder = binary.Decoder()
+        decoder.feed(binary.dumps(Matrix(1, 2, [1.0, 2.0]))[:-1])
+        with raises(InvalidMatrixFileError) as exc_info:
+            decoder.finish()
+        assert_exc_info_msg(
+            exc_info,
+            'Invalid binary matrix file: '
+            'contents do not match dimensions (1, 2)')
+
+
+def gzip_compress(data):
+    buf = StringIO()
+    with gzip.GzipFile(mode='wb', fileobj=buf) as gzip_file:
+        gzip_file.write(data)
+    return buf.getvalue()
+
+
+class TestCompressed(object):
+    MATRIX = Matrix(2, 2, [11.7, 52, -34, -12.2])
+
+    @mark.parametrize('data', [
+        zlib.compress('1 2\n'),
+        zlib.compress('1 2\n', 9),
+        zlib.compress('1 2\n', 1),
+        gzip_compress('1 2\n'),
+    ])
+    def test_is_compressed(self, data):
+        assert compressed.is_compressed(data)
+
+    @mark.parametrize('data', [
+        '', '1', '1 2\n', '80 1\n', '-1', ' 8', '\n', binary.MAGIC])
+    def test_is_not_compressed(self, data):
+        assert not compressed.is_compressed(data)
+
+    @mark.parametrize('compress', [zlib.compress, gzip_compress])
+    def test_from_file(self, tmpdir, matrix_name, compress):
+        path = tmpdir.join('matrix')
+        with open(fixture_path(matrix_name), 'rb') as matrix_file:
+            path.write(compress(matrix_file.read()), 'wb')
+        assert from_file(str(path)) == self.MATRIX
+
+    def test_from_file_in_pieces(self, tmpdir):
+        path = tmpdir.join('matrix')
+        path.write(zlib.compress(binary.dumps(self.MATRIX)), 'wb')
+        with patch('stencil_lang.matrix.compressed.READ_CHUNK_SIZE', 3):
+            assert from_file(str(path)) == self.MATRIX
+
+    def test_highly_compressible(self):
+        # Like a 10 MB matrix file of zeros which compresses to about 10 KB,
+        # scaled down since rzlib is slow untranslated: a single piece of
+        # compressed bytes is still decompressed a piece at a time.
+        data = binary.MAGIC + '\0' * (16 * 1024)
+        pieces = []
+        with patch('stencil_lang.matrix.compressed.READ_CHUNK_SIZE', 1024):
+            with patch.object(compressed._Decoder, 'feed',
+                              lambda decoder, piece: pieces.append(piece)):
+                with patch.object(compressed._Decoder, 'finish'):
+                    compressed.loads(zlib.compress(data, 9))
+        assert max(len(piece) for piece in pieces) == 1024
+        assert ''.join(pieces) == data
+
+    def test_from_data(self):
+        assert from_data(zlib.compress('1 2\n')) == Matrix(1, 2, [1, 2])
+
+    def test_truncated(self):
+        with raises(InvalidMatrixFileError) as exc_info:
+            from_data(zlib.compress('1 2\n3 4\n')[:-3])
+        assert_exc_info_msg(
+            exc_info,
+            'Invalid binary matrix file: truncated compressed data')
+
+    def test_corrupt(self):
+        data = zlib.compress('1 2\n3 4\n')
+        with raises(InvalidMatrixFileError) as exc_info:
+            from_data(data[:2] + '\xff' * (len(data) - 2))
+        assert str(exc_info.value).startswith(
+            'Invalid binary matrix file: corrupt compressed data: ')
+
+    @mark.parametrize('filename',
+                      ['matrix.gz', 'matrix.slmx.gz', 'matrix.npy.gz'])
+    def test_to_file(self, tmpdir, filename):
+        path = tmpdir.join(filename)
+        to_file(str(path), self.MATRIX)
+        assert from_file(str(path)) == self.MATRIX
+        with gzip.open(str(path)) as gzip_file:
+            data = gzip_file.read()
+        if filename == 'matrix.gz':
+            assert data == to_string(self.MATRIX)
+        elif filename == 'matrix.npy.gz':
+            assert data == npy.dumps(self.MATRIX)
+        else:
+            assert data == binary.dumps(self.MATRIX)
+
+    def test_uncompressed_filename(self):
+        assert compressed.uncompressed_filename('a.slmx.gz') == 'a.slmx'
+        assert compressed.uncompressed_filename('a.slmx') == 'a.slmx'
+
+
+class TestSplitLines(object):
+    def test_split(self):
+        assert split_lines('1\n2\n3\n4\n', 2) == [0, 4, 8]
+
+    def test_long_line(self):
+        assert split_lines('1 2 3 4 5 6\n7\n', 3) == [0, 12, 14]
+
+    def test_no_newline(self):
+        assert split_lines('1 2 3', 4) == [0, 5]
+
+    def test_empty(self):
+        assert split_lines('', 4) == [0]
+
+
+@fixture
+def parallel_reader():
+    return ParallelReader(3, 0)
+
+
+class TestParallelReader(object):
+    @mark.parametrize('text', [
+        '',
+        '1\n',
+        '1 2\n3 4\n5 6\n7 8\n9 10\n11 12\n',
+        '1 2\n3 4\n5 6\n7 8\n9 10\n11 12',
+        '1.5 -2e3 4\n' * 20 + '  \t ',
+    ])
+    def test_same_as_read(self, parallel_reader, text):
+        assert parallel_reader.read(text) == read(text)
+
+    @mark.parametrize('text', [
+        '1 2\n3 4\n5 6\n7 8\n9 x\n11 12\n',
+        '1 2\n3 4\n5 6\n7 8\n9\n11 12\n',
+        '1 2\n3 4\n5 6\n7 8 9\n10 11 12\n13 x\n',
+        '1 2 3\n4 5 6\n7 8 9\n10 11 12\n\n13 14 15\n',
+        '1 2\n3 4\n5 6\n7 8\n9 10\n11 12\n13\n14 15\n',
+        '1 2\n3 4\n5 6\n7 8\n9 10\n11 12\n13 x 14\n',
+        'x\n1 2\n3 4\n5 6\n7 8\n9 10\n',
+    ])
+    def test_same_errors_as_read(self, parallel_reader, text):
+        with raises(Exception) as expected:
+            read(text)
+        with raises(expected.type) as exc_info:
+            parallel_reader.read(text)
+        assert str(exc_info.value) == str(expected.value)
+        if expected.type is LexingError:
+            assert (exc_info.value.getsourcepos().idx ==
+                    expected.value.getsourcepos().idx)
+
+    def test_below_threshold(self):
+        parallel_reader = ParallelReader(3, 100)
+        with patch('os.fork') as mock_fork:
+            assert parallel_reader.read('1 2\n3 4\n') == Matrix(
+                2, 2, [1, 2, 3, 4])
+        assert not mock_fork.called
+
+    def test_fork_fails(self, parallel_reader):
+        with patch('os.fork', side_effect=OSError):
+            assert parallel_reader.read('1 2\n3 4\n') == Matrix(
+                2, 2, [1, 2, 3, 4])
+
+    @patch('stencil_lang.matrix.parallel_reader', ParallelReader(2, 0))
+    def test_from_file(self, tmpdir):
+        path = tmpdir.join('matrix')
+        path.write('1 2\n3 4\n5 6\n')
+        assert from_file(str(path)) == Matrix(3, 2, [1, 2, 3, 4, 5, 6])
+
+
+class TestPrefetcher(object):
+    MATRIX = Matrix(2, 2, [11.7, 52, -34, -12.2])
+
+    @fixture
+    def matrix_file(self, tmpdir):
+        path = tmpdir.join('matrix')
+        path.write('11.7 52\n-34 -12.2\n')
+        return str(path)
+
+    @fixture
+    def prefetcher(self):
+        prefetcher = Prefetcher(2)
+        yield prefetcher
+        prefetcher.close()
+
+    def test_take(self, prefetcher, matrix_file, tmpdir):
+        other = tmpdir.join('other')
+        other.write('1\n')
+        prefetcher.start([matrix_file, str(other)])
+        assert prefetcher.take(matrix_file) == self.MATRIX
+        assert prefetcher.take(str(other)) == Matrix(1, 1, [1])
+        assert prefetcher.taken == 2
+        # Each file is only taken once.
+        assert prefetcher.take(matrix_file) is None
+
+    def test_not_prefetched(self, prefetcher, matrix_file):
+        assert prefetcher.take(matrix_file) is None
+
+    def test_locks_allocated_by_start(self, prefetcher, matrix_file):
+        assert prefetcher._mutex is None
+        prefetcher.discard(matrix_file)
+        prefetcher.close()
+        prefetcher.start([matrix_file])
+        assert prefetcher._mutex is not None
+        assert prefetcher.take(matrix_file) == self.MATRIX
+
+    def test_close_after_finished(self, prefetcher, matrix_file, tmpdir):
+        prefetcher.start([matrix_file])
+        assert prefetcher.take(matrix_file) == self.MATRIX
+        # Wait for the reader to exit, which leaves the event set.
+        prefetcher._finished.wait()
+        prefetcher._finished.set()
+        other = tmpdir.join('other')
+        other.write('1\n')
+        prefetcher.start([str(other)])
+        finished = prefetcher._finished
+        with patch.object(finished, 'wait', wraps=finished.wait) as wait:
+            prefetcher.close()
+        # The event left set by the first reader doesn't wake close before
+        # the second reader has finished.
+        assert prefetcher._running == 0
+        assert wait.call_count <= 1
+
+    def test_cleanup_forgets_locks(self, prefetcher, matrix_file):
+        prefetcher.start([matrix_file])
+        prefetcher._cleanup_()
+        assert prefetcher._mutex is None
+        assert prefetcher.take(matrix_file) is None
+
+    def test_over_budget(self, prefetcher, matrix_file, tmpdir):
+        other = tmpdir.join('other')
+        other.write('1\n')
+        # Room for the one-real matrix but not for the four-real one.
+        with patch('stencil_lang.matrix.prefetch.file_cache',
+                   MatrixFileCache(8)):
+            prefetcher.start([str(other), matrix_file])
+            for filename in [str(other), matrix_file]:
+                entry = prefetcher._entries[filename]
+                entry.ready.wait()
+                entry.ready.set()
+            assert prefetcher._num_bytes == 8
+            assert prefetcher.take(matrix_file) is None
+            assert prefetcher.take(str(other)) == Matrix(1, 1, [1])
+        assert prefetcher._num_bytes == 0
+
+    def test_discard_frees_budget(self, prefetcher, matrix_file):
+        prefetcher.start([matrix_file])
+        entry = prefetcher._entries[matrix_file]
+        entry.ready.wait()
+        entry.ready.set()
+        assert prefetcher._num_bytes == 32
+        prefetcher.discard(matrix_file)
+        assert prefetcher._num_bytes == 0
+
+    def test_disabled(self, matrix_file):
+        prefetcher = Prefetcher(0)
+        prefetcher.start([matrix_file])
+        assert prefetcher.take(matrix_file) is None
+
+    def test_same_file_twice(self, prefetcher, matrix_file):
+        prefetcher.start([matrix_file, matrix_file])
+        assert prefetcher.take(matrix_file) == self.MATRIX
+        assert prefetcher.take(matrix_file) is None
+
+    def test_changed_while_read(self, prefetcher, matrix_file):
+        def read_then_change(filename):
+            matrix = from_file(filename)
+            with open(filename, 'a') as matrix_file:
+                matrix_file.write('1 2\n')
+            return matrix
+        with patch('stencil_lang.matrix.prefetch.from_file',
+                   side_effect=read_then_change):
+            prefetcher.start([matrix_file])
+            assert prefetcher.take(matrix_file) is None
+
+    def test_unreadable(self, prefetcher, tmpdir):
+        path = tmpdir.join('invalid')
+        path.write('1 2\n3\n')
+        missing = str(tmpdir.join('missing'))
+        prefetcher.start([str(path), missing])
+        assert prefetcher.take(str(path)) is None
+        assert prefetcher.take(missing) is None
+
+    def test_discard(self, prefetcher, matrix_file):
+        prefetcher.start([matrix_file])
+        prefetcher.discard(matrix_file)
+        assert prefetcher.take(matrix_file) is None
+
+    def test_adds_to_file_cache(self, prefetcher, matrix_file):
+        cache = MatrixFileCache(1024)
+        with patch('stencil_lang.matrix.prefetch.file_cache', cache):
+            prefetcher.start([matrix_file])
+            prefetcher.take(matrix_file)
+        assert cache.read(matrix_file) == self.MATRIX
+        assert cache.hits == 1
+        assert cache.misses == 0
+
+    def test_close(self, prefetcher, tmpdir):
+        filenames = []
+        for i in xrange(10):
+            path = tmpdir.join(str(i))
+            path.write('%d\n' % i)
+            filenames.append(str(path))
+        prefetcher.start(filenames)
+        prefetcher.close()
+        assert prefetcher._running == 0
+        assert prefetcher.take(filenames[-1]) is None
+        # Prefetching starts again after closing.
+        prefetcher.start(filenames)
+        assert prefetcher.take(filenames[-1]) == Matrix(1, 1, [9])
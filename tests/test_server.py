@@ -0,0 +1,232 @@
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+from pytest import fixture, mark
+
+from stencil_lang.server import (
+    PROGRAM,
+    OUTPUT,
+    ERROR,
+    END,
+    MAX_PROGRAM_LENGTH,
+    encode_frame,
+    handle,
+)
+from stencil_lang.client import submit, _main
+
+
+def output_of(frames):
+    return ''.join(payload for kind, payload in frames if kind == OUTPUT)
+
+
+def read_frames(sock):
+    data = ''
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    frames = []
+    while data:
+        length = struct.unpack('<I', data[1:5])[0]
+        frames.append((data[0], data[5:5 + length]))
+        data = data[5 + length:]
+    return frames
+
+
+def answer(capsys, request):
+    client, server = socket.socketpair()
+    try:
+        client.sendall(request)
+        client.shutdown(socket.SHUT_WR)
+        # The program prints to sys.stdout, which is captured by pytest
+        # instead of going to the file descriptor handed to the program.
+        with capsys.disabled():
+            handle(server.fileno())
+    finally:
+        server.close()
+    try:
+        return read_frames(client)
+    finally:
+        client.close()
+
+
+class TestEncodeFrame(object):
+    def test_encode(self):
+        assert encode_frame(OUTPUT, 'abc') == 'O\x03\x00\x00\x00abc'
+
+    def test_empty(self):
+        assert encode_frame(END, '') == 'X\x00\x00\x00\x00'
+
+
+class TestHandle(object):
+    def test_output(self, capsys):
+        frames = answer(
+            capsys, encode_frame(PROGRAM, 'STO 0 1\nPR 0\nPR 0\n'))
+        assert output_of(frames) == '1\n1\n'
+        assert frames[-1] == (END, '')
+        assert ERROR not in [kind for kind, payload in frames]
+
+    def test_error(self, capsys):
+        frames = answer(
+            capsys, encode_frame(PROGRAM, 'STO 0 1\nPR 0\nPR 1\n'))
+        # Output is sent as it is read, in pieces of any length.
+        assert output_of(frames) == '1\n'
+        assert frames[-2:] == [
+            (ERROR, 'UninitializedVariableError: '
+             'Register 1 is not initialized. Please STO first.'),
+            (END, ''),
+        ]
+
+    def test_os_error(self, tmpdir, capsys):
+        missing = tmpdir.join('missing')
+        frames = answer(capsys, encode_frame(
+            PROGRAM, 'CMX 0 1 1\nSMXF 0 "%s"\n' % missing))
+        assert frames == [
+            (ERROR, 'OSError: No such file or directory'),
+            (END, ''),
+        ]
+
+    def test_parse_error(self, capsys):
+        assert answer(capsys, encode_frame(PROGRAM, '')) == [
+            (ERROR, "ParseError: Unexpected `$end'"), (END, '')]
+
+    @mark.parametrize('data', [
+        encode_frame(OUTPUT, ''),
+        PROGRAM + struct.pack('<I', MAX_PROGRAM_LENGTH + 1),
+    ])
+    def test_invalid_request(self, data, capsys):
+        assert answer(capsys, data) == [
+            (ERROR, 'invalid request'), (END, '')]
+
+    def test_truncated_request(self, capsys):
+        assert answer(capsys, encode_frame(PROGRAM, 'PR 0\n')[:-1]) == []
+
+
+def start_server(path):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'stencil_lang.main', '--serve=' + path,
+         '--serve-workers=2'])
+    # Wait for the server to start listening.
+    for _ in xrange(600):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+            break
+        except socket.error:
+            time.sleep(0.1)
+        finally:
+            sock.close()
+    return process
+
+
+def stat_fields(pid):
+    """Fields of /proc/PID/stat after the command name, which may contain
+    spaces, or None if the process is gone or a zombie."""
+    try:
+        with open('/proc/%d/stat' % pid) as stat_file:
+            stat = stat_file.read()
+    except IOError:
+        return None
+    fields = stat[stat.rindex(')') + 2:].split()
+    if fields[0] == 'Z':
+        return None
+    return fields
+
+
+def workers_of(pid):
+    """Process ids of the live workers of a server. RPython also keeps a
+    helper process of its own."""
+    pids = []
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            fields = stat_fields(int(name))
+            if fields is None or int(fields[1]) != pid:
+                continue
+            with open('/proc/%s/cmdline' % name) as cmdline_file:
+                if '--serve=' in cmdline_file.read():
+                    pids.append(int(name))
+    return pids
+
+
+def wait_until(predicate):
+    for _ in xrange(100):
+        if predicate():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+@fixture
+def server(tmpdir):
+    path = str(tmpdir.join('socket'))
+    process = start_server(path)
+    try:
+        yield path
+    finally:
+        process.terminate()
+        process.wait()
+        assert wait_until(lambda: not os.path.exists(path))
+
+
+class TestServe(object):
+    @mark.parametrize('kill', [
+        lambda process: process.terminate(),
+        lambda process: process.kill(),
+    ])
+    def test_workers_exit_with_server(self, tmpdir, kill):
+        path = str(tmpdir.join('socket'))
+        process = start_server(path)
+        try:
+            # The socket is listening before the workers are forked.
+            assert wait_until(lambda: len(workers_of(process.pid)) == 2)
+            workers = workers_of(process.pid)
+        finally:
+            kill(process)
+            process.wait()
+        # Killing only the server still stops its workers.
+        assert wait_until(lambda: all(stat_fields(worker) is None
+                                      for worker in workers))
+        assert not os.path.exists(path)
+
+    def test_submit(self, server):
+        assert submit(server, 'STO 0 2\nPR 0\n') == ('2\n', '')
+        assert submit(server, 'PR 0\n') == (
+            '', 'UninitializedVariableError: '
+            'Register 0 is not initialized. Please STO first.')
+
+    def test_submit_concurrently(self, server):
+        # More programs than workers wait to be accepted.
+        sockets = []
+        for i in xrange(4):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(server)
+            sock.sendall(encode_frame(PROGRAM, 'STO 0 %d\nPR 0\n' % i))
+            sockets.append(sock)
+        for i, sock in enumerate(sockets):
+            frames = read_frames(sock)
+            assert output_of(frames) == '%d\n' % i
+            assert frames[-1] == (END, '')
+            sock.close()
+
+    def test_client(self, server, tmpdir, capsys):
+        source = tmpdir.join('program.sl')
+        source.write('STO 0 3\nPR 0\nPR 1\n')
+        status_code = _main(['progname', server, str(source)])
+        out, err = capsys.readouterr()
+        assert out == '3\n'
+        assert err == ('UninitializedVariableError: '
+                       'Register 1 is not initialized. Please STO first.\n')
+        assert status_code == 1
+
+
+class TestClient(object):
+    def test_usage(self, capsys):
+        status_code = _main(['progname'])
+        out, err = capsys.readouterr()
+        assert 'usage' in out
+        assert status_code == 1
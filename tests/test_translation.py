@@ -0,0 +1,14 @@
+from rpython.translator.interactive import Translation
+
+from stencil_lang.main import target
+
+
+class TestTranslation(object):
+    def test_annotate_and_rtype(self):
+        # Code which only runs untranslated can't show an RPython error, so
+        # check that the whole interpreter still goes through the first
+        # stages of translation. Compiling it to C takes far longer.
+        entry_point = target()[0]
+        translation = Translation(entry_point, [[str]], thread=True)
+        translation.annotate()
+        translation.rtype()
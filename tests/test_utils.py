@@ -1,4 +1,4 @@
-from stencil_lang.utils import rjust, ljust
+from stencil_lang.utils import rjust, ljust, format_real
 
 
 class TestRjust(object):
@@ -21,3 +21,21 @@ class TestLjust(object):
 
     def test_width_smaller_than_text_size(self):
         assert ljust('hello there', 5) == 'hello there'
+
+
+class TestFormatReal(object):
+    def test_integral(self):
+        assert format_real(42.0) == '42'
+
+    def test_shortest_exact(self):
+        assert format_real(0.1 + 0.2) == '0.30000000000000004'
+
+    def test_exponent_without_plus(self):
+        assert format_real(-1e20) == '-1e20'
+
+    def test_negative_exponent(self):
+        assert format_real(1e-5) == '1e-05'
+
+    def test_infinity(self):
+        assert format_real(float('inf')) == '1e999'
+        assert format_real(float('-inf')) == '-1e999'